@@ -0,0 +1,9 @@
+# benchmarks/__init__.py
+# ============================================================
+# Benchmarks de core con datos sintéticos
+# - generadores: Parcelas, IT04, RVC y Cavanet reproducibles, de
+#   10k a 5M pesadas, como DataFrame y como xlsx/CSV.
+# - casos: las funciones públicas de core que se miden.
+# - python -m benchmarks: tiempos, filas/s y pico de memoria por
+#   caso y escala en JSON, comparables con una ejecución anterior.
+# ============================================================
@@ -0,0 +1,100 @@
+# benchmarks/__main__.py
+# ============================================================
+# Línea de órdenes: mide los casos a varias escalas
+# - Tiempo (mínimo y mediana de -r repeticiones), CPU, filas/s y
+#   pico de memoria por caso y escala (benchmarks.medicion).
+# - Resultado en JSON (línea base). Con --comparar, cada caso se
+#   compara con la base; con alguna regresión o error, código 1.
+# - Cada escala, en un proceso aparte. 5M pesadas ocupan ~2,6 GB
+#   solo de entradas sintéticas: a esa escala los casos con
+#   archivos se omiten (--max-archivos) y del reparto en adelante
+#   hacen falta más de 6 GB de RAM.
+#
+# Uso: python -m benchmarks -e 10k 100k 1m -r 3 -o base.json
+#      python -m benchmarks -e 100k --comparar base.json -c "rvc.*"
+# ============================================================
+
+from __future__ import annotations
+import argparse
+import fnmatch
+import json
+import sys
+from datetime import datetime
+from typing import List, Optional
+
+import pandas as pd
+
+from core.telemetria import entorno
+
+from .casos import CASOS
+from .generadores import escala
+from .medicion import comparar, ejecutar
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks',
+        description="Tiempos y memoria de las funciones de core con datos sintéticos."
+    )
+    parser.add_argument('-e', '--escalas', nargs='+', default=['10k', '100k'],
+                        help="Nº de pesadas: 10k, 100k, 1m, 5m...")
+    parser.add_argument('-r', '--repeticiones', type=int, default=3)
+    parser.add_argument('-c', '--casos', nargs='+', default=['*'],
+                        help="Patrones de nombre de caso (p. ej. 'rvc.*' '*excel*')")
+    parser.add_argument('--max-archivos', default='200k',
+                        help="Pesadas máximas para los casos que leen o escriben xlsx/CSV")
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--sin-memoria', action='store_true', help="No medir el pico de memoria (tracemalloc)")
+    parser.add_argument('-o', '--salida', default='benchmark.json', help="JSON con los resultados")
+    parser.add_argument('--comparar', metavar='BASE', help="JSON de una ejecución anterior")
+    parser.add_argument('--tolerancia', type=float, default=0.25,
+                        help="Margen sobre la base antes de marcar una regresión (0.25 = 25 %%)")
+    parser.add_argument('--listar', action='store_true', help="Solo listar los casos")
+    args = parser.parse_args(argv)
+
+    casos = [c for c in CASOS if any(fnmatch.fnmatchcase(c.nombre, p) for p in args.casos)]
+    if args.listar or not casos:
+        for c in casos:
+            print(f"{c.grupo:<12} {c.nombre}{'  (archivo)' if c.archivo else ''}")
+        return 0 if casos else 1
+    escalas = [escala(e) for e in args.escalas]
+
+    def informar(fila):
+        if fila['error']:
+            detalle = f"ERROR {fila['error']}"
+        else:
+            memoria = '' if fila['memoria_pico_mb'] is None else f"{fila['memoria_pico_mb']:>9.1f} MB"
+            velocidad = '' if fila['filas_por_s'] is None else f"{fila['filas_por_s']:>14,.0f} filas/s"
+            detalle = f"{fila['segundos_min']:>9.4f} s (mediana {fila['segundos_mediana']:.4f}) {velocidad} {memoria}"
+        print(f"{fila['n_pesadas']:>10,} {fila['caso']:<66} {detalle}", flush=True)
+
+    resultados = ejecutar(casos, escalas, args.repeticiones, args.semilla, escala(args.max_archivos),
+                          not args.sin_memoria, al_medir=informar)
+    informe = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'entorno': entorno(),
+        'parametros': {'escalas': escalas, 'repeticiones': args.repeticiones, 'semilla': args.semilla,
+                       'max_archivos': escala(args.max_archivos), 'memoria': not args.sin_memoria},
+        'resultados': resultados,
+    }
+    with open(args.salida, 'w', encoding='utf-8') as f:
+        json.dump(informe, f, ensure_ascii=False, indent=2)
+    errores = sum(bool(r['error']) for r in resultados)
+    print(f"{len(resultados) - errores}/{len(resultados)} casos medidos; resultados en {args.salida}")
+
+    if not args.comparar:
+        return 1 if errores else 0
+    with open(args.comparar, 'r', encoding='utf-8') as f:
+        base = json.load(f)
+    if base.get('entorno') != informe['entorno']:
+        print(f"Aviso: la base se midió en otro entorno ({base.get('entorno')}).")
+    tabla = comparar(resultados, base.get('resultados', []), args.tolerancia)
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(tabla.to_string(index=False))
+    regresiones = int(tabla['regresion'].sum())
+    print(f"{regresiones} regresiones (tolerancia {args.tolerancia:.0%}) en {len(tabla)} casos comparados.")
+    return 1 if regresiones or errores else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,300 @@
+# benchmarks/casos.py
+# ============================================================
+# Casos medidos: funciones públicas de core con entradas sintéticas
+# - Los datos de cada escala son etapas (core.pipeline.Etapa) que
+#   parten de generadores.generar: Parcelas normalizadas, cruces,
+#   repartos... se calculan una vez, cuando algún caso los pide, y
+#   fuera del tiempo medido (Datos).
+# - Un caso = función de core + las etapas de datos que recibe.
+#   Orden: lectura, Parcelas/IT04, RVC, Cavanet y flujos completos,
+#   con los casos de una misma entrada seguidos: cada salida se
+#   olvida cuando ningún caso pendiente la necesita (a 5M pesadas
+#   no caben todas a la vez).
+# - `archivo=True`: el caso lee o escribe xlsx/CSV. Una hoja de
+#   Excel admite 1.048.576 filas y openpyxl tarda minutos por
+#   millón: se limitan con --max-archivos.
+# - Fuera: helpers escalares (norm_*, find_col...), resolución de
+#   esquemas, catálogo de variedades e infraestructura (pipeline,
+#   telemetria, trabajos, lote); se miden a través de los casos.
+# ============================================================
+
+from __future__ import annotations
+import atexit
+import os
+import shutil
+import tempfile
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from core import cache, categorias, cavanet, escenarios, esquema, export, flujos, it04, lectura, parcelas, reparto, rvc, utils
+from core.cavanet import AGRUPAR_POR_EJERCICIO_DEFAULT, RENDIMIENTO_POR_HECTAREA_DEFAULT
+from core.indice import IndiceParcelas
+from core.pipeline import Etapa, Pipeline
+
+from .generadores import METADATOS_PARCELAS, TITULO_CAVANET, a_csv, a_xlsx, generar
+
+ESCENARIOS = [9000.0, 10500.0, 12000.0, {'XAB': 11000.0, 'MAB': 9500.0}]
+
+
+@dataclass(frozen=True)
+class Caso:
+    nombre: str                     # 'modulo.funcion' o 'modulo.funcion[variante]'
+    grupo: str
+    funcion: Callable[..., Any]
+    entradas: Tuple[str, ...]       # etapas de datos que recibe, en orden
+    filas: Optional[str] = None     # etapa cuyas filas son el tamaño de la entrada (por defecto, la primera tabla)
+    archivo: bool = False
+
+
+# ============================================================
+# Directorios temporales (estado del reparto incremental, caché)
+# ============================================================
+_temporales: List[str] = []
+
+
+def _temporal() -> str:
+    directorio = tempfile.mkdtemp(prefix='pgc_bench_')
+    _temporales.append(directorio)
+    return directorio
+
+
+@atexit.register
+def borrar_temporales() -> None:
+    for directorio in _temporales:
+        shutil.rmtree(directorio, ignore_errors=True)
+    _temporales.clear()
+
+
+# Las cabeceras desplazadas que aprende core.esquema no van al almacén del usuario
+esquema.RUTA_ESQUEMAS = os.path.join(_temporal(), 'esquemas.json')
+
+
+# ============================================================
+# Datos de una escala
+# ============================================================
+def _estado_guardado(controlar: Callable, df) -> str:
+    # Ruta con el estado que deja un primer reparto incremental (para medir el "sin cambios")
+    ruta = os.path.join(_temporal(), 'estado.json')
+    controlar(df, ruta)
+    return ruta
+
+
+def _en_cache(df) -> str:
+    directorio = _temporal()
+    cache.guardar_cache('benchmark', df, directorio)
+    return directorio
+
+
+ETAPAS_DATOS = [
+    Etapa('conjunto', generar, ('n_pesadas', 'semilla')),
+    Etapa('parcelas_df', lambda c: c.parcelas, ('conjunto',)),
+    Etapa('it04_df', lambda c: c.it04, ('conjunto',)),
+    Etapa('rvc_df', lambda c: c.rvc, ('conjunto',)),
+    Etapa('cav_df', lambda c: c.cavanet, ('conjunto',)),
+    # Archivos
+    Etapa('parcelas_xlsx', lambda df: a_xlsx(df, 'Parcelas', METADATOS_PARCELAS), ('parcelas_df',)),
+    Etapa('it04_xlsx', lambda df: a_xlsx(df, 'IT04'), ('it04_df',)),
+    Etapa('rvc_xlsx', lambda df: a_xlsx(df, 'RVC'), ('rvc_df',)),
+    Etapa('rvc_csv', a_csv, ('rvc_df',)),
+    Etapa('cav_xlsx', lambda df: a_xlsx(df, 'Detalle pesadas', TITULO_CAVANET), ('cav_df',)),
+    # CAT (RVC)
+    Etapa('parcelas_rvc', parcelas.procesar_parcelas, ('parcelas_df',)),
+    Etapa('hect_rvc', parcelas.agregar_hectareas, ('parcelas_rvc', 'agrupar_por_ejercicio')),
+    Etapa('final_rvc', parcelas.aplicar_rendimiento_ha, ('hect_rvc', 'rendimiento_ha')),
+    Etapa('it04', it04.cargar_it04, ('it04_df',)),
+    Etapa('rend_rvc', it04.construir_rendimiento_ajustado, ('final_rvc', 'it04')),
+    Etapa('indice_rvc', IndiceParcelas, ('parcelas_rvc',)),
+    Etapa('cupos', lambda df, agr, agrupar: escenarios.cupos_por_escenario(df, ESCENARIOS, agr, agrupar),
+          ('parcelas_rvc', 'it04', 'agrupar_por_ejercicio')),
+    Etapa('rvc_clean', rvc.procesar_rvc, ('rvc_df',)),
+    Etapa('cruce_rvc', lambda df, p, i: rvc.crear_vartip_rvc(df, None, p, None, indice=i),
+          ('rvc_clean', 'parcelas_rvc', 'indice_rvc')),
+    Etapa('con_rend_rvc', reparto.reasignar_rendimiento, ('cruce_rvc', 'rend_rvc')),
+    Etapa('estado_rvc', lambda df: _estado_guardado(rvc.controlar_rendimientos_incremental, df), ('con_rend_rvc',)),
+    Etapa('procesado_rvc', rvc.controlar_rendimientos, ('con_rend_rvc',)),
+    Etapa('resumenes_rvc', rvc.generar_resumenes, ('procesado_rvc',)),
+    Etapa('hojas_rvc', lambda df, r: rvc.construir_hojas_salida(df, *r), ('procesado_rvc', 'resumenes_rvc')),
+    Etapa('procesado_rvc_texto', categorias.a_texto, ('procesado_rvc',)),
+    Etapa('cache_rvc', _en_cache, ('rvc_clean',)),
+    # ESP (Cavanet)
+    Etapa('parcelas_cav', cavanet.procesar_parcelas, ('parcelas_df',)),
+    Etapa('hect_cav', cavanet.agregar_hectareas_parcelas, ('parcelas_cav', 'agrupar_por_ejercicio')),
+    Etapa('final_cav', cavanet.aplicar_rendimiento_ha, ('hect_cav', 'rendimiento_ha')),
+    Etapa('rend_cav', lambda df, agr: cavanet.construir_rendimiento_ajustado(df, agr)[0], ('final_cav', 'it04')),
+    Etapa('indice_cav', IndiceParcelas, ('parcelas_cav',)),
+    Etapa('cav_clean', cavanet.procesar_cavanet, ('cav_df',)),
+    Etapa('cruce_cav', lambda df, p, i: cavanet.crear_vartip_cavanet(df, None, p, None, indice=i),
+          ('cav_clean', 'parcelas_cav', 'indice_cav')),
+    Etapa('con_rend_cav', reparto.reasignar_rendimiento, ('cruce_cav', 'rend_cav')),
+    Etapa('estado_cav', lambda df: _estado_guardado(cavanet.controlar_rendimientos_por_fecha_incremental, df),
+          ('con_rend_cav',)),
+    Etapa('procesado_cav', cavanet.controlar_rendimientos_por_fecha, ('con_rend_cav',)),
+    Etapa('resumenes_cav', cavanet.generar_resumenes_cavanet, ('procesado_cav',)),
+]
+
+
+class Datos:
+    """
+    Salidas de ETAPAS_DATOS para una escala, calculadas a demanda y guardadas. Sin
+    huellas (las entradas no cambian): a diferencia de Pipeline.ejecutar, pedir una
+    etapa no repite las previas ya olvidadas si su salida sigue guardada.
+    """
+
+    def __init__(self, n_pesadas: int, semilla: int = 0):
+        self.etapas = {e.nombre: e for e in ETAPAS_DATOS}
+        self.valores = dict(n_pesadas=n_pesadas, semilla=semilla, rendimiento_ha=RENDIMIENTO_POR_HECTAREA_DEFAULT,
+                            agrupar_por_ejercicio=AGRUPAR_POR_EJERCICIO_DEFAULT)
+        self._salidas: Dict[str, Any] = {}
+
+    def obtener(self, nombre: str) -> Any:
+        if nombre in self.valores:
+            return self.valores[nombre]
+        if nombre not in self._salidas:
+            etapa = self.etapas[nombre]
+            self._salidas[nombre] = etapa.funcion(*(self.obtener(e) for e in etapa.entradas))
+            if nombre == 'conjunto':
+                # Las cuatro tablas se separan en seguida: así el conjunto se olvida y
+                # cada tabla se libera cuando ya no la pide ningún caso
+                for tabla in [e for e in self.etapas.values() if e.entradas == ('conjunto',)]:
+                    self._salidas[tabla.nombre] = tabla.funcion(self._salidas[nombre])
+        return self._salidas[nombre]
+
+    def conservar(self, casos: Iterable[Caso]) -> None:
+        # Olvida las salidas que no necesitan `casos` (ni directamente ni para calcular lo que les falta)
+        necesarias: Set[str] = set()
+        pila = [e for c in casos for e in (*c.entradas, *([c.filas] if c.filas else []))]
+        while pila:
+            nombre = pila.pop()
+            if nombre in necesarias or nombre not in self.etapas:
+                continue
+            necesarias.add(nombre)
+            if nombre not in self._salidas:
+                pila.extend(self.etapas[nombre].entradas)
+        for nombre in [n for n in self._salidas if n not in necesarias]:
+            del self._salidas[nombre]
+
+
+# ============================================================
+# Casos
+# ============================================================
+def _incremental(controlar: Callable) -> Callable:
+    # Primer reparto del día: sin estado guardado (directorio nuevo en cada llamada)
+    return lambda df: controlar(df, os.path.join(_temporal(), 'estado.json'))
+
+
+def _flujo(crear: Callable[[], Pipeline], **valores) -> Callable:
+    # Flujo completo de una página desde los archivos, con la caché de entradas vacía
+    # (core.cache lee DIR_CACHE en cada llamada)
+    def ejecutar(archivo_parcelas: bytes, archivo_it04: bytes, archivo_pesadas: bytes) -> bytes:
+        anterior, cache.DIR_CACHE = cache.DIR_CACHE, _temporal()
+        try:
+            return crear().ejecutar(
+                ['excel'], archivo_parcelas=archivo_parcelas, archivo_it04=archivo_it04,
+                archivo_pesadas=archivo_pesadas, extra=(), rendimiento_ha=RENDIMIENTO_POR_HECTAREA_DEFAULT,
+                agrupar_por_ejercicio=AGRUPAR_POR_EJERCICIO_DEFAULT, incremental=False, **valores
+            )['excel']
+        finally:
+            cache.DIR_CACHE = anterior
+    return ejecutar
+
+
+CASOS = [
+    # ---- Lectura de archivos ----
+    Caso('lectura.leer_parcelas_excel', 'lectura',
+         lambda data: lectura.leer_parcelas_excel(data, esquema='parcelas'), ('parcelas_xlsx',),
+         filas='parcelas_df', archivo=True),
+    Caso('cavanet.cargar_parcelas_desde_excel', 'lectura', cavanet.cargar_parcelas_desde_excel, ('parcelas_xlsx',),
+         filas='parcelas_df', archivo=True),
+    Caso('lectura.leer_tabla[it04.xlsx]', 'lectura', lectura.leer_tabla, ('it04_xlsx',), filas='it04_df', archivo=True),
+    Caso('cavanet.cargar_it04_df', 'lectura', cavanet.cargar_it04_df, ('it04_xlsx',), filas='it04_df', archivo=True),
+    Caso('lectura.leer_tabla[rvc.xlsx]', 'lectura', lambda data: lectura.leer_tabla(data, esquema='rvc'),
+         ('rvc_xlsx',), filas='rvc_df', archivo=True),
+    Caso('lectura.leer_tabla[rvc.csv]', 'lectura', lambda data: lectura.leer_tabla(data, True, esquema='rvc'),
+         ('rvc_csv',), filas='rvc_df', archivo=True),
+    Caso('cavanet.cargar_cavanet_desde_excel', 'lectura', cavanet.cargar_cavanet_desde_excel, ('cav_xlsx',),
+         filas='cav_df', archivo=True),
+
+    # ---- Parcelas (CAT y ESP) e IT04 ----
+    Caso('parcelas.procesar_parcelas', 'parcelas', parcelas.procesar_parcelas, ('parcelas_df',)),
+    Caso('parcelas.agregar_hectareas', 'parcelas', parcelas.agregar_hectareas,
+         ('parcelas_rvc', 'agrupar_por_ejercicio')),
+    Caso('parcelas.aplicar_rendimiento_ha', 'parcelas', parcelas.aplicar_rendimiento_ha, ('hect_rvc', 'rendimiento_ha')),
+    Caso('parcelas.crear_dataframe_final', 'parcelas', parcelas.crear_dataframe_final,
+         ('parcelas_rvc', 'rendimiento_ha', 'agrupar_por_ejercicio')),
+    Caso('cavanet.procesar_parcelas', 'parcelas', cavanet.procesar_parcelas, ('parcelas_df',)),
+    Caso('cavanet.agregar_hectareas_parcelas', 'parcelas', cavanet.agregar_hectareas_parcelas,
+         ('parcelas_cav', 'agrupar_por_ejercicio')),
+    Caso('cavanet.aplicar_rendimiento_ha', 'parcelas', cavanet.aplicar_rendimiento_ha, ('hect_cav', 'rendimiento_ha')),
+    Caso('cavanet.crear_dataframe_final_parcelas', 'parcelas', cavanet.crear_dataframe_final_parcelas,
+         ('parcelas_cav', 'rendimiento_ha', 'agrupar_por_ejercicio')),
+    Caso('cavanet.construir_rendimiento_ajustado', 'parcelas', cavanet.construir_rendimiento_ajustado,
+         ('final_cav', 'it04')),
+    Caso('it04.cargar_it04', 'parcelas', it04.cargar_it04, ('it04_df',)),
+    Caso('it04.construir_rendimiento_ajustado', 'parcelas', it04.construir_rendimiento_ajustado, ('final_rvc', 'it04')),
+    Caso('indice.IndiceParcelas', 'parcelas', IndiceParcelas, ('parcelas_rvc',)),
+    Caso('export.exportar_excel_parcelas', 'exportacion', export.exportar_excel_parcelas,
+         ('final_rvc', 'parcelas_rvc'), archivo=True),
+    Caso('escenarios.cupos_por_escenario', 'escenarios',
+         lambda df, agr, agrupar: escenarios.cupos_por_escenario(df, ESCENARIOS, agr, agrupar),
+         ('parcelas_rvc', 'it04', 'agrupar_por_ejercicio')),
+
+    # ---- Utilidades vectoriales sobre las pesadas en bruto ----
+    Caso('utils.normalizar[norm_nif]', 'utilidades', lambda df: utils.normalizar(df['nifLliurador'], utils.norm_nif),
+         ('rvc_df',)),
+    Caso('utils.normalizar[norm_refparcela]', 'utilidades',
+         lambda df: utils.normalizar(df['origenParcella'], utils.norm_refparcela), ('rvc_df',)),
+    Caso('utils.claves_num_pesada', 'utilidades', lambda df: utils.claves_num_pesada(df['numPesada']), ('rvc_df',)),
+    Caso('utils.rango_num_pesada', 'utilidades', lambda df: utils.rango_num_pesada(df['numPesada']), ('rvc_df',)),
+    Caso('categorias.combinar_claves', 'utilidades',
+         lambda df: categorias.combinar_claves(df['varietatDesc'], df['nifLliurador']), ('rvc_df',)),
+
+    # ---- RVC ----
+    Caso('rvc.procesar_rvc', 'rvc', rvc.procesar_rvc, ('rvc_df',)),
+    Caso('rvc.crear_vartip_rvc', 'rvc', lambda df, p, i: rvc.crear_vartip_rvc(df, None, p, None, indice=i),
+         ('rvc_clean', 'parcelas_rvc', 'indice_rvc')),
+    Caso('cache.guardar_cache', 'cache', lambda df: cache.guardar_cache('benchmark', df, _temporal()), ('rvc_clean',)),
+    Caso('cache.leer_cache', 'cache', lambda directorio: cache.leer_cache('benchmark', directorio), ('cache_rvc',),
+         filas='rvc_clean'),
+    Caso('reparto.reasignar_rendimiento', 'rvc', reparto.reasignar_rendimiento, ('cruce_rvc', 'rend_rvc')),
+    Caso('rvc.controlar_rendimientos', 'rvc', rvc.controlar_rendimientos, ('con_rend_rvc',)),
+    Caso('reparto.repartir_cupo', 'rvc', lambda df: reparto.repartir_cupo(df['kgTotals'], df['vartip'], df['rendimiento']),
+         ('procesado_rvc',)),
+    Caso('rvc.controlar_rendimientos_incremental[primero]', 'rvc', _incremental(rvc.controlar_rendimientos_incremental),
+         ('con_rend_rvc',)),
+    Caso('rvc.controlar_rendimientos_incremental[sin_cambios]', 'rvc', rvc.controlar_rendimientos_incremental,
+         ('con_rend_rvc', 'estado_rvc')),
+    Caso('rvc.generar_resumenes', 'rvc', rvc.generar_resumenes, ('procesado_rvc',)),
+    Caso('rvc.construir_hojas_salida', 'rvc', lambda df, r: rvc.construir_hojas_salida(df, *r),
+         ('procesado_rvc', 'resumenes_rvc')),
+    Caso('export.exportar_excel_rvc', 'exportacion', export.exportar_excel_rvc, ('hojas_rvc', 'rend_rvc', 'it04'),
+         filas='procesado_rvc', archivo=True),
+    Caso('escenarios.barrido_rendimiento_ha', 'escenarios',
+         lambda df, cupos: escenarios.barrido_rendimiento_ha(df, cupos, 'kgTotals', ['nomCeller']),
+         ('procesado_rvc', 'cupos')),
+    Caso('categorias.a_texto', 'utilidades', categorias.a_texto, ('procesado_rvc',)),
+    Caso('categorias.compactar_claves', 'utilidades', categorias.compactar_claves, ('procesado_rvc_texto',)),
+
+    # ---- Cavanet ----
+    Caso('utils.a_fechas', 'utilidades', lambda df: utils.a_fechas(df['Fecha']), ('cav_df',)),
+    Caso('utils.a_numero', 'utilidades', lambda df: utils.a_numero(df['kg']), ('cav_df',)),
+    Caso('cavanet.procesar_cavanet', 'cavanet', cavanet.procesar_cavanet, ('cav_df',)),
+    Caso('cavanet.crear_vartip_cavanet', 'cavanet',
+         lambda df, p, i: cavanet.crear_vartip_cavanet(df, None, p, None, indice=i),
+         ('cav_clean', 'parcelas_cav', 'indice_cav')),
+    Caso('cavanet.controlar_rendimientos_por_fecha', 'cavanet', cavanet.controlar_rendimientos_por_fecha,
+         ('con_rend_cav',)),
+    Caso('cavanet.controlar_rendimientos_por_fecha_incremental[primero]', 'cavanet',
+         _incremental(cavanet.controlar_rendimientos_por_fecha_incremental), ('con_rend_cav',)),
+    Caso('cavanet.controlar_rendimientos_por_fecha_incremental[sin_cambios]', 'cavanet',
+         cavanet.controlar_rendimientos_por_fecha_incremental, ('con_rend_cav', 'estado_cav')),
+    Caso('cavanet.generar_resumenes_cavanet', 'cavanet', cavanet.generar_resumenes_cavanet, ('procesado_cav',)),
+    Caso('cavanet.build_excel_bytes_cavanet', 'exportacion',
+         lambda df, r, rend, agr: cavanet.build_excel_bytes_cavanet(df, r[0], r[1], rend, agr, r[2]),
+         ('procesado_cav', 'resumenes_cav', 'rend_cav', 'it04'), archivo=True),
+
+    # ---- Flujos completos (archivos -> Excel de resultados) ----
+    Caso('flujos.flujo_rvc', 'flujo', _flujo(flujos.flujo_rvc, it04_csv=False, pesadas_csv=False),
+         ('parcelas_xlsx', 'it04_xlsx', 'rvc_xlsx'), filas='rvc_df', archivo=True),
+    Caso('flujos.flujo_cavanet', 'flujo', _flujo(flujos.flujo_cavanet),
+         ('parcelas_xlsx', 'it04_xlsx', 'cav_xlsx'), filas='cav_df', archivo=True),
+]
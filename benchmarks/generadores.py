@@ -0,0 +1,315 @@
+# benchmarks/generadores.py
+# ============================================================
+# Entradas sintéticas: Parcelas, IT04, RVC y Cavanet
+# - Reproducibles (semilla) y escalables: se pide el nº de
+#   pesadas; parcelas (~1 por cada 6 pesadas) y socios (~1 por
+#   cada 5 parcelas) salen de él.
+# - Con los rasgos de los archivos reales:
+#   · Parcelas con la cabecera desplazada a la fila 7 (metadatos
+#     del registro) y columnas en catalán ('Any', 'Varietat',
+#     'Superfície (ha)', 'Estat'); Cavanet con filas de título
+#     antes de la cabecera y 'Instalación' con acento.
+#   · XAREL·LO escrito de varias formas (y el resto de variedades
+#     con sus alias), NIF y parcela con otra grafía en las pesadas.
+#   · Fechas mezcladas en Cavanet y RVC: fecha de Excel, texto
+#     dd/mm/aaaa y número de serie (a_fechas las interpreta).
+#   · Superficie y kilos con coma decimal en parte.
+#   · numPesada con sufijo ('12345B': repesadas).
+# - Parte de las pesadas son de no socios o de parcelas no
+#   registradas para su VARTIP, para que los cruces filtren.
+# ============================================================
+
+from __future__ import annotations
+import json
+import os
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from core.xlsx import escribir_libro
+
+# Filas por hoja de un xlsx (la cabecera y las filas previas cuentan)
+MAX_FILAS_XLSX = 1_048_576
+
+# Grafías por variedad (pesos aproximados de una campaña del Penedès)
+VARIEDADES = [
+    (0.34, ['XAREL·LO', 'Xarel·lo', 'XAREL.LO', 'Xarel.lo', 'XARELLO', 'Xarel-lo']),
+    (0.28, ['MACABEU', 'Macabeo', 'VIURA']),
+    (0.18, ['PARELLADA', 'Parellada']),
+    (0.08, ['CHARDONNAY', 'Chardonnay']),
+    (0.05, ['PINOT NOIR', 'Pinot-Noir']),
+    (0.03, ['GARNATXA NEGRA', 'Garnacha Tinta']),
+    (0.02, ['TREPAT']),
+    (0.02, ['SUBIRAT PARENT', 'Malvasia de Sitges']),
+]
+CELLERS = ['Celler Cooperatiu Sant Sadurní', 'Cavas del Penedès', 'Celler de Vilafranca',
+           'Caves Subirats', 'Cooperativa de Gelida', 'Celler Torrelavit']
+NOMBRES = ['Joan', 'Josep', 'Maria', 'Montserrat', 'Jordi', 'Núria', 'Pere', 'Anna', 'Francesc', 'Mercè']
+APELLIDOS = ['Puig', 'Ferrer', 'Vidal', 'Soler', 'Raventós', 'Torres', 'Mestres', 'Sabaté', 'Güell', 'Rovira']
+
+COLUMNAS_PARCELAS = ['Any', 'RefParcela', 'NRegistro', 'NIF', 'Apellidos', 'Nombre', 'Varietat',
+                     'Superfície (ha)', 'PorcentajeTitularidad', 'Estat', 'Segmento']
+METADATOS_PARCELAS = [
+    ['REGISTRE VITIVINÍCOLA DE CATALUNYA', None, None],
+    ['Consulta de parcel·les per titular', None, None],
+    ["Data d'extracció:", '01/10/2024', None],
+    [None, None, None],
+    ['Campanya:', '2024', None],
+    [None, None, None],
+]
+TITULO_CAVANET = [
+    ['CAVANET - Detalle de pesadas por bodega', None],
+    ['Campaña 2024', None],
+    [None, None],
+]
+LETRAS_NIF = np.array(list('TRWAGMYFPDXBNJZSQVHLCKE'))
+
+
+@dataclass
+class Conjunto:
+    n_pesadas: int
+    semilla: int
+    parcelas: pd.DataFrame
+    it04: pd.DataFrame
+    rvc: pd.DataFrame
+    cavanet: pd.DataFrame
+
+
+def escala(texto) -> int:
+    # '10k', '1m', '5M', '250000' -> nº de pesadas
+    t = str(texto).strip().lower().replace('_', '')
+    mult = {'k': 1_000, 'm': 1_000_000}.get(t[-1:], 1)
+    return int(float(t[:-1] if mult > 1 else t) * mult)
+
+
+def _elegir(rng: np.random.Generator, opciones: Sequence, n: int, pesos: Optional[Sequence[float]] = None):
+    # Texto como lo deja la lectura (str de Arrow, None -> NaN), sin un objeto de Python por fila
+    if pesos is not None:
+        pesos = np.asarray(pesos, dtype=float) / np.sum(pesos)
+    return pd.array(list(opciones), dtype='str').take(rng.choice(len(opciones), size=n, p=pesos))
+
+
+def _nifs(rng: np.random.Generator, n: int) -> pd.Series:
+    # DNI con letra de control (y ~5 % de CIF de sociedades), distintos
+    numeros = rng.choice(89_999_999, size=n, replace=False) + 10_000_000
+    texto = pd.Series(numeros).astype('str')
+    return texto.add(pd.Series(LETRAS_NIF[numeros % 23])).where(rng.random(n) >= 0.05, 'B' + texto)
+
+
+def _grafia(rng: np.random.Generator, valores: pd.Series, idx: np.ndarray, variantes) -> pd.Series:
+    # valores[idx] con otra grafía en parte de las filas; cada variante se calcula una vez por
+    # valor distinto (socio, parcela), no por pesada
+    tabla = pd.concat([valores] + [f(valores) for _, f in variantes], ignore_index=True)
+    pesos = [p for p, _ in variantes]
+    elegida = rng.choice(len(variantes) + 1, size=len(idx), p=[1 - sum(pesos), *pesos])
+    return tabla.take(elegida * len(valores) + idx).reset_index(drop=True)
+
+
+# La misma persona escrita como en otro programa: minúsculas, guion antes de la letra, espacios
+GRAFIAS_NIF = [
+    (0.10, lambda s: s.str.lower()),
+    (0.08, lambda s: s.str[:-1] + '-' + s.str[-1]),
+    (0.04, lambda s: ' ' + s + ' '),
+]
+# Con o sin espacios y en minúsculas (norm_refparcela las junta)
+GRAFIAS_PARCELA = [
+    (0.25, lambda s: s.str.replace(' ', '', regex=False)),
+    (0.10, lambda s: s.str.lower()),
+]
+
+
+def _variedades(rng: np.random.Generator, grupo: np.ndarray):
+    # Una grafía cualquiera de la variedad de cada fila (el catálogo las resuelve al mismo código)
+    grafias = [g for _, gs in VARIEDADES for g in gs]
+    cuantas = np.array([len(gs) for _, gs in VARIEDADES])
+    inicio = np.concatenate([[0], np.cumsum(cuantas)[:-1]])
+    elegida = inicio[grupo] + (rng.random(len(grupo)) * cuantas[grupo]).astype(np.int64)
+    return pd.array(grafias, dtype='str').take(elegida)
+
+
+def _fechas(rng: np.random.Generator, n: int, inicio: str = '2024-08-19', dias: int = 55) -> pd.Series:
+    return pd.Series(pd.Timestamp(inicio) + pd.to_timedelta(rng.integers(0, dias * 24 * 60, n), unit='min'))
+
+
+def _fechas_mezcladas(rng: np.random.Generator, fechas: pd.Series) -> np.ndarray:
+    # ~85 % fecha de Excel (datetime, como la devuelve openpyxl), ~12 % texto dd/mm/aaaa,
+    # ~3 % número de serie de Excel
+    out = np.array(fechas.dt.floor('D').dt.to_pydatetime(), dtype=object)
+    u = rng.random(len(fechas))
+    texto = u < 0.12
+    out[texto] = fechas[texto].dt.strftime('%d/%m/%Y').to_numpy(dtype=object)
+    serie = (u >= 0.12) & (u < 0.15)
+    out[serie] = ((fechas[serie].dt.floor('D') - pd.Timestamp('1899-12-30')).dt.days).to_numpy(dtype=object)
+    return out
+
+
+def _con_coma(rng: np.random.Generator, valores: np.ndarray, proporcion: float, decimales: int) -> np.ndarray:
+    # Parte de los números como texto con coma decimal ('1,2345'), como los exporta un Excel en catalán
+    out = valores.astype(object)
+    mask = rng.random(len(valores)) < proporcion
+    out[mask] = (pd.Series(valores[mask]).round(decimales).astype(str).str.replace('.', ',', regex=False)
+                 .to_numpy(dtype=object))
+    return out
+
+
+def generar(n_pesadas: int, semilla: int = 0) -> Conjunto:
+    rng = np.random.default_rng(semilla)
+    n_parcelas = max(60, n_pesadas // 6)
+    n_socios = max(12, n_parcelas // 5)
+
+    # ---- Parcelas (registro vitícola) ----
+    nifs = _nifs(rng, n_socios)
+    nombre = pd.Series(_elegir(rng, NOMBRES, n_socios))
+    apellidos = pd.Series(_elegir(rng, APELLIDOS, n_socios)) + ' ' + pd.Series(_elegir(rng, APELLIDOS, n_socios))
+    socio = np.sort(rng.integers(0, n_socios, n_parcelas))
+    pesos = np.array([p for p, _ in VARIEDADES])
+    grupo = rng.choice(len(VARIEDADES), size=n_parcelas, p=pesos / pesos.sum())
+    refs = pd.Series([f"08-{m:03d}-{p:03d}-{q:05d} {r}" for m, p, q, r in zip(
+        rng.integers(1, 320, n_parcelas), rng.integers(1, 40, n_parcelas), range(n_parcelas),
+        rng.choice(list('ABCD'), n_parcelas))], dtype='str')
+    superficie = rng.gamma(2.0, 0.45, n_parcelas).round(4) + 0.05
+    superficie = _con_coma(rng, superficie, 0.30, 4)
+    superficie[rng.random(n_parcelas) < 0.002] = 's/d'
+    titularidad = np.where(rng.random(n_parcelas) < 0.9, 100, 50).astype(object)
+    titularidad[rng.random(n_parcelas) < 0.02] = '50 %'
+    parcelas = pd.DataFrame({
+        'Any': 2024,
+        'RefParcela': refs,
+        'NRegistro': socio + 10_000,
+        'NIF': nifs.take(socio).to_numpy(),
+        'Apellidos': apellidos.take(socio).to_numpy(),
+        'Nombre': nombre.take(socio).to_numpy(),
+        'Varietat': _variedades(rng, grupo),
+        'Superfície (ha)': superficie,
+        'PorcentajeTitularidad': titularidad,
+        'Estat': _elegir(rng, ['VALIDADA', 'PENDENT', 'BAIXA'], n_parcelas, [0.95, 0.03, 0.02]),
+        'Segmento': _elegir(rng, ['GUARDA', 'Guarda ', 'GUARDA SUPERIOR', 'Guarda  Superior'], n_parcelas,
+                            [0.78, 0.07, 0.10, 0.05]),
+    }, columns=COLUMNAS_PARCELAS)
+
+    # ---- Pesadas: de una parcela del registro, de otra no registrada para el VARTIP o de no socios ----
+    origen = rng.integers(0, n_parcelas, n_pesadas)
+    u = rng.random(n_pesadas)
+    parcela_p = origen.copy()
+    otra_parcela = (u >= 0.90) & (u < 0.95)
+    parcela_p[otra_parcela] = rng.integers(0, n_parcelas, int(otra_parcela.sum()))
+    # Los no socios van detrás de los socios en la tabla de NIF
+    socio_p = socio[origen]
+    no_socio = u >= 0.95
+    socio_p[no_socio] = n_socios + np.arange(int(no_socio.sum()))
+    todos_nifs = pd.concat([nifs, _nifs(rng, int(no_socio.sum()))], ignore_index=True)
+    nif_p = _grafia(rng, todos_nifs, socio_p, GRAFIAS_NIF)
+    ref_p = _grafia(rng, refs, parcela_p, GRAFIAS_PARCELA)
+    var_p = _variedades(rng, grupo[origen])
+    fechas_hora = _fechas(rng, n_pesadas)
+    fechas = _fechas_mezcladas(rng, fechas_hora)
+    kg = rng.gamma(3.0, 900.0, n_pesadas).round(0).astype(np.int64) + 50
+    kg = _con_coma(rng, kg.astype(float), 0.05, 1)
+    celler = _elegir(rng, CELLERS, n_pesadas)
+    nombre_p = (nombre + ' ' + apellidos).take(socio[origen]).reset_index(drop=True)
+
+    # ---- RVC (Registre de Verema de Catalunya): columnas en catalán ----
+    base = np.arange(1, n_pesadas + 1) + 100_000
+    sufijo = _elegir(rng, ['', 'B', 'C'], n_pesadas, [0.95, 0.04, 0.01])
+    repesada = sufijo != ''
+    base[repesada] = base[rng.integers(0, n_pesadas, int(repesada.sum()))]
+    num_pesada = pd.Series(base).astype('str') + pd.Series(sufijo)
+    rvc = pd.DataFrame({
+        'dos': _elegir(rng, ['CV', 'CV ', 'PN', 'DO'], n_pesadas, [0.88, 0.04, 0.05, 0.03]),
+        'cavaGuardaSuperior': _elegir(rng, [None, 'NO', 'SI', 'Sí'], n_pesadas, [0.70, 0.22, 0.06, 0.02]),
+        'numPesada': num_pesada,
+        'kgTotals': kg,
+        'nomCeller': celler,
+        'nipd': _elegir(rng, [f"{i:05d}" for i in range(1, 40)] + [None], n_pesadas),
+        'varietatDesc': var_p,
+        'nifLliurador': nif_p,
+        'nomLliurador': nombre_p,
+        'dataPesada': fechas,
+        'origenParcella': ref_p,
+        'tiquetBascula': rng.integers(1, 999_999, n_pesadas),
+        'motiuPesadaIncidental': _elegir(rng, [None, 'IN-01', 'IN-02', 'in 01'], n_pesadas, [0.94, 0.03, 0.02, 0.01]),
+        'observacions': _elegir(rng, [None, 'Pluja', 'Gra petit'], n_pesadas, [0.9, 0.05, 0.05]),
+    }, copy=False)
+
+    # ---- Cavanet: columnas en castellano, con acentos ----
+    # (copy=False: NIF, nombre, variedad, parcela, celler, fechas y kilos comparten buffers con RVC; copy-on-write)
+    cavanet = pd.DataFrame({
+        'Fecha': fechas,
+        'Tiquet': rng.permutation(n_pesadas) + 1,
+        'Bodega': celler,
+        'NifBodega': _elegir(rng, ['F08012345', 'B08054321', 'F08099887'], n_pesadas),
+        'Instalación': _elegir(rng, ['Sant Sadurní', 'Vilafranca', 'Gelida'], n_pesadas),
+        'Dni': nif_p,
+        'NombreViticultor': nombre_p,
+        'Variedad': var_p,
+        'Segmento': _elegir(rng, ['GUARDA', 'Guarda', 'GUARDA SUPERIOR'], n_pesadas, [0.85, 0.05, 0.10]),
+        'Parcela': ref_p,
+        'kg': kg,
+        'Estado': _elegir(rng, ['VALID', 'ANUL', 'PEND'], n_pesadas, [0.94, 0.04, 0.02]),
+        'FechaEstado': fechas_hora,
+        'FechaModificacion': fechas_hora,
+        'UsuarioModificacion': _elegir(rng, ['bascula1', 'bascula2', 'admin'], n_pesadas),
+    }, copy=False)
+
+    # ---- IT04: kilos a restar de ~3 % de los VARTIP (variedad + NIF, como los calcula Parcelas) ----
+    codigos = {g: cod for (_, grafias), cod in zip(VARIEDADES, ['XAB', 'MAB', 'PAB', 'CHB', 'PTN', 'GAN', 'TRN', 'SPB'])
+               for g in grafias}
+    vartips = pd.unique(parcelas['Varietat'].map(codigos) + '-' + parcelas['NIF']).astype(object)
+    elegidos = rng.choice(len(vartips), size=max(2, len(vartips) * 3 // 100), replace=False)
+    it04 = pd.DataFrame({
+        'VARTIP': vartips[elegidos],
+        'Kg_a_restar': _con_coma(rng, rng.integers(100, 5_000, len(elegidos)).astype(float), 0.10, 0),
+    })
+    return Conjunto(n_pesadas, semilla, parcelas, it04, rvc, cavanet)
+
+
+# ============================================================
+# Archivos
+# ============================================================
+def a_xlsx(df: pd.DataFrame, hoja: str = 'Sheet1', previas: Optional[List[list]] = None) -> bytes:
+    # `previas`: filas antes de la cabecera (metadatos, títulos); se escriben como parte de la rejilla
+    if not previas:
+        return escribir_libro([(hoja, df)])
+    ancho = max(df.shape[1], *(len(f) for f in previas))
+    filas = [list(f) + [None] * (ancho - len(f)) for f in previas[1:]] + [list(df.columns) + [None] * (ancho - df.shape[1])]
+    rejilla = pd.concat([pd.DataFrame(filas, dtype=object), df.set_axis(range(df.shape[1]), axis=1).astype(object)],
+                        ignore_index=True)
+    cabecera = list(previas[0]) + [None] * (ancho - len(previas[0]))
+    return escribir_libro([(hoja, rejilla.set_axis(cabecera, axis=1))])
+
+
+def a_csv(df: pd.DataFrame) -> bytes:
+    return df.to_csv(index=False).encode('utf-8')
+
+
+def archivos(conjunto: Conjunto) -> Dict[str, bytes]:
+    # Los archivos tal como llegan a la app (y al proceso por lotes)
+    if conjunto.n_pesadas + len(TITULO_CAVANET) + 1 > MAX_FILAS_XLSX:
+        raise ValueError(f"{conjunto.n_pesadas:,} pesadas no caben en una hoja de Excel.")
+    return {
+        'parcelas.xlsx': a_xlsx(conjunto.parcelas, 'Parcelas', METADATOS_PARCELAS),
+        'it04.xlsx': a_xlsx(conjunto.it04, 'IT04'),
+        'rvc.xlsx': a_xlsx(conjunto.rvc, 'RVC'),
+        'rvc.csv': a_csv(conjunto.rvc),
+        'cavanet.xlsx': a_xlsx(conjunto.cavanet, 'Detalle pesadas', TITULO_CAVANET),
+    }
+
+
+def escribir_archivos(conjunto: Conjunto, directorio: str) -> str:
+    # Archivos + manifiesto de core.lote (un conjunto RVC y uno Cavanet); devuelve la ruta del manifiesto
+    os.makedirs(directorio, exist_ok=True)
+    for nombre, datos in archivos(conjunto).items():
+        with open(os.path.join(directorio, nombre), 'wb') as f:
+            f.write(datos)
+    manifiesto = [
+        {'nombre': f"sintetico_rvc_{conjunto.n_pesadas}", 'tipo': 'rvc',
+         'parcelas': 'parcelas.xlsx', 'it04': 'it04.xlsx', 'pesadas': 'rvc.xlsx'},
+        {'nombre': f"sintetico_cavanet_{conjunto.n_pesadas}", 'tipo': 'cavanet',
+         'parcelas': 'parcelas.xlsx', 'it04': 'it04.xlsx', 'pesadas': 'cavanet.xlsx'},
+    ]
+    ruta = os.path.join(directorio, 'manifiesto.json')
+    with open(ruta, 'w', encoding='utf-8') as f:
+        json.dump(manifiesto, f, ensure_ascii=False, indent=2)
+    return ruta
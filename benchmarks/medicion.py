@@ -0,0 +1,160 @@
+# benchmarks/medicion.py
+# ============================================================
+# Medición de los casos (benchmarks.casos) y comparación
+# - Por caso y escala: una ejecución con tracemalloc para el pico
+#   de memoria (hace de calentamiento) y `repeticiones` sin él
+#   para el tiempo: mínimo, mediana, CPU y filas por segundo.
+# - Cada repetición recibe copias superficiales de las tablas: los
+#   casos que añaden columnas no cambian la entrada del siguiente.
+# - Cada escala, en un proceso aparte (ver ejecutar).
+# - comparar(): más lento o con más memoria que (1 + tolerancia)
+#   veces la base es una regresión; diferencias de menos de
+#   10 ms / 1 MB no cuentan (ruido).
+# ============================================================
+
+from __future__ import annotations
+import gc
+import multiprocessing
+import queue
+import statistics
+import time
+from typing import Any, Dict, List
+
+import pandas as pd
+
+from core.telemetria import filas, medir, registrar
+
+from .casos import CASOS, Caso, Datos, borrar_temporales
+from .generadores import MAX_FILAS_XLSX
+
+RUIDO_S = 0.01
+RUIDO_MB = 1.0
+
+
+def _fila(caso: Caso, n_pesadas: int, error: str = '') -> Dict[str, Any]:
+    return {'caso': caso.nombre, 'grupo': caso.grupo, 'n_pesadas': n_pesadas, 'filas': None, 'repeticiones': 0,
+            'segundos_min': None, 'segundos_mediana': None, 'cpu_s': None, 'filas_por_s': None,
+            'memoria_pico_mb': None, 'error': error}
+
+
+def medir_caso(caso: Caso, datos: Datos, repeticiones: int, memoria: bool = True) -> Dict[str, Any]:
+    fila = _fila(caso, datos.valores['n_pesadas'])
+    try:
+        args = [datos.obtener(e) for e in caso.entradas]
+        fila['filas'] = (filas(datos.obtener(caso.filas)) if caso.filas
+                         else next((n for n in map(filas, args) if n is not None), None))
+
+        def copias() -> List[Any]:
+            return [a.copy(deep=False) if isinstance(a, pd.DataFrame) else a for a in args]
+
+        if memoria:
+            with registrar(memoria=True):
+                with medir(caso.nombre) as medida:
+                    salida = caso.funcion(*copias())
+            del salida
+            fila['memoria_pico_mb'] = medida.memoria_pico_mb
+        tiempos, cpu = [], []
+        for _ in range(repeticiones):
+            entrada = copias()
+            gc.collect()
+            inicio, inicio_cpu = time.perf_counter(), time.process_time()
+            salida = caso.funcion(*entrada)
+            tiempos.append(time.perf_counter() - inicio)
+            cpu.append(time.process_time() - inicio_cpu)
+            del salida, entrada
+    except Exception as e:
+        fila['error'] = f"{type(e).__name__}: {e}"
+        return fila
+    if tiempos:
+        fila.update(repeticiones=len(tiempos), segundos_min=round(min(tiempos), 5),
+                    segundos_mediana=round(statistics.median(tiempos), 5), cpu_s=round(min(cpu), 5))
+        if fila['filas']:
+            fila['filas_por_s'] = round(fila['filas'] / max(min(tiempos), 1e-9), 1)
+    return fila
+
+
+def _medir_escala(cola, nombres: List[str], n_pesadas: int, repeticiones: int, semilla: int, memoria: bool) -> None:
+    # En el proceso hijo: los casos se buscan por nombre (las funciones de CASOS no se pueden enviar).
+    # Un hijo de multiprocessing no ejecuta atexit: los temporales se borran aquí.
+    por_nombre = {c.nombre: c for c in CASOS}
+    casos = [por_nombre[n] for n in nombres]
+    datos = Datos(n_pesadas, semilla)
+    try:
+        for i, caso in enumerate(casos):
+            datos.conservar(casos[i:])
+            cola.put(medir_caso(caso, datos, repeticiones, memoria))
+    finally:
+        borrar_temporales()
+    cola.put(None)
+
+
+def ejecutar(casos: List[Caso], escalas: List[int], repeticiones: int = 3, semilla: int = 0,
+             max_archivos: int = 200_000, memoria: bool = True, al_medir=None) -> List[Dict[str, Any]]:
+    """
+    Mide `casos` a cada escala (nº de pesadas) y devuelve una fila por caso y escala.
+    Los casos con archivos se omiten por encima de `max_archivos` pesadas (y siempre
+    que no quepan en una hoja de Excel). `al_medir(fila)` se llama tras cada caso.
+
+    Cada escala se mide en un proceso aparte: empieza con la memoria limpia y, si el
+    sistema lo mata (sin memoria a 5M pesadas), se conservan los casos ya medidos y
+    el resto queda con error.
+    """
+    contexto = multiprocessing.get_context('spawn')
+    resultados = []
+    for n in escalas:
+        limite = min(max_archivos, MAX_FILAS_XLSX - 10)
+        pendientes = [c for c in casos if not (c.archivo and n > limite)]
+        cola = contexto.Queue()
+        proceso = contexto.Process(target=_medir_escala, daemon=True,
+                                   args=(cola, [c.nombre for c in pendientes], n, repeticiones, semilla, memoria))
+        proceso.start()
+        medidos = 0
+        while True:
+            try:
+                fila = cola.get(timeout=1)
+            except queue.Empty:
+                if proceso.is_alive():
+                    continue
+                fila = None
+            if fila is None:
+                break
+            medidos += 1
+            resultados.append(fila)
+            if al_medir is not None:
+                al_medir(fila)
+        proceso.join()
+        for caso in pendientes[medidos:]:
+            motivo = (f"señal {-proceso.exitcode} (¿sin memoria?)" if (proceso.exitcode or 0) < 0
+                      else f"código {proceso.exitcode}")
+            fila = _fila(caso, n, f"El proceso de la escala terminó antes de medirlo ({motivo})")
+            resultados.append(fila)
+            if al_medir is not None:
+                al_medir(fila)
+    return resultados
+
+
+def comparar(resultados: List[Dict[str, Any]], base: List[Dict[str, Any]],
+             tolerancia: float) -> pd.DataFrame:
+    # Una fila por caso y escala medidos en las dos ejecuciones, con sus cocientes nuevo / base
+    previos = {(b['caso'], b['n_pesadas']): b for b in base}
+    filas_cmp = []
+    for r in resultados:
+        b = previos.get((r['caso'], r['n_pesadas']))
+        if b is None or r['segundos_min'] is None or b.get('segundos_min') is None:
+            continue
+        ratio_t = r['segundos_min'] / max(b['segundos_min'], 1e-9)
+        lento = ratio_t > 1 + tolerancia and r['segundos_min'] - b['segundos_min'] > RUIDO_S
+        ratio_m = None
+        mas_memoria = False
+        if r['memoria_pico_mb'] is not None and b.get('memoria_pico_mb') is not None:
+            ratio_m = r['memoria_pico_mb'] / max(b['memoria_pico_mb'], 1e-9)
+            mas_memoria = ratio_m > 1 + tolerancia and r['memoria_pico_mb'] - b['memoria_pico_mb'] > RUIDO_MB
+        filas_cmp.append({
+            'caso': r['caso'], 'n_pesadas': r['n_pesadas'],
+            'base_s': b['segundos_min'], 'nuevo_s': r['segundos_min'], 'ratio_tiempo': round(ratio_t, 3),
+            'base_mb': b.get('memoria_pico_mb'), 'nuevo_mb': r['memoria_pico_mb'],
+            'ratio_memoria': None if ratio_m is None else round(ratio_m, 3),
+            'regresion': lento or mas_memoria,
+        })
+    return pd.DataFrame(filas_cmp, columns=['caso', 'n_pesadas', 'base_s', 'nuevo_s', 'ratio_tiempo',
+                                            'base_mb', 'nuevo_mb', 'ratio_memoria', 'regresion'])
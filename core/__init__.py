@@ -0,0 +1,18 @@
+# core/__init__.py
+# ============================================================
+# Copy-on-write de pandas
+# - El proceso no duplica tablas enteras en cada etapa: las
+#   selecciones y hojas derivadas comparten datos con la tabla
+#   base y solo se copia lo que se reescribe.
+# - Es el comportamiento por defecto desde pandas 3.0, y core lo
+#   necesita (requirements.txt). No se activa con set_option: la
+#   opción es global al proceso y cambiaría también las páginas
+#   y st_aggrid (y con option_context, las demás sesiones, que
+#   son hilos del mismo proceso).
+# ============================================================
+
+import pandas as pd
+
+if int(pd.__version__.split('.')[0]) < 3:
+    raise ImportError(f"core necesita pandas >= 3.0 (copy-on-write); instalado: {pd.__version__}. "
+                      "Instale las dependencias de requirements.txt.")
@@ -0,0 +1,187 @@
+# core/cache.py
+# ============================================================
+# Caché en disco de entradas ya procesadas
+# - Clave: hash del contenido subido + cargador + opciones +
+#   catálogo de variedades (los códigos se resuelven al procesar).
+# - Se guarda el DataFrame normalizado (salida de procesar_*,
+#   cargar_it04...) en Parquet y se relee con memory map.
+# - Si Parquet no admite alguna columna (tipos mezclados), pickle
+#   firmado (HMAC): el directorio puede ser compartido y un pickle
+#   ejecuta código al leerlo. La clave no está en ese directorio
+#   (PGC_CACHE_CLAVE o ~/.pgc_cache_clave); lo que no se verifica
+#   se descarta.
+# - Otro proceso puede purgar una entrada mientras se lee: fallo
+#   de caché, no error.
+# - Expulsión LRU por tamaño total del directorio.
+# ============================================================
+
+from __future__ import annotations
+import hashlib
+import hmac
+import json
+import os
+import pickle
+import secrets
+from functools import lru_cache
+from typing import Callable, Optional
+
+import pandas as pd
+
+from .variedades import catalogo_variedades
+
+
+DIR_CACHE = os.environ.get('PGC_CACHE_DIR', '.cache_entradas')
+LIMITE_CACHE_MB = float(os.environ.get('PGC_CACHE_MB', '512'))
+# Subir al cambiar la salida de algún cargador/procesado para invalidar lo guardado
+VERSION_CACHE = 9
+
+_EXTENSIONES = ('.parquet', '.pkl')
+RUTA_CLAVE = os.environ.get('PGC_CACHE_CLAVE_ARCHIVO', os.path.join(os.path.expanduser('~'), '.pgc_cache_clave'))
+
+
+def clave_cache(data: bytes, cargador: str, **opciones) -> str:
+    h = hashlib.sha256()
+    h.update(data)
+    h.update(json.dumps([VERSION_CACHE, cargador, opciones, catalogo_variedades().huella()],
+                        sort_keys=True, default=str).encode('utf-8'))
+    return h.hexdigest()
+
+
+def _ruta(clave: str, ext: str, directorio: Optional[str]) -> str:
+    return os.path.join(directorio or DIR_CACHE, clave + ext)
+
+
+@lru_cache(maxsize=None)
+def _clave_firma() -> bytes:
+    # Compartida por los procesos del mismo usuario; se crea (0600) la primera vez
+    if os.environ.get('PGC_CACHE_CLAVE'):
+        return os.environ['PGC_CACHE_CLAVE'].encode('utf-8')
+    try:
+        with open(RUTA_CLAVE, 'rb') as f:
+            clave = f.read()
+        if len(clave) >= 32:
+            return clave
+    except FileNotFoundError:
+        pass
+    tmp = f"{RUTA_CLAVE}.{os.getpid()}.tmp"
+    descriptor = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, 'wb') as f:
+        f.write(secrets.token_bytes(32))
+    try:
+        os.link(tmp, RUTA_CLAVE)  # si otro proceso la creó antes, se usa la suya
+    except FileExistsError:
+        pass
+    finally:
+        os.remove(tmp)
+    with open(RUTA_CLAVE, 'rb') as f:
+        return f.read()
+
+
+def _firma(datos: bytes) -> bytes:
+    return hmac.new(_clave_firma(), datos, hashlib.sha256).digest()
+
+
+def _leer_pickle(ruta: str) -> pd.DataFrame:
+    with open(ruta, 'rb') as f:
+        contenido = f.read()
+    firma, datos = contenido[:32], contenido[32:]
+    if not hmac.compare_digest(firma, _firma(datos)):
+        raise ValueError('Firma no válida')
+    return pickle.loads(datos)
+
+
+def leer_cache(clave: str, directorio: Optional[str] = None) -> Optional[pd.DataFrame]:
+    for ext in _EXTENSIONES:
+        ruta = _ruta(clave, ext, directorio)
+        try:
+            if ext == '.parquet':
+                df = pd.read_parquet(ruta, memory_map=True)
+            else:
+                df = _leer_pickle(ruta)
+            os.utime(ruta)  # marca de uso para la expulsión LRU
+        except FileNotFoundError:
+            # No está (o otro proceso la acaba de purgar)
+            continue
+        except Exception:
+            # Entrada corrupta, sin firma válida o de otra versión de pandas/pyarrow: se descarta
+            try:
+                os.remove(ruta)
+            except FileNotFoundError:
+                pass
+            return None
+        return df
+    return None
+
+
+def _mismos_tipos(a: pd.DataFrame, b: pd.DataFrame) -> bool:
+    return (a.columns.equals(b.columns) and a.index.equals(b.index)
+            and a.index.dtype == b.index.dtype and a.dtypes.equals(b.dtypes))
+
+
+def guardar_cache(clave: str, df: pd.DataFrame, directorio: Optional[str] = None) -> str:
+    directorio = directorio or DIR_CACHE
+    os.makedirs(directorio, exist_ok=True)
+    tmp = _ruta(clave, f'.{os.getpid()}.tmp', directorio)
+    ruta = _ruta(clave, '.parquet', directorio)
+    try:
+        df.to_parquet(tmp, index=True)
+        if not _mismos_tipos(df, pd.read_parquet(tmp, memory_map=True)):
+            raise TypeError('Parquet no conserva los tipos')
+    except Exception:
+        # Columnas que Parquet no representa tal cual (objetos con enteros o tipos mezclados,
+        # nombres no texto...): pickle, que sí las conserva
+        datos = pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)
+        with open(tmp, 'wb') as f:
+            f.write(_firma(datos) + datos)
+        ruta = _ruta(clave, '.pkl', directorio)
+    os.replace(tmp, ruta)
+    purgar_cache(directorio)
+    return ruta
+
+
+def purgar_cache(directorio: Optional[str] = None, limite_mb: Optional[float] = None) -> int:
+    # Borra las entradas usadas hace más tiempo hasta quedar por debajo del límite; devuelve cuántas
+    directorio = directorio or DIR_CACHE
+    limite = (LIMITE_CACHE_MB if limite_mb is None else limite_mb) * 2**20
+    if not os.path.isdir(directorio):
+        return 0
+    entradas = []
+    for nombre in os.listdir(directorio):
+        if nombre.endswith(_EXTENSIONES):
+            try:
+                st = os.stat(os.path.join(directorio, nombre))
+            except FileNotFoundError:
+                continue
+            entradas.append((st.st_mtime, st.st_size, nombre))
+    total = sum(e[1] for e in entradas)
+    borradas = 0
+    for _, tam, nombre in sorted(entradas):
+        if total <= limite:
+            break
+        try:
+            os.remove(os.path.join(directorio, nombre))
+        except FileNotFoundError:
+            pass
+        total -= tam
+        borradas += 1
+    return borradas
+
+
+def procesado_en_cache(
+    data: bytes,
+    cargador: str,
+    funcion: Callable[[bytes], pd.DataFrame],
+    directorio: Optional[str] = None,
+    **opciones
+) -> pd.DataFrame:
+    """
+    Devuelve `funcion(data)` reutilizando el resultado guardado si ya se procesó
+    el mismo contenido con el mismo `cargador` y `opciones`.
+    """
+    clave = clave_cache(data, cargador, **opciones)
+    df = leer_cache(clave, directorio)
+    if df is None:
+        df = funcion(data)
+        if df is not None:
+            guardar_cache(clave, df, directorio)
+    return df
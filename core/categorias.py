@@ -0,0 +1,85 @@
+# core/categorias.py
+# ============================================================
+# Columnas clave codificadas por diccionario (category)
+# - vartip, NIF/Dni, variedad, segmento, bodega, celler, parcela
+#   y estado viajan como category: cada valor distinto se guarda
+#   una vez y las filas llevan un código entero.
+# - Categorías ordenadas: ordenar por la columna da el mismo orden
+#   que con el texto.
+# - Pesadas e IT04 se recodifican al diccionario de Parcelas antes
+#   de cruzar, así merges y groupbys comparan códigos.
+# - Se vuelve a texto solo en las vistas previas (la exportación
+#   escribe las categorías tal cual).
+# ============================================================
+
+from __future__ import annotations
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+
+
+COLUMNAS_CLAVE = [
+    'vartip', 'NIF', 'nif', 'Dni', 'Variedad', 'codigo_variedad', 'Segmento', 'segmento',
+    'Bodega', 'Instalacion', 'nomCeller', 'RefParcela_norm', 'estado_vartip',
+]
+
+
+def es_categoria(serie: pd.Series) -> bool:
+    return isinstance(serie.dtype, pd.CategoricalDtype)
+
+
+def a_categoria(serie: pd.Series, tipo: Optional[pd.CategoricalDtype] = None) -> pd.Series:
+    """
+    Columna como category. Sin `tipo`, con sus valores distintos ordenados como
+    categorías; con `tipo`, recodificada a ese diccionario (los valores que no
+    están en él quedan NaN, como si no cruzaran).
+    """
+    if tipo is not None:
+        return serie.astype(tipo)
+    if es_categoria(serie):
+        return serie
+    try:
+        codigos, distintos = pd.factorize(serie, sort=True)
+    except TypeError:
+        # Valores que no se pueden ordenar entre sí (texto y números mezclados): se deja igual
+        return serie
+    return pd.Series(pd.Categorical.from_codes(codigos, distintos), index=serie.index, name=serie.name)
+
+
+def compactar_claves(df: pd.DataFrame, columnas: Iterable[str] = COLUMNAS_CLAVE) -> pd.DataFrame:
+    for c in columnas:
+        if c in df.columns:
+            df[c] = a_categoria(df[c])
+    return df
+
+
+def unificar(serie: pd.Series, referencia: pd.Series) -> pd.Series:
+    # Recodifica `serie` al diccionario de `referencia` para cruzar por códigos
+    if es_categoria(referencia):
+        return a_categoria(serie, referencia.dtype)
+    return serie
+
+
+def combinar_claves(a: pd.Series, b: pd.Series, sep: str = '-') -> pd.Series:
+    # a.astype(str) + sep + b.astype(str) como category, concatenando solo los pares distintos
+    ca, ua = pd.factorize(a, use_na_sentinel=False)
+    cb, ub = pd.factorize(b, use_na_sentinel=False)
+    par = ca.astype(np.int64) * max(len(ub), 1) + cb
+    _, primeras, inversa = np.unique(par, return_index=True, return_inverse=True)
+    textos = (a.iloc[primeras].astype(str).reset_index(drop=True) + sep
+              + b.iloc[primeras].astype(str).reset_index(drop=True))
+    codigos, distintos = pd.factorize(textos, sort=True)
+    return pd.Series(pd.Categorical.from_codes(codigos[inversa.ravel()], distintos),
+                     index=a.index, name=a.name)
+
+
+def a_texto(df: pd.DataFrame) -> pd.DataFrame:
+    # Categorías -> valores (para AgGrid / st.dataframe)
+    cats = [c for c in df.columns if es_categoria(df[c])]
+    if not cats:
+        return df
+    df = df.copy(deep=False)
+    for c in cats:
+        df[c] = np.asarray(df[c], dtype=object)
+    return df
@@ -0,0 +1,169 @@
+# core/escenarios.py
+# ============================================================
+# Escenarios de rendimiento por hectárea (kg/ha)
+# - Calcula el reparto CAVA/PGC de varios kg/ha a la vez sobre
+#   las mismas pesadas ya cruzadas y ordenadas.
+# - El acumulado por VARTIP no depende del cupo: se calcula una
+#   vez y se compara contra una matriz (pesada x escenario).
+# ============================================================
+
+from __future__ import annotations
+import re
+from typing import Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from .reparto import TOLERANCIA_CUPO, _segmentos, _cumsum_segmentos
+from .utils import a_numero
+
+Escenario = Union[float, Dict[str, float]]
+
+# Máximo de celdas (pesadas x escenarios) por bloque de cálculo
+_CELDAS_POR_BLOQUE = 8_000_000
+
+
+def _nombre_escenario(esc: Escenario) -> str:
+    if isinstance(esc, dict):
+        return ' '.join(f"{k}={float(v):g}" for k, v in esc.items())
+    return f"{float(esc):g}"
+
+
+def _kg_ha(tokens: List[str], malos: List[str]) -> List[float]:
+    # Valores kg/ha con el lector numérico de las columnas ('10.500' y '9,000' son miles);
+    # los no numéricos o <= 0 se añaden a `malos`
+    valores = a_numero(pd.Series(tokens, dtype=object), miles=True).tolist() if tokens else []
+    malos.extend(t for t, v in zip(tokens, valores) if not v > 0)
+    return valores
+
+
+def escenarios_desde_texto(valores: str, por_variedad: str = "") -> List[Escenario]:
+    """
+    "9000; 10500 12000" o "9000, 10500" -> [9000.0, 10500.0]; "XAB=11000; MAB=9500" añade un
+    escenario por variedad. Separan los valores ';', espacios y ', ' (la coma pegada a cifras
+    es de miles o decimal). Los repetidos se quitan; lo no numérico o <= 0 lanza ValueError.
+    """
+    malos: List[str] = []
+    tokens = [t for t in re.split(r"\s*;\s*|,\s+|\s+", (valores or "").strip()) if t]
+    escenarios: List[Escenario] = list(dict.fromkeys(_kg_ha(tokens, malos)))
+
+    codigos, textos = [], []
+    for tok in re.split(r";|,(?=\s*[A-Za-z])", por_variedad or ""):
+        if not tok.strip():
+            continue
+        cod, _, val = tok.partition('=')
+        if not cod.strip() or not val.strip():
+            malos.append(tok.strip())
+            continue
+        codigos.append(cod.strip().upper())
+        textos.append(val.strip())
+    overrides = dict(zip(codigos, _kg_ha(textos, malos)))
+    if malos:
+        raise ValueError("Escenarios no válidos (se espera un kg/ha mayor que 0): " + ", ".join(malos))
+    if overrides:
+        escenarios.append(overrides)
+    if not escenarios:
+        raise ValueError("Indique al menos un escenario de kg/ha.")
+    return escenarios
+
+
+def cupos_por_escenario(
+    df_parcelas_clean: pd.DataFrame,
+    escenarios: List[Escenario],
+    df_it04_aggr: Optional[pd.DataFrame] = None,
+    agrupar_por_ejercicio: bool = True,
+    rendimiento_ha_base: float = 10500
+) -> pd.DataFrame:
+    """
+    Rendimiento ajustado por VARTIP (filas) y escenario (columnas).
+
+    Mismo cálculo que crear_dataframe_final + construir_rendimiento_ajustado:
+    hectáreas x kg/ha redondeado a 2 decimales por clave, suma por VARTIP,
+    resta IT04 y recorte a 0. Un escenario es un kg/ha común o un dict
+    codigo_variedad -> kg/ha (las variedades no indicadas usan `rendimiento_ha_base`).
+    """
+    clave = ['Ejercicio', 'vartip'] if agrupar_por_ejercicio and ('Ejercicio' in df_parcelas_clean.columns) else ['vartip']
+    hect = (df_parcelas_clean.groupby(clave, dropna=False, observed=True)
+            .agg(hectareas=('superficie_efectiva', 'sum'), codigo_variedad=('codigo_variedad', 'first'))
+            .reset_index())
+
+    # Un escenario por nombre (9000 y 9000.0 darían columnas repetidas)
+    por_nombre = {}
+    for esc in escenarios:
+        por_nombre.setdefault(_nombre_escenario(esc), esc)
+    nombres, escenarios = list(por_nombre), list(por_nombre.values())
+    rend = pd.DataFrame(index=hect.index)
+    for nombre, esc in zip(nombres, escenarios):
+        if isinstance(esc, dict):
+            kg_ha = hect['codigo_variedad'].astype(object).map(esc).fillna(float(rendimiento_ha_base)).astype(float)
+        else:
+            kg_ha = float(esc)
+        rend[nombre] = (hect['hectareas'] * kg_ha).astype(float).round(2)
+    rend['vartip'] = hect['vartip']
+    cupos = rend.groupby('vartip', dropna=False, observed=True)[nombres].sum()
+
+    if df_it04_aggr is not None and not df_it04_aggr.empty:
+        restar = df_it04_aggr.set_index('vartip')['kg_a_restar_total'].reindex(cupos.index).fillna(0.0)
+        cupos = cupos.sub(restar, axis=0).clip(lower=0.0)
+    return cupos
+
+
+def barrido_rendimiento_ha(
+    df_ordenado: pd.DataFrame,
+    cupos: pd.DataFrame,
+    kg_col: str,
+    nivel_cols: Optional[List[str]] = None,
+    tol: float = TOLERANCIA_CUPO
+) -> pd.DataFrame:
+    """
+    total_kg_pgc por VARTIP (y niveles, p. ej. nomCeller o Bodega) para cada escenario.
+
+    `df_ordenado` son las pesadas cruzadas en el orden del reparto (p. ej. la
+    salida de controlar_rendimientos*). `cupos` viene de cupos_por_escenario.
+    Devuelve una tabla larga: escenario, vartip, niveles, total_kg_pgc.
+    """
+    nivel_cols = [c for c in (nivel_cols or []) if c in df_ordenado.columns]
+    nombres = list(cupos.columns)
+    n = len(df_ordenado)
+
+    codigos, uniques = pd.factorize(df_ordenado['vartip'])
+    orden, inicio, largo, pos = _segmentos(codigos)
+    kg_o = pd.to_numeric(df_ordenado[kg_col], errors='coerce').to_numpy(dtype=float)[orden]
+    acum = _cumsum_segmentos(kg_o, inicio, largo, pos)
+    previo = np.r_[0.0, acum[:-1]] if n else acum
+    if n:
+        previo[inicio] = 0.0
+
+    # Cupo de cada grupo y escenario (n_grupos x S)
+    cupo_grp = cupos.reindex(uniques[codigos[orden][inicio]] if n else []).to_numpy(dtype=float)
+    grupo_fila = np.repeat(np.arange(len(inicio)), largo)
+    filas = np.arange(len(orden))
+
+    pgc = np.zeros((n, len(nombres)))
+    paso = max(1, _CELDAS_POR_BLOQUE // max(n, 1))
+    for j0 in range(0, len(nombres), paso):
+        sl = slice(j0, j0 + paso)
+        r = cupo_grp[grupo_fila, sl]
+        valido = ~np.isnan(r)
+        cabe = acum[:, None] <= r
+        excede = ~cabe & valido
+        dispara = excede | (cabe & (np.abs(acum[:, None] - r) < tol))
+        cand = np.where(dispara, filas[:, None], n)
+        primero = np.minimum.reduceat(cand, inicio, axis=0) if n else cand
+        disp_fila = primero[grupo_fila]
+        en_disp = filas[:, None] == disp_fila
+        post = (disp_fila < n) & (filas[:, None] > disp_fila)
+        pgc_exc = kg_o[:, None] - np.maximum(r - previo[:, None], 0.0)
+        bloque = np.select([en_disp & excede, post], [pgc_exc, np.broadcast_to(kg_o[:, None], r.shape)], 0.0)
+        pgc[orden, sl] = bloque
+
+    df_pgc = pd.DataFrame(pgc, columns=nombres, index=df_ordenado.index)
+    claves = ['vartip'] + nivel_cols
+    for c in claves:
+        df_pgc[c] = df_ordenado[c]
+    tabla = df_pgc.groupby(claves, dropna=False, observed=True)[nombres].sum()
+    tabla.columns.name = 'escenario'
+    tabla = (tabla.stack().rename('total_kg_pgc').reset_index()
+             [['escenario'] + claves + ['total_kg_pgc']])
+    tabla['total_kg_pgc'] = tabla['total_kg_pgc'].round(2)
+    return tabla
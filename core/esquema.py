@@ -0,0 +1,234 @@
+# core/esquema.py
+# ============================================================
+# Resolución de columnas (nombre lógico -> columna del archivo)
+# - Mismas reglas que find_col / find_col_by_terms, pero todas
+#   las columnas lógicas de una vez y normalizando cada nombre
+#   de la cabecera una sola vez.
+# - Resultado memorizado por firma de la cabecera (en memoria y
+#   en disco): los exportadores conocidos no se vuelven a resolver.
+#   Como mucho MAX_FIRMAS cabeceras (las usadas más recientemente).
+# - La misma resolución dice qué columnas leer (proyección).
+# ============================================================
+
+from __future__ import annotations
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .cache import DIR_CACHE
+from .utils import norm_text
+
+
+RUTA_ESQUEMAS = os.environ.get('PGC_ESQUEMAS', os.path.join(DIR_CACHE, 'esquemas.json'))
+MAX_FIRMAS = 500
+
+# Regla: ('col', candidatos) como find_col, ('terminos', términos) como find_col_by_terms.
+# Cada campo prueba sus reglas en orden hasta que una encuentra columna.
+Regla = Tuple[str, Tuple[str, ...]]
+
+_SUPERFICIE = [
+    ('col', ('Superficie', 'Superfície', 'superficie', 'Superficie (ha)', 'Superfície (ha)',
+             'Sup', 'sup', 'Sup (ha)', 'sup (ha)', 'Hectáreas', 'Hectareas', 'Hectárea', 'Hectarea',
+             'ha', 'HA')),
+    ('terminos', ('SUPERFIC',)), ('terminos', ('HECTA',)), ('terminos', ('HA',)),
+]
+
+# nombre -> (renombrado en cadena, campos). En cadena: cada columna encontrada se
+# renombra antes de buscar la siguiente (como hacen los procesar_parcelas).
+ESQUEMAS: Dict[str, Tuple[bool, List[Tuple[str, List[Regla]]]]] = {
+    'parcelas': (True, [
+        ('NIF', [('col', ('NIF', 'nif'))]),
+        ('Variedad', [('col', ('Variedad', 'variedad', 'Varietat', 'varietat'))]),
+        ('RefParcela', [('col', ('RefParcela', 'refparcela', 'Ref_Parcela', 'Ref Parcela', 'Ref parcela',
+                                 'origenParcela', 'origenParcella')),
+                        ('terminos', ('PARCEL',))]),
+        ('Superficie', _SUPERFICIE),
+        ('Segmento', [('col', ('Segmento', 'segmento'))]),
+        ('Nombre', [('col', ('Nombre', 'nombre'))]),
+        ('Apellidos', [('col', ('Apellidos', 'apellidos'))]),
+        ('Ejercicio', [('col', ('Ejercicio', 'ejercicio', 'Any', 'Año', 'ano', 'Ano'))]),
+        ('PorcentajeTitularidad', [('col', ('PorcentajeTitularidad', 'porcentajetitularidad',
+                                            'Porcentaje Titularidad', 'PorcTitularidad'))]),
+        ('NRegistro', [('col', ('NRegistro', 'Nº Registro', 'NºRegistro', 'NumRegistro'))]),
+        ('Estado', [('col', ('Estado', 'estado', 'Estat', 'estat', 'Status'))]),
+    ]),
+    'cavanet.parcelas': (True, [
+        ('NIF', [('col', ('NIF', 'nif'))]),
+        ('Variedad', [('col', ('Variedad', 'variedad', 'Varietat', 'varietat'))]),
+        ('RefParcela', [('col', ('RefParcela', 'refparcela', 'Ref_Parcela', 'Ref Parcela', 'Ref parcela',
+                                 'origenParcela', 'origenParcella'))]),
+        ('Superficie', [('col', ('Superficie', 'superficie', 'Sup', 'sup', 'Hectáreas', 'Hectareas', 'ha', 'HA'))]),
+        ('Segmento', [('col', ('Segmento', 'segmento'))]),
+        ('Nombre', [('col', ('Nombre', 'nombre'))]),
+        ('Apellidos', [('col', ('Apellidos', 'apellidos'))]),
+        ('Ejercicio', [('col', ('Ejercicio', 'ejercicio', 'Any', 'Año', 'ano', 'Ano'))]),
+        ('PorcentajeTitularidad', [('col', ('PorcentajeTitularidad', 'porcentajetitularidad',
+                                            'Porcentaje Titularidad', 'PorcTitularidad'))]),
+        ('NRegistro', [('col', ('NRegistro', 'Nº Registro', 'NºRegistro', 'NumRegistro'))]),
+        ('Estado', [('col', ('Estado', 'estado', 'Estat', 'estat', 'Status'))]),
+    ]),
+    'rvc': (False, [
+        ('dos', [('col', ('dos',))]),
+        ('cavaGuardaSuperior', [('col', ('cavaGuardaSuperior', 'cava_guarda_superior'))]),
+        ('numPesada', [('col', ('numPesada', 'num_pesada'))]),
+        ('kgTotals', [('col', ('kgTotals', 'kg_totals', 'kgTotal', 'kg'))]),
+        ('nomCeller', [('col', ('nomCeller', 'celler', 'nombreCeller', 'nom_celler'))]),
+        ('varietatDesc', [('col', ('varietatDesc', 'variedad', 'varietat', 'variety'))]),
+        ('nifLliurador', [('col', ('nifLliurador', 'nifLLiurador', 'nif lliurador', 'nif_entrega', 'nifProveedor'))]),
+        ('nomLliurador', [('col', ('nomLliurador', 'nom lliurador', 'nombreLliurador', 'proveedor', 'nombreProveedor'))]),
+        ('nipd', [('col', ('nipd', 'nip', 'idProveedor'))]),
+        ('dataPesada', [('col', ('dataPesada', 'fechaPesada', 'data_pesada', 'fecha'))]),
+        ('origenParcella', [('col', ('origenParcella', 'origenParcela', 'origen parcela', 'origen_parcela'))]),
+        ('tiquetBascula', [('col', ('tiquetBascula', 'tiquetBascu', 'tiquet_bascu', 'ticketBascula', 'tiquetBascul'))]),
+        ('motiuPesadaIncidental', [('col', ('motiuPesadaIncidental', 'motivoPesadaIncidental',
+                                            'motiu incidental', 'motivo incidental')),
+                                   ('terminos', ('MOTIU', 'INCID')), ('terminos', ('MOTIVO', 'INCID')),
+                                   ('terminos', ('MOTIU', 'INCIDENTAL')), ('terminos', ('MOTIVO', 'INCIDENTAL'))]),
+    ]),
+    'cavanet': (False, [
+        ('Fecha', [('col', ('Fecha', 'Data')), ('terminos', ('FECH',))]),
+        ('Tiquet', [('col', ('Tiquet', 'Ticket', 'TiquetBascula'))]),
+        ('Bodega', [('col', ('Bodega', 'nomCeller', 'Celler'))]),
+        ('NifBodega', [('col', ('NifBodega', 'NIF Bodega', 'NIF_Bodega'))]),
+        ('Instalacion', [('col', ('Instalacion', 'Instalación', 'instalacion', 'instal·lacio', 'instalacio', 'instalación'))]),
+        ('Dni', [('col', ('Dni', 'DNI', 'NIF', 'nif'))]),
+        ('NombreViticultor', [('col', ('NombreViticultor', 'NomViticultor', 'Proveedor', 'nomLliurador'))]),
+        ('Variedad', [('col', ('Variedad', 'Varietat', 'varietat', 'variedad'))]),
+        ('Segmento', [('col', ('Segmento', 'segmento'))]),
+        ('Parcela', [('col', ('Parcela', 'Parcella', 'parcela', 'parcella'))]),
+        ('kg', [('col', ('kg', 'Kg', 'Kgs', 'Kilos', 'KILOS', 'Peso', 'PESO'))]),
+        ('Estado', [('col', ('Estado', 'Estat', 'estado'))]),
+    ]),
+}
+
+_lock = threading.Lock()
+_resueltos: Dict[str, List[Optional[int]]] = {}  # en orden de uso (la última, la más reciente)
+_cargado = False
+
+
+def _buscar(nombres: Dict, regla: Regla):
+    # nombres: columna -> nombre normalizado (orden de la cabecera, sin repetidas)
+    tipo, valores = regla
+    if tipo == 'terminos':
+        for col, ncol in nombres.items():
+            if all(t in ncol for t in valores):
+                return col
+        return None
+    targets = [norm_text(c) for c in valores]
+    for col, ncol in nombres.items():
+        if ncol in targets:
+            return col
+    for t in targets:
+        for col, ncol in nombres.items():
+            if t in ncol:
+                return col
+    return None
+
+
+def _resolver(columnas: List, esquema: str) -> List[Optional[int]]:
+    # Posición (en la cabecera, ya renombrada si es en cadena) de la columna de cada campo
+    en_cadena, campos = ESQUEMAS[esquema]
+    actuales = list(columnas)
+    normas = {c: norm_text(c) for c in actuales}
+    posiciones: List[Optional[int]] = []
+    for logico, reglas in campos:
+        col = None
+        for regla in reglas:
+            col = _buscar(normas, regla)
+            if col is not None:
+                break
+        if col is None:
+            posiciones.append(None)
+            continue
+        posiciones.append(actuales.index(col))
+        if en_cadena:
+            actuales = [logico if c == col else c for c in actuales]
+            normas = {c: normas.get(c) or norm_text(c) for c in actuales}
+    return posiciones
+
+
+def firma_cabecera(columnas: Sequence, esquema: str) -> str:
+    contenido = [esquema, ESQUEMAS[esquema], [[type(c).__name__, str(c)] for c in columnas]]
+    return hashlib.sha1(json.dumps(contenido, ensure_ascii=False, default=str).encode('utf-8')).hexdigest()
+
+
+def _cargar_conocidas() -> None:
+    global _cargado
+    _cargado = True
+    try:
+        with open(RUTA_ESQUEMAS, 'r', encoding='utf-8') as f:
+            _resueltos.update(json.load(f))
+    except (OSError, ValueError):
+        pass
+    _recortar()
+
+
+def _recortar() -> None:
+    for firma in list(_resueltos)[:max(0, len(_resueltos) - MAX_FIRMAS)]:
+        del _resueltos[firma]
+
+
+def _guardar_conocidas() -> None:
+    try:
+        carpeta = os.path.dirname(RUTA_ESQUEMAS)
+        if carpeta:
+            os.makedirs(carpeta, exist_ok=True)
+        tmp = f"{RUTA_ESQUEMAS}.{os.getpid()}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(_resueltos, f)
+        os.replace(tmp, RUTA_ESQUEMAS)
+    except OSError:
+        pass  # sin disco escribible solo se pierde la memoria entre procesos
+
+
+def posiciones_esquema(columnas: Sequence, esquema: str) -> List[Optional[int]]:
+    columnas = list(columnas)
+    firma = firma_cabecera(columnas, esquema)
+    with _lock:
+        if not _cargado:
+            _cargar_conocidas()
+        posiciones = _resueltos.pop(firma, None)
+        if posiciones is not None:
+            _resueltos[firma] = posiciones  # pasa a ser la más reciente (se guarda con la próxima nueva)
+    if posiciones is None or len(posiciones) != len(ESQUEMAS[esquema][1]):
+        posiciones = _resolver(columnas, esquema)
+        with _lock:
+            _resueltos.pop(firma, None)
+            _resueltos[firma] = posiciones
+            _recortar()
+            _guardar_conocidas()
+    return posiciones
+
+
+def resolver_columnas(columnas: Sequence, esquema: str) -> Dict[str, Optional[object]]:
+    """
+    Campo lógico -> columna del archivo (None si no está), con las reglas del esquema.
+
+    En los esquemas en cadena la búsqueda ve las columnas ya renombradas; para
+    esos usar `renombrar_columnas`.
+    """
+    columnas = list(columnas)
+    campos = ESQUEMAS[esquema][1]
+    return {logico: (columnas[p] if p is not None else None)
+            for (logico, _), p in zip(campos, posiciones_esquema(columnas, esquema))}
+
+
+def renombrar_columnas(columnas: Sequence, esquema: str) -> List:
+    # Cabecera final tras renombrar cada campo encontrado a su nombre lógico (en orden)
+    actuales = list(columnas)
+    campos = ESQUEMAS[esquema][1]
+    for (logico, _), p in zip(campos, posiciones_esquema(actuales, esquema)):
+        if p is not None:
+            col = actuales[p]
+            actuales = [logico if c == col else c for c in actuales]
+    return actuales
+
+
+def columnas_proyectadas(columnas: Sequence, esquema: str, extra: Iterable = ()) -> List:
+    # Columnas del archivo que usa el proceso (las resueltas + `extra` presentes), en orden de cabecera
+    columnas = list(columnas)
+    usadas = {p for p in posiciones_esquema(columnas, esquema) if p is not None}
+    extra = set(extra)
+    return [c for i, c in enumerate(columnas) if i in usadas or c in extra]
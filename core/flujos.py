@@ -0,0 +1,177 @@
+# core/flujos.py
+# ============================================================
+# Grafos de etapas de las dos páginas (core.pipeline)
+# - CAT (RVC) y ESP (Cavanet) declaran la misma cadena:
+#   parcelas -> final -> IT04 -> rendimiento ajustado -> cruce
+#   -> reparto -> resúmenes -> Excel.
+# - El cruce solo depende de Parcelas y de las pesadas; el kg/ha
+#   y el IT04 entran después (reasignar_rendimiento). Subir otro
+#   archivo de pesadas no repite Parcelas ni IT04; cambiar el
+#   kg/ha no repite lecturas ni cruces.
+# - Valores de entrada: archivo_parcelas, archivo_it04,
+#   archivo_pesadas (bytes o None), extra, rendimiento_ha,
+#   agrupar_por_ejercicio, incremental (+ it04_csv / pesadas_csv
+#   en RVC). El reparto incremental se pide con forzar=('procesado',);
+#   su estado guardado va por archivo de Parcelas.
+# - Las etapas de lectura miden por separado la lectura del libro
+#   y la normalización (core.telemetria); con caché no aparecen.
+# ============================================================
+
+from __future__ import annotations
+from typing import Optional, Tuple
+
+import pandas as pd
+
+from .cache import procesado_en_cache
+from .indice import IndiceParcelas
+from .lectura import leer_parcelas_excel, leer_tabla
+from .pipeline import Etapa, Pipeline
+from .telemetria import medido
+from .reparto import reasignar_rendimiento, ruta_estado_reparto
+from . import cavanet, it04, parcelas, rvc, export
+
+
+# ============================================================
+# CAT (RVC)
+# ============================================================
+def _parcelas_rvc(archivo: bytes, extra: Tuple) -> pd.DataFrame:
+    if archivo is None:
+        raise ValueError("Debe subir el archivo de Parcelas.")
+    return procesado_en_cache(
+        archivo, "cat.parcelas",
+        lambda data: medido('normalizacion', parcelas.procesar_parcelas,
+                            medido('lectura', leer_parcelas_excel, data, esquema="parcelas", extra=extra)),
+        extra=extra
+    )
+
+
+def _it04_rvc(archivo: Optional[bytes], es_csv: bool) -> pd.DataFrame:
+    # Sin archivo it04: ajustes nulos. El IT04 no tiene esquema: las columnas extra no le aplican
+    if archivo is None:
+        return pd.DataFrame(columns=["vartip", "kg_a_restar_total"])
+    return procesado_en_cache(
+        archivo, "cat.it04",
+        lambda data: medido('normalizacion', it04.cargar_it04, medido('lectura', leer_tabla, data, es_csv)),
+        csv=es_csv
+    )
+
+
+def _pesadas_rvc(archivo: bytes, es_csv: bool, extra: Tuple) -> pd.DataFrame:
+    if archivo is None:
+        raise ValueError("Debe subir un archivo RVC.")
+    return procesado_en_cache(
+        archivo, "cat.rvc",
+        lambda data: medido('normalizacion', rvc.procesar_rvc,
+                            medido('lectura', leer_tabla, data, es_csv, esquema="rvc", extra=extra)),
+        csv=es_csv, extra=extra
+    )
+
+
+def _cruce_rvc(df_rvc_clean: pd.DataFrame, df_parcelas_clean: pd.DataFrame, indice: IndiceParcelas) -> pd.DataFrame:
+    return rvc.crear_vartip_rvc(df_rvc_clean, None, df_parcelas_clean, None, indice=indice)
+
+
+def _procesado_rvc(df_con_rend: pd.DataFrame, incremental: bool, archivo_parcelas: bytes) -> pd.DataFrame:
+    if incremental:
+        return rvc.controlar_rendimientos_incremental(df_con_rend, ruta_estado_reparto('rvc', archivo_parcelas))
+    return rvc.controlar_rendimientos(df_con_rend)
+
+
+def _hojas_rvc(df_procesado: pd.DataFrame, resumenes: Tuple) -> dict:
+    return rvc.construir_hojas_salida(df_procesado, *resumenes)
+
+
+def _excel_rvc(hojas: dict, df_rend_ajustado: pd.DataFrame, df_it04_aggr: pd.DataFrame) -> bytes:
+    return export.exportar_excel_rvc(hojas, df_rend_ajustado=df_rend_ajustado, df_it04_aggr=df_it04_aggr)
+
+
+def flujo_rvc() -> Pipeline:
+    return Pipeline([
+        Etapa('parcelas', _parcelas_rvc, ('archivo_parcelas', 'extra')),
+        Etapa('indice', IndiceParcelas, ('parcelas',)),
+        Etapa('hect', parcelas.agregar_hectareas, ('parcelas', 'agrupar_por_ejercicio')),
+        Etapa('final', parcelas.aplicar_rendimiento_ha, ('hect', 'rendimiento_ha')),
+        Etapa('excel_parcelas', export.exportar_excel_parcelas, ('final', 'parcelas')),
+        Etapa('it04', _it04_rvc, ('archivo_it04', 'it04_csv')),
+        Etapa('rend_ajustado', it04.construir_rendimiento_ajustado, ('final', 'it04')),
+        Etapa('pesadas', _pesadas_rvc, ('archivo_pesadas', 'pesadas_csv', 'extra')),
+        Etapa('cruce', _cruce_rvc, ('pesadas', 'parcelas', 'indice')),
+        Etapa('con_rend', reasignar_rendimiento, ('cruce', 'rend_ajustado')),
+        Etapa('procesado', _procesado_rvc, ('con_rend', 'incremental', 'archivo_parcelas')),
+        Etapa('resumenes', rvc.generar_resumenes, ('procesado',)),
+        Etapa('hojas', _hojas_rvc, ('procesado', 'resumenes')),
+        Etapa('excel', _excel_rvc, ('hojas', 'rend_ajustado', 'it04')),
+    ])
+
+
+# ============================================================
+# ESP (Cavanet)
+# ============================================================
+def _parcelas_cavanet(archivo: bytes, extra: Tuple) -> pd.DataFrame:
+    if archivo is None:
+        raise ValueError("Debes subir Parcelas y Cavanet.")
+    return procesado_en_cache(
+        archivo, "esp.parcelas",
+        lambda data: medido('normalizacion', cavanet.procesar_parcelas,
+                            medido('lectura', cavanet.cargar_parcelas_desde_excel, data, extra=extra)),
+        extra=extra
+    )
+
+
+def _it04_cavanet(archivo: Optional[bytes]) -> Optional[pd.DataFrame]:
+    return procesado_en_cache(archivo, "esp.it04", cavanet.cargar_it04_df) if archivo else None
+
+
+def _rend_ajustado_cavanet(df_final: pd.DataFrame, df_it04_aggr: Optional[pd.DataFrame]) -> pd.DataFrame:
+    return cavanet.construir_rendimiento_ajustado(df_final, df_it04_aggr)[0]
+
+
+def _pesadas_cavanet(archivo: bytes, extra: Tuple) -> pd.DataFrame:
+    if archivo is None:
+        raise ValueError("Debes subir Parcelas y Cavanet.")
+    return procesado_en_cache(
+        archivo, "esp.cavanet",
+        lambda data: medido('normalizacion', cavanet.procesar_cavanet,
+                            medido('lectura', cavanet.cargar_cavanet_desde_excel, data, extra=extra)),
+        extra=extra
+    )
+
+
+def _cruce_cavanet(df_cav_clean: pd.DataFrame, df_parcelas_clean: pd.DataFrame, indice: IndiceParcelas) -> pd.DataFrame:
+    return cavanet.crear_vartip_cavanet(df_cav_clean, None, df_parcelas_clean, None, indice=indice)
+
+
+def _procesado_cavanet(df_con_rend: pd.DataFrame, incremental: bool, archivo_parcelas: bytes) -> pd.DataFrame:
+    if incremental:
+        return cavanet.controlar_rendimientos_por_fecha_incremental(df_con_rend, ruta_estado_reparto('cavanet', archivo_parcelas))
+    return cavanet.controlar_rendimientos_por_fecha(df_con_rend)
+
+
+def _excel_cavanet(df_procesado: pd.DataFrame, resumenes: Tuple, df_rend_ajustado: pd.DataFrame,
+                   df_it04_aggr: Optional[pd.DataFrame]) -> bytes:
+    resumen_bodegas, resumen_vartips, resumen_pgc = resumenes
+    return cavanet.build_excel_bytes_cavanet(
+        df_procesado=df_procesado,
+        resumen_bodegas=resumen_bodegas,
+        resumen_vartips=resumen_vartips,
+        df_rend_ajustado=df_rend_ajustado,
+        df_it04_aggr=df_it04_aggr,
+        pgc_resumen_vartip=resumen_pgc
+    )
+
+
+def flujo_cavanet() -> Pipeline:
+    return Pipeline([
+        Etapa('parcelas', _parcelas_cavanet, ('archivo_parcelas', 'extra')),
+        Etapa('indice', IndiceParcelas, ('parcelas',)),
+        Etapa('hect', cavanet.agregar_hectareas_parcelas, ('parcelas', 'agrupar_por_ejercicio')),
+        Etapa('final', cavanet.aplicar_rendimiento_ha, ('hect', 'rendimiento_ha')),
+        Etapa('it04', _it04_cavanet, ('archivo_it04',)),
+        Etapa('rend_ajustado', _rend_ajustado_cavanet, ('final', 'it04')),
+        Etapa('pesadas', _pesadas_cavanet, ('archivo_pesadas', 'extra')),
+        Etapa('cruce', _cruce_cavanet, ('pesadas', 'parcelas', 'indice')),
+        Etapa('con_rend', reasignar_rendimiento, ('cruce', 'rend_ajustado')),
+        Etapa('procesado', _procesado_cavanet, ('con_rend', 'incremental', 'archivo_parcelas')),
+        Etapa('resumenes', cavanet.generar_resumenes_cavanet, ('procesado',)),
+        Etapa('excel', _excel_cavanet, ('procesado', 'resumenes', 'rend_ajustado', 'it04')),
+    ])
@@ -0,0 +1,89 @@
+# core/indice.py
+# ============================================================
+# Índice de Parcelas para filtrar pesadas (RVC y Cavanet)
+# - Se construye una vez por Parcelas procesadas y se guarda en
+#   sesión: NIF de socios, VARTIP y pares (VARTIP, parcela).
+# - Los tres filtros de crear_vartip_* (socio, VARTIP con
+#   rendimiento, parcela registrada para el VARTIP) son búsquedas
+#   vectorizadas en esos índices, no merges sucesivos.
+# - No depende del kg/ha ni del IT04: el rendimiento ajustado se
+#   pasa en cada cruce.
+# ============================================================
+
+from __future__ import annotations
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from .categorias import combinar_claves, unificar
+
+
+class IndiceParcelas:
+    def __init__(self, df_parcelas_clean: pd.DataFrame):
+        # NIF de socios (= los 'nif' de dataframe_final, como texto)
+        self.socios = pd.Index(df_parcelas_clean['NIF'].astype(str).unique())
+
+        # VARTIP de Parcelas; las series vacías guardan el diccionario para recodificar
+        self._ref_vartip = df_parcelas_clean['vartip'].iloc[:0]
+        self.vartips = pd.Index(df_parcelas_clean['vartip'].dropna().unique())
+
+        # Pares (VARTIP, parcela) registrados como posiciones en los dos índices
+        self.hay_parcelas = ('RefParcela_norm' in df_parcelas_clean.columns
+                             and df_parcelas_clean['RefParcela_norm'].notna().any())
+        if self.hay_parcelas:
+            pares = df_parcelas_clean[['vartip', 'RefParcela_norm']].dropna()
+            self._ref_parcela = pares['RefParcela_norm'].iloc[:0]
+            self.parcelas = pd.Index(pares['RefParcela_norm'].unique())
+            claves = self._clave_par(self.vartips.get_indexer(pares['vartip']),
+                                     self.parcelas.get_indexer(pares['RefParcela_norm']))
+            self.pares = pd.Index(np.unique(claves))
+        else:
+            self._ref_parcela = pd.Series(dtype=object)
+            self.parcelas = pd.Index([])
+            self.pares = pd.Index(np.array([], dtype=np.int64))
+
+    def _clave_par(self, pos_vartip: np.ndarray, pos_parcela: np.ndarray) -> np.ndarray:
+        return pos_vartip.astype(np.int64) * max(len(self.parcelas), 1) + pos_parcela
+
+    def es_socio(self, nifs: pd.Series) -> np.ndarray:
+        return self.socios.get_indexer(nifs) >= 0
+
+    def vartip(self, codigo_variedad: pd.Series, nif: pd.Series) -> pd.Series:
+        # VARTIP de las pesadas con el diccionario de Parcelas (los que no existen quedan NaN)
+        return unificar(combinar_claves(codigo_variedad, nif), self._ref_vartip)
+
+    def cruzar(self, df: pd.DataFrame, df_rend_ajustado: Optional[pd.DataFrame], por_parcela: bool = True) -> pd.DataFrame:
+        """
+        Pesadas con VARTIP con rendimiento y, con `por_parcela`, de una parcela
+        registrada para ese VARTIP. Añade 'rendimiento' (ajustado por IT04);
+        mismo resultado que los INNER por 'vartip' y por ('vartip', 'RefParcela_norm').
+
+        Sin `df_rend_ajustado` cruzan todos los VARTIP de Parcelas (el rendimiento
+        ajustado tiene uno por VARTIP) y 'rendimiento' queda NaN, para asignarlo
+        después con reasignar_rendimiento: el cruce no depende del kg/ha ni del IT04.
+        """
+        # Rendimiento por posición de VARTIP (df_rend_ajustado: una fila por VARTIP)
+        rendimiento = np.full(len(self.vartips), np.nan)
+        if df_rend_ajustado is None:
+            tiene_rend = np.ones(len(self.vartips), dtype=bool)
+        else:
+            pos_rend = self.vartips.get_indexer(df_rend_ajustado['vartip'])
+            con_rend = pos_rend >= 0
+            rendimiento[pos_rend[con_rend]] = df_rend_ajustado['rendimiento_ajustado_total'].to_numpy(dtype=float)[con_rend]
+            tiene_rend = np.zeros(len(self.vartips), dtype=bool)
+            tiene_rend[pos_rend[con_rend]] = True
+
+        pos = self.vartips.get_indexer(df['vartip'])
+        ok = pos >= 0
+        ok[ok] = tiene_rend[pos[ok]]
+
+        if por_parcela:
+            df = df.assign(RefParcela_norm=unificar(df['RefParcela_norm'], self._ref_parcela))
+            pos_parc = self.parcelas.get_indexer(df['RefParcela_norm'])
+            ok &= pos_parc >= 0
+            ok[ok] = self.pares.get_indexer(self._clave_par(pos[ok], pos_parc[ok])) >= 0
+
+        out = df[ok].reset_index(drop=True)
+        out['rendimiento'] = rendimiento[pos[ok]]
+        return out
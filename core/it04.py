@@ -1,6 +1,9 @@
 import pandas as pd
 from typing import Tuple
 
+from .categorias import compactar_claves, unificar
+from .utils import columna_numerica
+
 def cargar_it04(df: pd.DataFrame) -> pd.DataFrame:
     # Normaliza nombres
     cols = {c.lower().strip(): c for c in df.columns}
@@ -11,17 +14,18 @@ def cargar_it04(df: pd.DataFrame) -> pd.DataFrame:
 
     df = df.rename(columns={col_vt:'vartip', col_kg:'kg_a_restar'})
     df['vartip'] = df['vartip'].astype(str).str.strip().str.upper()
-    df['kg_a_restar'] = pd.to_numeric(df['kg_a_restar'], errors='coerce').fillna(0.0)
+    df['kg_a_restar'] = columna_numerica(df, 'kg_a_restar', miles=True).fillna(0.0)
     df.loc[df['kg_a_restar'] < 0, 'kg_a_restar'] = 0.0
 
-    df_it04_aggr = df.groupby('vartip', dropna=False)['kg_a_restar'].sum().reset_index()
+    df_it04_aggr = df.groupby('vartip', dropna=False, observed=True)['kg_a_restar'].sum().reset_index()
     df_it04_aggr = df_it04_aggr.rename(columns={'kg_a_restar':'kg_a_restar_total'})
-    return df_it04_aggr
+    df_it04_aggr.attrs['no_numericos'] = df.attrs['no_numericos']
+    return compactar_claves(df_it04_aggr, ['vartip'])
 
 
 def construir_rendimiento_ajustado(df_final: pd.DataFrame, df_it04_aggr: pd.DataFrame) -> pd.DataFrame:
     # rendimiento total por VARTIP
-    rend_total = df_final.groupby('vartip', dropna=False)['rendimiento'].sum().reset_index()
+    rend_total = df_final.groupby('vartip', dropna=False, observed=True)['rendimiento'].sum().reset_index()
     rend_total = rend_total.rename(columns={'rendimiento':'rendimiento_total'})
 
     if df_it04_aggr is None or df_it04_aggr.empty:
@@ -29,6 +33,8 @@ def construir_rendimiento_ajustado(df_final: pd.DataFrame, df_it04_aggr: pd.Data
         rend_total['rendimiento_ajustado_total'] = rend_total['rendimiento_total']
         return rend_total
 
+    # IT04 al diccionario de VARTIP de Parcelas: el cruce compara códigos
+    df_it04_aggr = df_it04_aggr.assign(vartip=unificar(df_it04_aggr['vartip'], rend_total['vartip']))
     df_rend = rend_total.merge(df_it04_aggr, on='vartip', how='left')
     df_rend['kg_a_restar_total'] = df_rend['kg_a_restar_total'].fillna(0.0)
     df_rend['rendimiento_ajustado_total'] = (df_rend['rendimiento_total'] - df_rend['kg_a_restar_total']).clip(lower=0.0)
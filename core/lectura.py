@@ -0,0 +1,287 @@
+# core/lectura.py
+# ============================================================
+# Lectura de libros Excel en una sola pasada
+# - Abre el xlsx una vez en modo solo lectura (streaming).
+# - Decide la fila de cabecera con las primeras filas según llegan
+#   y sigue volcando las filas de datos en buffers por columna.
+# - Mismas conversiones que pd.read_excel (NA, enteros, numéricos
+#   en texto, 'Unnamed: n', columnas duplicadas 'X.1').
+# - Proyección: con un esquema (core.esquema) solo se convierten
+#   las columnas que usa el proceso (+ las extra pedidas).
+# ============================================================
+
+from __future__ import annotations
+import io
+from itertools import chain, islice, zip_longest
+from typing import Callable, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+import openpyxl
+
+from .esquema import columnas_proyectadas
+from .utils import norm_text
+
+
+# Valores que pd.read_excel interpreta como NA por defecto
+NA_VALORES = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+}
+ERRORES_EXCEL = {'#NULL!', '#DIV/0!', '#VALUE!', '#REF!', '#NAME?', '#NUM!', '#N/A'}
+
+_NA_O_ERROR = NA_VALORES | ERRORES_EXCEL
+
+COLUMNAS_PARCELAS_ESPERADAS = [
+    'Ejercicio','RefParcela','NRegistro','NIF','Apellidos','Nombre',
+    'Variedad','Superficie','PorcentajeTitularidad','Estado','Segmento'
+]
+FILA_CABECERA_PARCELAS_DESPLAZADA = 6
+
+COLUMNAS_CAVANET_ESPERADAS = [
+    'FECHA','TIQUET','BODEGA','NIFBODEGA','INSTALACION','DNI',
+    'NOMBREVITICULTOR','VARIEDAD','SEGMENTO','PARCELA','KG','ESTADO'
+]
+FILAS_BUSQUEDA_CABECERA_CAVANET = 30
+
+_FILAS_POR_BLOQUE = 5000
+
+
+def es_xlsx(data: bytes) -> bool:
+    return data[:2] == b'PK'
+
+
+def abrir_libro(data: bytes):
+    return openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+
+
+def _celda(v):
+    # Igual que el lector openpyxl de pandas: floats enteros -> int, errores -> NaN
+    if type(v) is float:
+        return int(v) if v.is_integer() else v
+    if type(v) is str and v in ERRORES_EXCEL:
+        return np.nan
+    return v
+
+
+def _ultima_llena(valores: Sequence) -> int:
+    # Índice del último valor no vacío (-1 si no hay ninguno)
+    for j in range(len(valores) - 1, -1, -1):
+        v = valores[j]
+        if v is not None and v != '':
+            return j
+    return -1
+
+
+def _columna(valores: list) -> pd.Series:
+    arr = np.empty(len(valores), dtype=object)
+    arr[:] = valores
+    vacio = pd.isna(arr) | pd.Series(arr).isin(_NA_O_ERROR).to_numpy()
+    arr[vacio] = np.nan
+    try:
+        num = pd.Series(pd.to_numeric(arr))
+    except (ValueError, TypeError):
+        # Columna de texto/fechas: floats enteros -> int, como el lector de pandas
+        arr[:] = [_celda(v) for v in arr]
+        return pd.Series(arr).infer_objects()
+    if (num.dtype.kind == 'f' and len(num) and not vacio.any()
+            and pd.api.types.infer_dtype(arr) in ('floating', 'mixed-integer-float')
+            and np.all(np.mod(num.to_numpy(), 1) == 0)):
+        return num.astype('int64')
+    return num
+
+
+def _nombres_columnas(cabecera: Sequence, ancho: int) -> List:
+    nombres, vistos = [], {}
+    for i in range(ancho):
+        v = cabecera[i] if i < len(cabecera) else None
+        v = _celda(v) if v is not None else None
+        if v is None or (isinstance(v, float) and np.isnan(v)) or v == '':
+            v = f"Unnamed: {i}"
+        base, k = v, vistos.get(v, 0)
+        while v in vistos:
+            k += 1
+            v = f"{base}.{k}"
+        vistos[base] = k
+        vistos[v] = 0
+        nombres.append(v)
+    return nombres
+
+
+def leer_hoja(
+    ws,
+    elegir_cabecera: Optional[Callable[[List[tuple]], int]] = None,
+    n_previas: int = 10,
+    elegir_columnas: Optional[Callable[[List], Iterable]] = None
+) -> pd.DataFrame:
+    """
+    Lee una hoja (openpyxl, modo solo lectura) recorriéndola una sola vez.
+
+    `elegir_cabecera` recibe las primeras `n_previas` filas y devuelve el índice
+    (0-based, filas físicas) de la cabecera; por defecto la primera fila.
+    `elegir_columnas` recibe los nombres de columna y devuelve los que se quieren;
+    el resto no llega a convertirse ni a formar parte del DataFrame.
+    """
+    filas = ws.iter_rows(values_only=True)
+    previas = list(islice(filas, n_previas))
+    hdr = elegir_cabecera(previas) if elegir_cabecera else 0
+    todas = chain(previas, filas)
+
+    # Filas anteriores a la cabecera: solo cuentan para el ancho
+    ancho = 0
+    cabecera: tuple = ()
+    for i, fila in enumerate(islice(todas, hdr + 1)):
+        fila = fila or ()
+        ancho = max(ancho, _ultima_llena(fila) + 1)
+        if i == hdr:
+            cabecera = fila
+
+    # Datos: se transponen por bloques de filas a un buffer por columna
+    bufs: List[list] = []
+    n = 0
+    while True:
+        bloque = [f or () for f in islice(todas, _FILAS_POR_BLOQUE)]
+        if not bloque:
+            break
+        cols = list(zip_longest(*bloque))
+        if len(cols) > len(bufs):
+            bufs.extend([None] * n for _ in range(len(cols) - len(bufs)))
+        for j, buf in enumerate(bufs):
+            buf.extend(cols[j] if j < len(cols) else [None] * len(bloque))
+        n += len(bloque)
+
+    # Ancho útil: última columna con algún valor en cualquier fila; sin filas vacías al final (como pandas)
+    ultimas = [_ultima_llena(buf) for buf in bufs]
+    llenas = [j for j, u in enumerate(ultimas) if u >= 0]
+    if llenas:
+        ancho = max(ancho, llenas[-1] + 1)
+    n = max(ultimas, default=-1) + 1
+
+    nombres = _nombres_columnas(cabecera, ancho)
+    pedidas = set(elegir_columnas(nombres)) if elegir_columnas else None
+    datos, elegidos = {}, []
+    for j, nombre in enumerate(nombres):
+        if pedidas is not None and nombre not in pedidas:
+            continue
+        valores = bufs[j][:n] if j < len(bufs) else [None] * n
+        datos[j] = _columna(valores)
+        elegidos.append(nombre)
+    df = pd.DataFrame(datos, index=pd.RangeIndex(n))
+    df.columns = elegidos
+    return df
+
+
+def columnas_extra(texto: str) -> List[str]:
+    # 'Municipio, Poligono' -> columnas del archivo a conservar además de las del esquema
+    return [c.strip() for c in (texto or '').split(',') if c.strip()]
+
+
+def _proyeccion(esquema: Optional[str], extra: Iterable = ()) -> Optional[Callable[[List], List]]:
+    if esquema is None:
+        return None
+    extra = list(extra)
+    return lambda nombres: columnas_proyectadas(nombres, esquema, extra)
+
+
+def _proyectar(df: pd.DataFrame, esquema: Optional[str], extra: Iterable = ()) -> pd.DataFrame:
+    # Lectores que no son de streaming (xls, csv ya leído): se proyecta después de leer
+    if esquema is None:
+        return df
+    return df[columnas_proyectadas(df.columns, esquema, extra)]
+
+
+def _cabecera_parcelas(previas: List[tuple]) -> int:
+    primera = previas[0] if previas else ()
+    cols_norm = [norm_text(c) for c in primera]
+    esper_norm = [norm_text(c) for c in COLUMNAS_PARCELAS_ESPERADAS]
+    coincidencias = sum(1 for c in esper_norm if c in cols_norm)
+    return 0 if coincidencias >= 4 else FILA_CABECERA_PARCELAS_DESPLAZADA
+
+
+def leer_parcelas_excel(
+    data: bytes,
+    sheet_name: Optional[str] = None,
+    esquema: Optional[str] = None,
+    extra: Iterable = ()
+) -> pd.DataFrame:
+    # Cabecera en la fila 1 o, si no se reconocen las columnas, desplazada a la fila 7 (metadatos del registro).
+    # sheet_name=None: 'Parcelas' si existe, si no la primera hoja.
+    # esquema ('parcelas' / 'cavanet.parcelas'): solo las columnas que usa ese proceso + `extra`.
+    if not es_xlsx(data):
+        xls = pd.ExcelFile(io.BytesIO(data))
+        hoja = sheet_name or ('Parcelas' if 'Parcelas' in xls.sheet_names else xls.sheet_names[0])
+        df_test = xls.parse(sheet_name=hoja, nrows=10)
+        hdr = _cabecera_parcelas([tuple(df_test.columns)])
+        return _proyectar(xls.parse(sheet_name=hoja, skiprows=hdr), esquema, extra)
+
+    wb = abrir_libro(data)
+    try:
+        hoja = sheet_name or ('Parcelas' if 'Parcelas' in wb.sheetnames else wb.sheetnames[0])
+        return leer_hoja(wb[hoja], elegir_cabecera=_cabecera_parcelas, n_previas=FILA_CABECERA_PARCELAS_DESPLAZADA + 1,
+                         elegir_columnas=_proyeccion(esquema, extra))
+    finally:
+        wb.close()
+
+
+def leer_tabla(data: bytes, es_csv: bool = False, esquema: Optional[str] = None, extra: Iterable = ()) -> pd.DataFrame:
+    # Primera hoja (o CSV) con cabecera en la primera fila, como pd.read_excel / pd.read_csv
+    if es_csv:
+        if esquema is None:
+            return pd.read_csv(io.BytesIO(data))
+        cabecera = pd.read_csv(io.BytesIO(data), nrows=0).columns
+        return pd.read_csv(io.BytesIO(data), usecols=columnas_proyectadas(cabecera, esquema, extra))
+    if not es_xlsx(data):
+        return _proyectar(pd.read_excel(io.BytesIO(data)), esquema, extra)
+    wb = abrir_libro(data)
+    try:
+        return leer_hoja(wb[wb.sheetnames[0]], elegir_columnas=_proyeccion(esquema, extra))
+    finally:
+        wb.close()
+
+
+# ============================================================
+# CAVANET
+# ============================================================
+def puntuar_cabeceras(previas: List[tuple], esperadas: Sequence[str]) -> np.ndarray:
+    # Nº de celdas de cada fila que coinciden (normalizadas) con las columnas esperadas
+    if not previas:
+        return np.zeros(0, dtype=int)
+    ancho = max(len(f or ()) for f in previas)
+    celdas = pd.Series([v for f in previas for v in chain(f or (), [None] * (ancho - len(f or ())))], dtype=object)
+    codigos, uniques = pd.factorize(celdas, use_na_sentinel=True)
+    acierto = np.append(pd.Index(uniques.map(norm_text)).isin(set(esperadas)), False)
+    return acierto[codigos].reshape(len(previas), ancho).sum(axis=1)
+
+
+def _cabecera_cavanet(previas: List[tuple]) -> int:
+    puntos = puntuar_cabeceras(previas, COLUMNAS_CAVANET_ESPERADAS)
+    if len(puntos) == 0 or puntos.max() < 4:
+        return 0
+    return int(puntos.argmax())
+
+
+def _hoja_cavanet(hojas: List[str]) -> str:
+    for s in hojas:
+        s_norm = norm_text(s)
+        if 'PESAD' in s_norm or 'BODEGA' in s_norm or 'DETALLE' in s_norm:
+            return s
+    return hojas[0]
+
+
+def leer_cavanet_excel(data: bytes, esquema: Optional[str] = None, extra: Iterable = ()) -> pd.DataFrame:
+    # Hoja de pesadas y cabecera con más coincidencias en las primeras 30 filas, con el libro abierto una vez
+    if not es_xlsx(data):
+        xls = pd.ExcelFile(io.BytesIO(data))
+        hoja = _hoja_cavanet(xls.sheet_names)
+        preview = xls.parse(sheet_name=hoja, header=None, nrows=FILAS_BUSQUEDA_CABECERA_CAVANET)
+        hdr = _cabecera_cavanet([tuple(r) for r in preview.itertuples(index=False)])
+        df = _proyectar(xls.parse(sheet_name=hoja, header=hdr), esquema, extra)
+    else:
+        wb = abrir_libro(data)
+        try:
+            hoja = _hoja_cavanet(wb.sheetnames)
+            df = leer_hoja(wb[hoja], elegir_cabecera=_cabecera_cavanet, n_previas=FILAS_BUSQUEDA_CABECERA_CAVANET,
+                           elegir_columnas=_proyeccion(esquema, extra))
+        finally:
+            wb.close()
+    return df.dropna(axis=1, how='all')
@@ -0,0 +1,178 @@
+# core/lote.py
+# ============================================================
+# Proceso por lotes sin navegador (cierre de campaña)
+# - Manifiesto JSON con un conjunto de entradas por celler:
+#   [{"nombre": "celler_a", "tipo": "rvc" | "cavanet",
+#     "parcelas": "...", "it04": "..." (opc.), "pesadas": "...",
+#     "rendimiento_ha": 10500, "agrupar_por_ejercicio": true,
+#     "extra": ["col"]}]
+#   Rutas relativas al manifiesto; parámetros opcionales.
+# - Cada conjunto recorre el mismo grafo de etapas que su página
+#   (core.flujos) en un proceso del pool: un Excel por conjunto,
+#   su telemetría por etapa en JSON al lado (core.telemetria) y
+#   resumen_lote.csv con estado, totales y tiempos.
+# - Sin reparto incremental: el estado guardado es de la app.
+# - Con varios procesos, cada uno exporta su Excel en serie: el
+#   pool de hojas de core.xlsx multiplicaría los procesos.
+#
+# Uso: python -m core.lote manifiesto.json -o salida -j 4 [--memoria]
+# ============================================================
+
+from __future__ import annotations
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from .cavanet import RENDIMIENTO_POR_HECTAREA_DEFAULT, AGRUPAR_POR_EJERCICIO_DEFAULT
+from . import xlsx
+from .flujos import flujo_cavanet, flujo_rvc
+from .telemetria import a_json
+
+TIPOS = ('rvc', 'cavanet')
+COLUMNAS_RESUMEN = ['nombre', 'tipo', 'estado', 'error', 'pesadas', 'total_kg_cava', 'total_kg_pgc',
+                    'segundos', 'archivo']
+
+
+def leer_manifiesto(ruta: str) -> List[Dict]:
+    with open(ruta, 'r', encoding='utf-8') as f:
+        conjuntos = json.load(f)
+    if isinstance(conjuntos, dict):
+        conjuntos = conjuntos.get('conjuntos', [])
+    base = os.path.dirname(os.path.abspath(ruta))
+    nombres = set()
+    for i, c in enumerate(conjuntos):
+        c.setdefault('nombre', f"conjunto_{i + 1}")
+        c['tipo'] = str(c.get('tipo', 'rvc')).lower()
+        if c['tipo'] not in TIPOS:
+            raise ValueError(f"{c['nombre']}: tipo '{c['tipo']}' no válido ({', '.join(TIPOS)}).")
+        if c['nombre'] in nombres:
+            raise ValueError(f"Nombre de conjunto repetido: {c['nombre']}")
+        nombres.add(c['nombre'])
+        for clave in ('parcelas', 'it04', 'pesadas'):
+            if c.get(clave):
+                c[clave] = os.path.join(base, c[clave])
+    return conjuntos
+
+
+def _leer(ruta: Optional[str]) -> Optional[bytes]:
+    if not ruta:
+        return None
+    with open(ruta, 'rb') as f:
+        return f.read()
+
+
+def _es_csv(ruta: Optional[str]) -> bool:
+    return bool(ruta) and ruta.lower().endswith('.csv')
+
+
+def procesar_conjunto(conjunto: Dict, salida: str) -> Dict:
+    # Un conjunto de entradas -> Excel de resultados; devuelve su fila del resumen (no lanza)
+    inicio = time.perf_counter()
+    fila = {'nombre': conjunto['nombre'], 'tipo': conjunto['tipo'], 'estado': 'ok', 'error': ''}
+    try:
+        if not conjunto.get('parcelas') or not conjunto.get('pesadas'):
+            raise ValueError("El conjunto necesita 'parcelas' y 'pesadas'.")
+        valores = dict(
+            archivo_parcelas=_leer(conjunto['parcelas']),
+            archivo_it04=_leer(conjunto.get('it04')),
+            archivo_pesadas=_leer(conjunto['pesadas']),
+            extra=tuple(conjunto.get('extra', ())),
+            rendimiento_ha=float(conjunto.get('rendimiento_ha', RENDIMIENTO_POR_HECTAREA_DEFAULT)),
+            agrupar_por_ejercicio=bool(conjunto.get('agrupar_por_ejercicio', AGRUPAR_POR_EJERCICIO_DEFAULT)),
+            incremental=False,
+        )
+        if conjunto['tipo'] == 'rvc':
+            flujo = flujo_rvc()
+            valores.update(it04_csv=_es_csv(conjunto.get('it04')), pesadas_csv=_es_csv(conjunto['pesadas']))
+        else:
+            flujo = flujo_cavanet()
+        salidas = flujo.ejecutar(['excel'], **valores)
+
+        archivo = os.path.join(salida, f"{conjunto['nombre']}_analisis_pesadas_{conjunto['tipo']}_resultados.xlsx")
+        with open(archivo, 'wb') as f:
+            f.write(salidas['excel'])
+        with open(os.path.splitext(archivo)[0] + '_telemetria.json', 'wb') as f:
+            f.write(a_json(flujo.medidas, conjunto=conjunto['nombre'], flujo=conjunto['tipo'],
+                           rendimiento_ha=valores['rendimiento_ha'],
+                           agrupar_por_ejercicio=valores['agrupar_por_ejercicio']))
+        procesado = salidas['procesado']
+        fila.update(pesadas=len(procesado),
+                    total_kg_cava=round(float(procesado['kg_cava'].sum()), 2),
+                    total_kg_pgc=round(float(procesado['kg_pgc'].sum()), 2),
+                    archivo=archivo)
+    except Exception as e:
+        fila.update(estado='error', error=f"{type(e).__name__}: {e}")
+    fila['segundos'] = round(time.perf_counter() - inicio, 2)
+    return fila
+
+
+def _iniciar_trabajador() -> None:
+    # Exportación en serie dentro del pool del lote (y en lo que lance)
+    os.environ['PGC_EXPORT_PROCESOS'] = '1'
+    xlsx.PROCESOS_EXPORTACION = 1
+
+
+def ejecutar_lote(conjuntos: List[Dict], salida: str, trabajos: Optional[int] = None,
+                  al_terminar=None) -> pd.DataFrame:
+    """
+    Procesa los conjuntos en un pool de `trabajos` procesos (por defecto, uno por
+    núcleo) y escribe los Excel y resumen_lote.csv en `salida`. `al_terminar(fila)`
+    se llama al acabar cada conjunto. Devuelve el resumen en el orden del manifiesto.
+    """
+    os.makedirs(salida, exist_ok=True)
+    trabajos = max(1, min(trabajos or os.cpu_count() or 1, len(conjuntos) or 1))
+    filas: Dict[str, Dict] = {}
+    if trabajos == 1:
+        for c in conjuntos:
+            filas[c['nombre']] = procesar_conjunto(c, salida)
+            if al_terminar is not None:
+                al_terminar(filas[c['nombre']])
+    else:
+        with ProcessPoolExecutor(max_workers=trabajos, initializer=_iniciar_trabajador) as pool:
+            futuros = {pool.submit(procesar_conjunto, c, salida): c['nombre'] for c in conjuntos}
+            for futuro in as_completed(futuros):
+                filas[futuros[futuro]] = futuro.result()
+                if al_terminar is not None:
+                    al_terminar(filas[futuros[futuro]])
+
+    resumen = pd.DataFrame([filas[c['nombre']] for c in conjuntos], columns=COLUMNAS_RESUMEN)
+    resumen['pesadas'] = resumen['pesadas'].astype('Int64')  # vacío en los conjuntos con error
+    resumen.to_csv(os.path.join(salida, 'resumen_lote.csv'), index=False, encoding='utf-8')
+    return resumen
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog='python -m core.lote',
+        description="Análisis RVC / Cavanet de varios cellers sin navegador."
+    )
+    parser.add_argument('manifiesto', help="JSON con los conjuntos de entradas")
+    parser.add_argument('-o', '--salida', default='resultados_lote', help="Carpeta de resultados")
+    parser.add_argument('-j', '--trabajos', type=int, default=None, help="Procesos en paralelo (por defecto, núcleos)")
+    parser.add_argument('--memoria', action='store_true',
+                        help="Medir el pico de memoria por etapa (tracemalloc; bastante más lento)")
+    args = parser.parse_args(argv)
+    if args.memoria:
+        os.environ['PGC_TELEMETRIA_MEMORIA'] = '1'  # lo heredan los procesos del pool
+
+    conjuntos = leer_manifiesto(args.manifiesto)
+
+    def informar(fila):
+        detalle = fila['archivo'] if fila['estado'] == 'ok' else fila['error']
+        print(f"[{fila['estado']}] {fila['nombre']} ({fila['tipo']}, {fila['segundos']} s): {detalle}", flush=True)
+
+    resumen = ejecutar_lote(conjuntos, args.salida, args.trabajos, al_terminar=informar)
+    errores = int((resumen['estado'] != 'ok').sum())
+    print(f"{len(resumen) - errores}/{len(resumen)} conjuntos procesados; resumen en "
+          f"{os.path.join(args.salida, 'resumen_lote.csv')}")
+    return 1 if errores else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
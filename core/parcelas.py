@@ -2,105 +2,21 @@ import pandas as pd
 import numpy as np
 from .utils import (
     norm_text, norm_segmento, norm_variedad, norm_nif, norm_refparcela,
-    to_numeric_safe, codigo_variedad_from_name, crear_diccionario_variedades,
-    find_col, find_col_by_terms
+    columna_numerica, normalizar
 )
-
-def _pick_superficie_col(df: pd.DataFrame) -> str | None:
-    """
-    Busca una columna de 'Superficie' de forma robusta (insensible a acentos y variantes).
-    Prioriza nombres más específicos si hay varias coincidencias.
-    """
-    # 1) candidatos directos más comunes
-    direct_candidates = [
-        'Superficie', 'Superfície', 'superficie',
-        'Superficie (ha)', 'Superfície (ha)',
-        'Sup', 'sup', 'Sup (ha)', 'sup (ha)',
-        'Hectáreas', 'Hectareas', 'Hectárea', 'Hectarea',
-        'ha', 'HA'
-    ]
-    col = find_col(df, direct_candidates)
-    if col:
-        return col
-
-    # 2) por términos contenidos
-    #   - primero SUPERFIC, luego HECTA
-    for terms in (['SUPERFIC'], ['HECTA'], ['HA']):
-        col = find_col_by_terms(df, terms)
-        if col:
-            return col
-
-    return None
-
+from .esquema import renombrar_columnas
+from .variedades import catalogo_variedades
+from .categorias import compactar_claves, combinar_claves
 
 def procesar_parcelas(df: pd.DataFrame) -> pd.DataFrame:
-    df_clean = df.copy()
-
     # ---- Detección y renombrado de columnas (robusto) ----
-    # Usamos find_col (insensible a acentos/case) y, si hace falta, find_col_by_terms (por fragmentos)
-    # Para cada clave lógica, intentamos varios alias.
-
-    # NIF
-    col_nif = find_col(df_clean, ['NIF', 'nif'])
-    if col_nif:
-        df_clean.rename(columns={col_nif: 'NIF'}, inplace=True)
-
-    # Variedad
-    col_var = find_col(df_clean, ['Variedad', 'variedad', 'Varietat', 'varietat'])
-    if col_var:
-        df_clean.rename(columns={col_var: 'Variedad'}, inplace=True)
-
-    # RefParcela
-    col_refp = find_col(df_clean, [
-        'RefParcela', 'refparcela', 'Ref_Parcela', 'Ref Parcela', 'Ref parcela',
-        'origenParcela', 'origenParcella'
-    ]) or find_col_by_terms(df_clean, ['PARCEL'])
-    if col_refp:
-        df_clean.rename(columns={col_refp: 'RefParcela'}, inplace=True)
-
-    # Superficie (robusta)
-    col_sup = _pick_superficie_col(df_clean)
-    if col_sup:
-        df_clean.rename(columns={col_sup: 'Superficie'}, inplace=True)
-
-    # Segmento
-    col_seg = find_col(df_clean, ['Segmento', 'segmento'])
-    if col_seg:
-        df_clean.rename(columns={col_seg: 'Segmento'}, inplace=True)
-
-    # Nombre / Apellidos
-    col_nom = find_col(df_clean, ['Nombre', 'nombre'])
-    if col_nom:
-        df_clean.rename(columns={col_nom: 'Nombre'}, inplace=True)
-    col_ape = find_col(df_clean, ['Apellidos', 'apellidos'])
-    if col_ape:
-        df_clean.rename(columns={col_ape: 'Apellidos'}, inplace=True)
-
-    # Ejercicio
-    col_ej = find_col(df_clean, ['Ejercicio', 'ejercicio', 'Any', 'Año', 'ano', 'Ano'])
-    if col_ej:
-        df_clean.rename(columns={col_ej: 'Ejercicio'}, inplace=True)
-
-    # PorcentajeTitularidad
-    col_tit = find_col(df_clean, [
-        'PorcentajeTitularidad', 'porcentajetitularidad', 'Porcentaje Titularidad', 'PorcTitularidad'
-    ])
-    if col_tit:
-        df_clean.rename(columns={col_tit: 'PorcentajeTitularidad'}, inplace=True)
-
-    # NRegistro
-    col_reg = find_col(df_clean, ['NRegistro', 'Nº Registro', 'NºRegistro', 'NumRegistro'])
-    if col_reg:
-        df_clean.rename(columns={col_reg: 'NRegistro'}, inplace=True)
-
-    # Estado
-    col_est = find_col(df_clean, ['Estado', 'estado', 'Estat', 'estat', 'Status'])
-    if col_est:
-        df_clean.rename(columns={col_est: 'Estado'}, inplace=True)
+    # Alias de cada columna lógica en core.esquema ('parcelas'), insensibles a acentos/case;
+    # la resolución se memoriza por cabecera. set_axis no copia los datos (copy-on-write).
+    df_clean = df.set_axis(renombrar_columnas(df.columns, 'parcelas'), axis=1)
 
     # ---- Filtros: Segmento = GUARDA (excluye Guarda Superior implícitamente) ----
     if 'Segmento' in df_clean.columns:
-        df_clean['Segmento'] = df_clean['Segmento'].astype(str).map(norm_segmento)
+        df_clean['Segmento'] = normalizar(df_clean['Segmento'].astype(str), norm_segmento)
         before = len(df_clean)
         df_clean = df_clean[df_clean['Segmento'] == 'GUARDA']
         # print(f"Filtro Segmento=GUARDA: {before} → {len(df_clean)}")
@@ -108,13 +24,13 @@ def procesar_parcelas(df: pd.DataFrame) -> pd.DataFrame:
     # ---- Filtro: Estado = VALIDADA ----
     if 'Estado' in df_clean.columns:
         before = len(df_clean)
-        df_clean['Estado'] = df_clean['Estado'].astype(str).map(norm_text)
+        df_clean['Estado'] = normalizar(df_clean['Estado'].astype(str), norm_text)
         df_clean = df_clean[df_clean['Estado'] == 'VALIDADA']
         # print(f"Filtro Estado=VALIDADA: {before} → {len(df_clean)}")
 
     # ---- NIF ----
     if 'NIF' in df_clean.columns:
-        df_clean['NIF'] = df_clean['NIF'].map(norm_nif)
+        df_clean['NIF'] = normalizar(df_clean['NIF'], norm_nif)
         df_clean = df_clean[df_clean['NIF'] != ""]
     else:
         # No abortamos, pero sin NIF no habrá VARTIP válido
@@ -122,11 +38,11 @@ def procesar_parcelas(df: pd.DataFrame) -> pd.DataFrame:
 
     # ---- Variedad ----
     if 'Variedad' in df_clean.columns:
-        df_clean['Variedad'] = df_clean['Variedad'].map(norm_variedad)
+        df_clean['Variedad'] = normalizar(df_clean['Variedad'], norm_variedad)
 
     # ---- Superficie -> numérico ----
     if 'Superficie' in df_clean.columns:
-        df_clean['Superficie'] = df_clean['Superficie'].map(to_numeric_safe)
+        df_clean['Superficie'] = columna_numerica(df_clean, 'Superficie')
         df_clean = df_clean.dropna(subset=['Superficie'])
     else:
         # Aquí estaba tu error; ahora damos un mensaje claro y listamos columnas detectadas.
@@ -140,7 +56,7 @@ def procesar_parcelas(df: pd.DataFrame) -> pd.DataFrame:
 
     # ---- PorcentajeTitularidad -> superficie_efectiva ----
     if 'PorcentajeTitularidad' in df_clean.columns:
-        df_clean['PorcentajeTitularidad'] = pd.to_numeric(df_clean['PorcentajeTitularidad'], errors='coerce').fillna(100)
+        df_clean['PorcentajeTitularidad'] = columna_numerica(df_clean, 'PorcentajeTitularidad').fillna(100)
         df_clean['PorcentajeTitularidad'] = df_clean['PorcentajeTitularidad'].clip(0, 100)
         df_clean['superficie_efectiva'] = df_clean['Superficie'] * (df_clean['PorcentajeTitularidad'] / 100.0)
     else:
@@ -155,20 +71,19 @@ def procesar_parcelas(df: pd.DataFrame) -> pd.DataFrame:
         df_clean['nombre_completo'] = 'N/A'
 
     # ---- Código variedad + VARTIP ----
-    dict_var = crear_diccionario_variedades()
     if 'Variedad' in df_clean.columns:
-        df_clean['codigo_variedad'] = df_clean['Variedad'].map(lambda s: dict_var.get(s, codigo_variedad_from_name(s)))
+        df_clean['codigo_variedad'] = catalogo_variedades().resolver(df_clean['Variedad'])
     else:
         df_clean['codigo_variedad'] = 'UNK'
 
     if 'NIF' in df_clean.columns:
-        df_clean['vartip'] = df_clean['codigo_variedad'].astype(str) + '-' + df_clean['NIF'].astype(str)
+        df_clean['vartip'] = combinar_claves(df_clean['codigo_variedad'], df_clean['NIF'])
     else:
         df_clean['vartip'] = df_clean['codigo_variedad'].astype(str) + '-'
 
     # ---- RefParcela normalizada ----
     if 'RefParcela' in df_clean.columns:
-        df_clean['RefParcela_norm'] = df_clean['RefParcela'].map(norm_refparcela)
+        df_clean['RefParcela_norm'] = normalizar(df_clean['RefParcela'], norm_refparcela)
     else:
         df_clean['RefParcela_norm'] = ""
 
@@ -177,17 +92,19 @@ def procesar_parcelas(df: pd.DataFrame) -> pd.DataFrame:
         ej_num = pd.to_numeric(df_clean['Ejercicio'], errors='coerce')
         df_clean['Ejercicio'] = np.where(ej_num.notna(), ej_num.astype('Int64'), df_clean['Ejercicio'].astype(str))
 
-    return df_clean
+    # ---- Claves (vartip, NIF, Variedad...) como category ----
+    return compactar_claves(df_clean)
 
 
-def crear_dataframe_final(df_clean: pd.DataFrame, rendimiento_ha: float, agrupar_por_ejercicio: bool = True) -> pd.DataFrame:
+def agregar_hectareas(df_clean: pd.DataFrame, agrupar_por_ejercicio: bool = True) -> pd.DataFrame:
+    # Agregado por clave (Ejercicio+VARTIP o VARTIP) sin redondear; no depende del kg/ha
     if agrupar_por_ejercicio and ('Ejercicio' in df_clean.columns):
         clave = ['Ejercicio', 'vartip']
     else:
         clave = ['vartip']
 
     hectareas_por_vartip = (
-        df_clean.groupby(clave, dropna=False)['superficie_efectiva']
+        df_clean.groupby(clave, dropna=False, observed=True)['superficie_efectiva']
         .sum()
         .reset_index()
         .rename(columns={'superficie_efectiva': 'hectareas_variedad'})
@@ -201,14 +118,18 @@ def crear_dataframe_final(df_clean: pd.DataFrame, rendimiento_ha: float, agrupar
         'codigo_variedad': 'first'
     }
 
-    df_final = (
-        df_clean.groupby(clave, dropna=False)
+    df_hect = (
+        df_clean.groupby(clave, dropna=False, observed=True)
         .agg(agg_dict)
         .reset_index()
         .merge(hectareas_por_vartip, on=clave, how='left')
     )
+    return df_hect
 
-    df_final['rendimiento'] = df_final['hectareas_variedad'] * float(rendimiento_ha)
+
+def aplicar_rendimiento_ha(df_hect: pd.DataFrame, rendimiento_ha: float) -> pd.DataFrame:
+    # De hectáreas agregadas a dataframe_final: solo reescala 'rendimiento'
+    df_final = df_hect.assign(rendimiento=df_hect['hectareas_variedad'] * float(rendimiento_ha))
 
     rename_map = {'NIF': 'nif', 'nombre_completo': 'nombre', 'Segmento': 'segmento'}
     if 'Ejercicio' in df_final.columns:
@@ -225,3 +146,6 @@ def crear_dataframe_final(df_clean: pd.DataFrame, rendimiento_ha: float, agrupar
     df_final = df_final.sort_values(sort_cols, ascending=[True, False] if 'ejercicio' in df_final.columns else [False]).reset_index(drop=True)
     return df_final
 
+
+def crear_dataframe_final(df_clean: pd.DataFrame, rendimiento_ha: float, agrupar_por_ejercicio: bool = True) -> pd.DataFrame:
+    return aplicar_rendimiento_ha(agregar_hectareas(df_clean, agrupar_por_ejercicio), rendimiento_ha)
@@ -0,0 +1,191 @@
+# core/pipeline.py
+# ============================================================
+# Motor de etapas (grafo) con memoria por etapa
+# - Cada etapa declara sus entradas: otras etapas o valores
+#   (archivos subidos, parámetros de la barra lateral).
+# - Huella de una etapa = su nombre + huellas de sus entradas
+#   (sha1 de los bytes de un archivo, repr JSON de un parámetro,
+#   huella de la etapa previa). No se hashean DataFrames.
+# - Solo se ejecutan las etapas cuya huella cambió; del resto se
+#   reutiliza la última salida (una por etapa).
+# - `forzar`: etapas con efectos (reparto incremental) que se
+#   repiten siempre, junto con todo lo que depende de ellas (su
+#   huella lleva un nonce aleatorio: no se repite entre copias).
+# - Las huellas no dependen de las salidas: qué etapas se van a
+#   ejecutar se sabe antes de empezar (progreso real), y una copia
+#   del grafo puede ejecutarse en otro proceso (core.trabajos).
+# - Cada etapa ejecutada se mide (core.telemetria): `medidas`.
+# ============================================================
+
+from __future__ import annotations
+import hashlib
+import json
+import uuid
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .telemetria import Medida, filas, medir, registrar
+
+
+@dataclass(frozen=True)
+class Etapa:
+    nombre: str
+    funcion: Callable[..., Any]
+    entradas: Tuple[str, ...] = ()
+
+
+def huella_valor(valor: Any) -> str:
+    if isinstance(valor, (bytes, bytearray, memoryview)):
+        return 'b:' + hashlib.sha1(valor).hexdigest()
+    return 'v:' + json.dumps(valor, sort_keys=True, default=str)
+
+
+class Pipeline:
+    def __init__(self, etapas: Iterable[Etapa]):
+        self.etapas: Dict[str, Etapa] = {}
+        for etapa in etapas:
+            if etapa.nombre in self.etapas:
+                raise ValueError(f"Etapa repetida: {etapa.nombre}")
+            self.etapas[etapa.nombre] = etapa
+        self._comprobar_ciclos()
+        self.valores: Dict[str, Any] = {}
+        self._huellas_valores: Dict[str, str] = {}
+        self.ejecutadas: List[str] = []
+        self.medidas: List[Medida] = []
+        self._memoria: Dict[str, Tuple[str, Any]] = {}
+
+    def _comprobar_ciclos(self) -> None:
+        estado: Dict[str, int] = {}  # 1 = visitando, 2 = hecho
+
+        def visitar(nombre: str, camino: List[str]) -> None:
+            if estado.get(nombre) == 2 or nombre not in self.etapas:
+                return
+            if estado.get(nombre) == 1:
+                raise ValueError("Ciclo entre etapas: " + " -> ".join(camino + [nombre]))
+            estado[nombre] = 1
+            for entrada in self.etapas[nombre].entradas:
+                visitar(entrada, camino + [nombre])
+            estado[nombre] = 2
+
+        for nombre in self.etapas:
+            visitar(nombre, [])
+
+    def actualizar(self, **valores) -> None:
+        # Valores de entrada (archivos, parámetros); los no indicados conservan el último.
+        # La huella se calcula aquí, una vez por valor nuevo (no en cada ejecutar).
+        for nombre, valor in valores.items():
+            if nombre not in self.valores or self.valores[nombre] is not valor:
+                self._huellas_valores[nombre] = huella_valor(valor)
+            self.valores[nombre] = valor
+
+    def _plan(self, objetivos: Iterable[str], forzar: Iterable[str] = ()) -> Dict[str, str]:
+        # Huella de cada etapa/valor necesario, en orden de ejecución (las entradas antes)
+        forzar = set(forzar)
+        huellas: Dict[str, str] = {}
+
+        def visitar(nombre: str) -> str:
+            if nombre in huellas:
+                return huellas[nombre]
+            if nombre not in self.etapas:
+                if nombre not in self.valores:
+                    raise KeyError(f"Falta el valor de entrada '{nombre}'.")
+                huellas[nombre] = self._huellas_valores[nombre]
+                return huellas[nombre]
+            partes = [nombre] + [visitar(e) for e in self.etapas[nombre].entradas]
+            if nombre in forzar:
+                partes.append(f"forzada:{uuid.uuid4().hex}")
+            huellas[nombre] = hashlib.sha1("|".join(partes).encode('utf-8')).hexdigest()
+            return huellas[nombre]
+
+        for objetivo in objetivos:
+            visitar(objetivo)
+        return huellas
+
+    def _vigente(self, nombre: str, huella: str) -> bool:
+        memoria = self._memoria.get(nombre)
+        return memoria is not None and memoria[0] == huella
+
+    def pendientes(self, objetivos: Iterable[str], forzar: Iterable[str] = ()) -> List[str]:
+        # Etapas que ejecutaría ejecutar(objetivos, forzar), en orden
+        forzar = set(forzar)
+        return [n for n, h in self._plan(objetivos, forzar).items()
+                if n in self.etapas and (n in forzar or not self._vigente(n, h))]
+
+    def ejecutar(
+        self,
+        objetivos: Iterable[str],
+        forzar: Iterable[str] = (),
+        al_ejecutar: Optional[Callable[[str], None]] = None,
+        **valores
+    ) -> Dict[str, Any]:
+        """
+        Salidas de `objetivos` (y de las etapas de las que dependen), ejecutando
+        solo las etapas cuya huella cambió. `al_ejecutar(nombre)` se llama antes
+        de ejecutar cada etapa (progreso en la página). Las etapas ejecutadas en
+        esta llamada quedan en `self.ejecutadas` y sus medidas en `self.medidas`.
+        """
+        self.actualizar(**valores)
+        forzar = set(forzar)
+        self.ejecutadas = []
+        salidas: Dict[str, Any] = {}
+        with registrar() as registro:
+            for nombre, huella in self._plan(objetivos, forzar).items():
+                if nombre not in self.etapas:
+                    salidas[nombre] = self.valores[nombre]
+                elif nombre not in forzar and self._vigente(nombre, huella):
+                    salidas[nombre] = self._memoria[nombre][1]
+                else:
+                    if al_ejecutar is not None:
+                        al_ejecutar(nombre)
+                    etapa = self.etapas[nombre]
+                    args = [salidas[e] for e in etapa.entradas]
+                    # Filas de entrada: las de la primera entrada tabular (la tabla principal)
+                    with medir(nombre, next((a for a in args if filas(a) is not None), None)) as medida:
+                        salidas[nombre] = etapa.funcion(*args)
+                        medida.filas_salida = filas(salidas[nombre])
+                    self._memoria[nombre] = (huella, salidas[nombre])
+                    self.ejecutadas.append(nombre)
+        self.medidas = registro.medidas
+        return salidas
+
+    def copia_para(self, objetivos: Iterable[str]) -> 'Pipeline':
+        # Copia con los valores actuales y la memoria de las etapas de las que dependen
+        # `objetivos` (lo que necesita otro proceso para ejecutarlos)
+        necesarias = set()
+        pila = list(objetivos)
+        while pila:
+            nombre = pila.pop()
+            if nombre in self.etapas and nombre not in necesarias:
+                necesarias.add(nombre)
+                pila.extend(self.etapas[nombre].entradas)
+        copia = Pipeline.__new__(Pipeline)
+        copia.__dict__.update(self.__dict__)
+        copia.valores = dict(self.valores)
+        copia._huellas_valores = dict(self._huellas_valores)
+        copia._memoria = {n: m for n, m in self._memoria.items() if n in necesarias}
+        copia.ejecutadas, copia.medidas = [], []
+        return copia
+
+    def exportar(self, nombres: Sequence[str]) -> List[Tuple[str, str, Any]]:
+        # (etapa, huella, salida) de las etapas indicadas, para incorporar() en otro grafo
+        return [(n, *self._memoria[n]) for n in nombres if n in self._memoria]
+
+    def incorporar(self, entradas: Sequence[Tuple[str, str, Any]], medidas: Sequence[Medida] = ()) -> None:
+        # Salidas (y medidas) calculadas en otro proceso; pasan a ser las ejecutadas de esta llamada
+        for nombre, huella, salida in entradas:
+            self._memoria[nombre] = (huella, salida)
+        self.ejecutadas = [nombre for nombre, _, _ in entradas]
+        self.medidas = list(medidas)
+
+    def tiene(self, nombre: str) -> bool:
+        return nombre in self._memoria
+
+    def resultado(self, nombre: str, defecto: Any = None) -> Any:
+        # Última salida guardada de la etapa (sin comprobar si sus entradas cambiaron)
+        memoria = self._memoria.get(nombre)
+        return memoria[1] if memoria is not None else defecto
+
+    def olvidar(self, *nombres: str) -> None:
+        # Sin nombres, vacía toda la memoria
+        for nombre in (nombres or list(self._memoria)):
+            self._memoria.pop(nombre, None)
@@ -0,0 +1,372 @@
+# core/reparto.py
+# ============================================================
+# Reparto CAVA/PGC por VARTIP (motor común RVC y Cavanet)
+# - Las pesadas de cada VARTIP consumen su rendimiento (cupo)
+#   en el orden recibido; lo que excede pasa a PGC.
+# - Cálculo por columnas completas (sumas acumuladas por grupo),
+#   sin bucles fila a fila.
+# ============================================================
+
+from __future__ import annotations
+import hashlib
+import json
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+ESTADOS_VARTIP = ['ACTIVO', 'COMPLETADO', 'EXCEDIDO']
+TOLERANCIA_CUPO = 1e-9
+COLUMNAS_REPARTO = ['kg_cava', 'kg_pgc', 'acumulado_antes', 'acumulado_despues', 'estado']
+
+
+def _segmentos(codigos: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # Orden estable que deja contiguas las filas de cada grupo (códigos -1 fuera)
+    orden = np.argsort(codigos, kind='stable')
+    orden = orden[codigos[orden] >= 0]
+    cod_ord = codigos[orden]
+    if len(orden) == 0:
+        vacio = np.empty(0, dtype=np.int64)
+        return orden, vacio, vacio, vacio
+    inicio = np.flatnonzero(np.r_[True, cod_ord[1:] != cod_ord[:-1]])
+    largo = np.diff(np.r_[inicio, len(orden)])
+    pos = np.arange(len(orden)) - np.repeat(inicio, largo)
+    return orden, inicio, largo, pos
+
+
+def _cumsum_segmentos(valores_ord: np.ndarray, inicio: np.ndarray, largo: np.ndarray, pos: np.ndarray) -> np.ndarray:
+    # Suma acumulada secuencial por grupo (mismo redondeo que `acum += kg`).
+    # Los grupos se agrupan en cubetas de longitud parecida y se acumulan
+    # como filas de una matriz, para no mezclar sumas entre grupos.
+    out = np.empty(len(valores_ord), dtype=float)
+    if len(valores_ord) == 0:
+        return out
+    cubeta = np.ceil(np.log2(largo)).astype(np.int64)
+    grupo_fila = np.repeat(np.arange(len(inicio)), largo)
+    cubeta_fila = cubeta[grupo_fila]
+    for b in np.unique(cubeta):
+        sel_g = np.flatnonzero(cubeta == b)
+        sel_f = np.flatnonzero(cubeta_fila == b)
+        fila = np.empty(len(inicio), dtype=np.int64)
+        fila[sel_g] = np.arange(len(sel_g))
+        r, c = fila[grupo_fila[sel_f]], pos[sel_f]
+        mat = np.zeros((len(sel_g), int(largo[sel_g].max())), dtype=float)
+        mat[r, c] = valores_ord[sel_f]
+        np.cumsum(mat, axis=1, out=mat)
+        out[sel_f] = mat[r, c]
+    return out
+
+
+def _primero_por_segmento(mask_ord: np.ndarray, inicio: np.ndarray) -> np.ndarray:
+    # Posición (en orden de segmentos) de la primera fila True de cada grupo; -1 si no hay
+    n = len(mask_ord)
+    cand = np.where(mask_ord, np.arange(n), n)
+    primero = np.minimum.reduceat(cand, inicio) if n else np.empty(0, dtype=np.int64)
+    return np.where(primero < n, primero, -1)
+
+
+def repartir_cupo(kg: pd.Series, grupo: pd.Series, cupo: pd.Series,
+                  tol: float = TOLERANCIA_CUPO,
+                  acumulado_inicial: Optional[pd.Series] = None,
+                  completo_inicial: Optional[pd.Series] = None) -> pd.DataFrame:
+    """
+    Reparte los kilos de cada grupo (VARTIP) entre CAVA y PGC según su cupo.
+
+    Las filas se consumen en el orden en que llegan. El cupo de cada grupo es el
+    primer valor no nulo de `cupo`. Devuelve un DataFrame con el mismo índice y
+    columnas kg_cava, kg_pgc, acumulado_antes, acumulado_despues y estado
+    (ACTIVO / COMPLETADO / EXCEDIDO). Grupos sin cupo quedan a cero y ACTIVO.
+
+    `acumulado_inicial` / `completo_inicial` (indexados por grupo) permiten
+    continuar un reparto ya empezado en lugar de partir de cero.
+    """
+    n = len(kg)
+    kg_v = pd.to_numeric(kg, errors='coerce').to_numpy(dtype=float)
+    cupo_v = pd.to_numeric(cupo, errors='coerce').to_numpy(dtype=float)
+    codigos, uniques = pd.factorize(grupo)
+
+    kg_cava = np.zeros(n)
+    kg_pgc = np.zeros(n)
+    antes = np.zeros(n)
+    despues = np.zeros(n)
+    estado = np.zeros(n, dtype=np.int8)
+
+    orden, inicio, largo, pos = _segmentos(codigos)
+    if len(orden):
+        grp_ini = codigos[orden][inicio]
+        acum0 = np.zeros(len(inicio))
+        comp0 = np.zeros(len(inicio), dtype=bool)
+        if acumulado_inicial is not None:
+            acum0 = acumulado_inicial.reindex(uniques).fillna(0.0).to_numpy(dtype=float)[grp_ini]
+        if completo_inicial is not None:
+            comp0 = completo_inicial.reindex(uniques).fillna(False).to_numpy(dtype=bool)[grp_ini]
+
+        kg_o = kg_v[orden]
+        base = kg_o.copy()
+        base[inicio] = acum0 + base[inicio]
+        acum = _cumsum_segmentos(base, inicio, largo, pos)
+        previo = np.r_[0.0, acum[:-1]]
+        previo[inicio] = acum0
+
+        # Cupo del grupo: primer valor no nulo en orden de llegada
+        idx_cupo = _primero_por_segmento(~np.isnan(cupo_v[orden]), inicio)
+        con_cupo = idx_cupo >= 0
+        r_grp = np.where(con_cupo, cupo_v[orden][np.maximum(idx_cupo, 0)], np.nan)
+        r = np.repeat(r_grp, largo)
+        valido = np.repeat(con_cupo, largo)
+
+        cerrado = np.repeat(comp0 & con_cupo, largo)
+        cabe = acum <= r
+        excede = ~cabe & valido & ~cerrado
+        completa = cabe & (np.abs(acum - r) < tol) & ~cerrado
+        dispara = excede | completa
+
+        # Los grupos que ya llegan completos se tratan como disparados antes de su primera fila
+        idx_disp = _primero_por_segmento(dispara, inicio)
+        idx_disp = np.where(comp0 & con_cupo, inicio - 1, idx_disp)
+        disp_fila = np.repeat(idx_disp, largo)
+        filas = np.arange(len(orden))
+        pre = valido & ~cerrado & ((disp_fila < 0) | (filas < disp_fila))
+        en_disp = filas == disp_fila
+        post = (cerrado | (disp_fila >= 0)) & (filas > disp_fila)
+
+        # Acumulado con el que queda cerrado el grupo tras la fila que lo completa
+        i_d = np.clip(idx_disp, 0, None)
+        fin_grp = np.where(comp0 & con_cupo, acum0,
+                           np.where(idx_disp >= 0, np.where(excede[i_d], r_grp, acum[i_d]), np.nan))
+        fin = np.repeat(fin_grp, largo)
+
+        cava_exc = np.maximum(r - previo, 0.0)
+        cava_o = np.select([pre | (en_disp & completa), en_disp & excede], [kg_o, cava_exc], 0.0)
+        pgc_o = np.select([en_disp & excede, post], [kg_o - cava_exc, kg_o], 0.0)
+        antes_o = np.select([pre | en_disp, post], [previo, fin], 0.0)
+        despues_o = np.select([pre | (en_disp & completa), en_disp & excede, post], [acum, r, fin], 0.0)
+        estado_o = np.select([en_disp & completa, (en_disp & excede) | post], [1, 2], 0).astype(np.int8)
+
+        kg_cava[orden] = cava_o
+        kg_pgc[orden] = pgc_o
+        antes[orden] = antes_o
+        despues[orden] = despues_o
+        estado[orden] = estado_o
+
+    return pd.DataFrame({
+        'kg_cava': kg_cava,
+        'kg_pgc': kg_pgc,
+        'acumulado_antes': antes,
+        'acumulado_despues': despues,
+        'estado': pd.Categorical.from_codes(estado, ESTADOS_VARTIP),
+    }, index=kg.index)
+
+
+def reasignar_rendimiento(df_con_rend: pd.DataFrame, df_rend_ajustado: pd.DataFrame) -> pd.DataFrame:
+    # Sustituye el cupo de pesadas ya cruzadas (p. ej. tras cambiar el kg/ha) sin repetir los cruces
+    cupo = df_rend_ajustado.set_index('vartip')['rendimiento_ajustado_total']
+    return df_con_rend.assign(rendimiento=cupo.reindex(df_con_rend['vartip']).to_numpy())
+
+
+# ============================================================
+# Reparto incremental (entregas diarias durante la vendimia)
+# - Un estado por archivo de Parcelas (ruta_estado_reparto): dos
+#   cooperativas (o sesiones con otras Parcelas) no comparten marcas.
+# - Junto al estado (JSON, por VARTIP) se guarda la asignación de
+#   cada pesada ya repartida (Parquet): la salida es siempre la
+#   temporada completa, aunque solo se reparta lo nuevo.
+# ============================================================
+DIR_ESTADO_REPARTO = os.environ.get('PGC_ESTADO_REPARTO_DIR', '.estado_reparto')
+COLUMNAS_ESTADO = ['vartip', 'cupo', 'acumulado', 'completo', 'n_pesadas', 'kg_pesadas']
+COLUMNAS_ASIGNACION = ['vartip', 'kg'] + COLUMNAS_REPARTO
+
+
+def ruta_estado_reparto(tipo: str, archivo_parcelas: Optional[bytes] = None) -> str:
+    if archivo_parcelas is None:
+        return os.path.join(DIR_ESTADO_REPARTO, f'{tipo}.json')
+    return os.path.join(DIR_ESTADO_REPARTO, f'{tipo}_{hashlib.sha1(archivo_parcelas).hexdigest()[:16]}.json')
+
+
+def _ruta_asignacion(ruta: str) -> str:
+    return os.path.splitext(ruta)[0] + '.filas.parquet'
+
+
+def cargar_estado_reparto(ruta: str) -> Optional[pd.DataFrame]:
+    if not ruta or not os.path.exists(ruta):
+        return None
+    with open(ruta, 'r', encoding='utf-8') as f:
+        contenido = json.load(f)
+    estado = pd.DataFrame(contenido['datos'], columns=list(contenido['tipos']))
+    for col, tipo in contenido['tipos'].items():
+        if tipo.startswith('datetime64'):
+            estado[col] = pd.to_datetime(estado[col])
+        elif tipo != 'object':
+            estado[col] = estado[col].astype(tipo)
+    return estado
+
+
+def cargar_asignacion_reparto(ruta: str) -> Optional[pd.DataFrame]:
+    # Asignación por pesada del último reparto (None si no hay o no se puede leer: se recalcula)
+    ruta = _ruta_asignacion(ruta) if ruta else ruta
+    if not ruta or not os.path.exists(ruta):
+        return None
+    try:
+        return pd.read_parquet(ruta)
+    except Exception:
+        return None
+
+
+def guardar_estado_reparto(estado: pd.DataFrame, ruta: str, asignacion: Optional[pd.DataFrame] = None) -> None:
+    # JSON propio (no to_json) para que los acumulados se guarden con precisión completa.
+    # La asignación se escribe antes que el estado: si falta o no cuadra, sus VARTIP se recalculan.
+    carpeta = os.path.dirname(ruta)
+    if carpeta:
+        os.makedirs(carpeta, exist_ok=True)
+    if asignacion is not None:
+        tmp = _ruta_asignacion(ruta) + '.tmp'
+        asignacion.assign(estado=asignacion['estado'].astype(str)).to_parquet(tmp, index=False)
+        os.replace(tmp, _ruta_asignacion(ruta))
+    datos = {}
+    for col in estado.columns:
+        serie = estado[col]
+        if pd.api.types.is_datetime64_any_dtype(serie):
+            serie = serie.dt.strftime('%Y-%m-%dT%H:%M:%S.%f')
+        datos[col] = [None if pd.isna(v) else (v.item() if hasattr(v, 'item') else v) for v in serie]
+    contenido = {
+        'tipos': {col: str(estado[col].dtype) for col in estado.columns},
+        'datos': [dict(zip(datos, fila)) for fila in zip(*datos.values())],
+    }
+    tmp = ruta + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(contenido, f, ensure_ascii=False)
+    os.replace(tmp, ruta)
+
+
+def _filas_nuevas(df: pd.DataFrame, orden_cols: List[str], estado: pd.DataFrame) -> np.ndarray:
+    # Una pesada es nueva si en el orden (vartip + orden_cols) queda detrás de la marca
+    # guardada de su VARTIP. Las iguales a la marca se consideran ya vistas.
+    cols = ['vartip'] + orden_cols
+    filas = df[cols].assign(_marca=0, _fila=np.arange(len(df)))
+    marcas = estado[cols].assign(_marca=1, _fila=-1)
+    tmp = pd.concat([filas, marcas], ignore_index=True)
+    tmp = tmp.sort_values(cols + ['_marca'], kind='stable', na_position='last')
+    pasada = tmp.groupby('vartip', sort=False)['_marca'].cumsum()
+    sel = (tmp['_marca'] == 0) & (pasada > 0)
+    nueva = np.zeros(len(df), dtype=bool)
+    nueva[tmp.loc[sel, '_fila'].to_numpy(dtype=np.int64)] = True
+    return nueva
+
+
+def _asignacion_vistas(vistas: pd.DataFrame, kg: pd.Series, asignacion: Optional[pd.DataFrame]) -> pd.DataFrame:
+    # Asignación guardada de las pesadas ya vistas, emparejadas por VARTIP y posición dentro
+    # del VARTIP (mismo orden en las dos ejecuciones). `_coincide`: hay asignación con los mismos kilos.
+    claves = pd.DataFrame({
+        'vartip': vistas['vartip'].to_numpy(),
+        '_pos': vistas.groupby('vartip', sort=False).cumcount().to_numpy(),
+        '_kg': kg.to_numpy(),
+    })
+    if asignacion is None:
+        asignacion = pd.DataFrame({c: pd.Series(dtype=object if c in ('vartip', 'estado') else float)
+                                   for c in COLUMNAS_ASIGNACION})
+    previa = asignacion.assign(vartip=asignacion['vartip'].astype(object),
+                               _pos=asignacion.groupby('vartip', sort=False).cumcount())
+    emparejadas = claves.merge(previa, on=['vartip', '_pos'], how='left')
+    return emparejadas.assign(_coincide=((emparejadas['kg'] - emparejadas['_kg']).abs() < 1e-6).to_numpy())
+
+
+def repartir_cupo_incremental(df: pd.DataFrame, kg_col: str, orden_cols: List[str],
+                              estado_previo: Optional[pd.DataFrame],
+                              asignacion_previa: Optional[pd.DataFrame] = None
+                              ) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """
+    Reparto incremental sobre la temporada completa `df` (ordenada por vartip + orden_cols).
+
+    Solo se reparten las pesadas posteriores a la marca guardada de cada VARTIP,
+    partiendo de su acumulado; las anteriores conservan su asignación guardada
+    (`asignacion_previa`). Un VARTIP se recalcula entero si su cupo ha cambiado
+    (p. ej. nuevo ajuste IT04), si han aparecido/cambiado pesadas anteriores a la
+    marca o si falta su asignación.
+    Devuelve (COLUMNAS_REPARTO de todas las filas de `df`, estado, asignación), con
+    el nº de pesadas repartidas en esta ejecución en `attrs['repartidas']`.
+    """
+    # El estado guarda los VARTIP como texto: aquí se trabaja con valores, no con códigos
+    df = df.assign(vartip=np.asarray(df['vartip'], dtype=object))
+    kg = pd.to_numeric(df[kg_col], errors='coerce').fillna(0.0)
+    por_vt = df.assign(_kg=kg).groupby('vartip', sort=False)
+    cupo_actual = por_vt['rendimiento'].first()
+
+    if estado_previo is None or estado_previo.empty:
+        prev = pd.DataFrame(columns=COLUMNAS_ESTADO).set_index('vartip')
+        nueva = np.ones(len(df), dtype=bool)
+    else:
+        prev = estado_previo.set_index('vartip')
+        nueva = _filas_nuevas(df, orden_cols, estado_previo)
+    p = prev.reindex(cupo_actual.index)
+
+    # VARTIPs que pueden continuar desde su estado: mismo cupo y mismas pesadas hasta la marca
+    vistas = df.assign(_kg=kg)[~nueva].groupby('vartip', sort=False)
+    n_vistas = vistas.size().reindex(cupo_actual.index).fillna(0)
+    kg_vistos = vistas['_kg'].sum().reindex(cupo_actual.index).fillna(0.0)
+    cupo_prev = p['cupo'].astype(float)
+    mismo_cupo = ((cupo_prev - cupo_actual.astype(float)).abs() < TOLERANCIA_CUPO) | (cupo_prev.isna() & cupo_actual.isna())
+    sin_cambios = (p['n_pesadas'].astype(float) == n_vistas) & ((p['kg_pesadas'].astype(float) - kg_vistos).abs() < 1e-6)
+    continuar = p['n_pesadas'].notna() & mismo_cupo & sin_cambios
+
+    # ... y con la asignación guardada de cada una de esas pesadas
+    vistas_cont = df['vartip'].map(continuar).fillna(False).to_numpy(dtype=bool) & ~nueva
+    guardada = _asignacion_vistas(df[vistas_cont], kg[vistas_cont], asignacion_previa)
+    incompletos = guardada.loc[~guardada['_coincide'], 'vartip'].unique()
+    continuar = continuar & ~continuar.index.isin(incompletos)
+    guardada = guardada[~guardada['vartip'].isin(incompletos)]
+
+    cont_fila = df['vartip'].map(continuar).fillna(False).to_numpy(dtype=bool)
+    repartir = ~cont_fila | nueva
+    conservar = ~repartir
+    sub = df[repartir]
+    vt_cont = continuar[continuar].index
+    reparto = repartir_cupo(
+        kg[repartir], sub['vartip'], sub['rendimiento'],
+        acumulado_inicial=prev['acumulado'].reindex(vt_cont).astype(float),
+        completo_inicial=prev['completo'].reindex(vt_cont).astype(bool),
+    )
+
+    # Temporada completa: lo repartido ahora + lo guardado de las pesadas ya vistas
+    completo = {}
+    for col in COLUMNAS_REPARTO[:-1]:
+        valores = np.empty(len(df))
+        valores[repartir] = reparto[col].to_numpy()
+        valores[conservar] = guardada[col].to_numpy(dtype=float)
+        completo[col] = valores
+    estados = np.empty(len(df), dtype=np.int8)
+    estados[repartir] = reparto['estado'].cat.codes.to_numpy()
+    estados[conservar] = pd.Categorical(guardada['estado'], categories=ESTADOS_VARTIP).codes
+    completo['estado'] = pd.Categorical.from_codes(estados, ESTADOS_VARTIP)
+    resultado = pd.DataFrame(completo, index=df.index)
+    resultado.attrs['repartidas'] = int(np.count_nonzero(repartir))
+
+    # Estado nuevo: el de la última pesada de cada VARTIP
+    ultimas = (resultado.assign(vartip=df['vartip'].to_numpy())
+               .drop_duplicates('vartip', keep='last').set_index('vartip'))
+    nuevo = pd.DataFrame({
+        'cupo': cupo_actual,
+        'acumulado': ultimas['acumulado_despues'].reindex(cupo_actual.index),
+        'completo': ultimas['estado'].reindex(cupo_actual.index) != 'ACTIVO',
+        'n_pesadas': por_vt.size(),
+        'kg_pesadas': por_vt['_kg'].sum(),
+    })
+    marca = df.drop_duplicates('vartip', keep='last').set_index('vartip')[orden_cols]
+    nuevo = nuevo.join(marca)
+    nuevo.index.name = 'vartip'
+
+    fuera = prev.index.difference(nuevo.index)
+    estado = nuevo.reset_index()
+    if len(fuera):
+        estado = pd.concat([prev.loc[fuera].reset_index(), estado], ignore_index=True)
+    estado = estado[COLUMNAS_ESTADO + orden_cols]
+    estado['completo'] = estado['completo'].astype(bool)
+
+    # Asignación por pesada (sin las que no tienen VARTIP); los VARTIP que no vienen en este archivo conservan la suya
+    asignacion = resultado.assign(vartip=df['vartip'].to_numpy(), kg=kg.to_numpy())[COLUMNAS_ASIGNACION]
+    asignacion = asignacion[asignacion['vartip'].notna()].reset_index(drop=True)
+    if len(fuera) and asignacion_previa is not None:
+        asignacion = pd.concat([asignacion_previa[asignacion_previa['vartip'].isin(fuera)][COLUMNAS_ASIGNACION], asignacion],
+                               ignore_index=True)
+    return resultado, estado, asignacion
@@ -0,0 +1,104 @@
+# core/resumenes.py
+# ============================================================
+# Resúmenes del reparto (RVC y Cavanet)
+# - Resumen_VARTIPs y PGC_Resumen_VARTIP salen de una sola
+#   agrupación por VARTIP sobre la salida del reparto.
+# - Primera PGC: la fila PGC más temprana de cada VARTIP (mínimo de
+#   su posición); pesadas desde la primera PGC = tamaño del grupo -
+#   posición + 1. Sin volver a cruzar el resultado con cada fila.
+# - Resumen por bodega / celler en la misma llamada.
+# ============================================================
+
+from __future__ import annotations
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+
+def resumir_reparto(
+    df: pd.DataFrame,
+    col_kg: str,
+    col_num: Optional[str] = None,
+    primeras: Optional[Dict[str, str]] = None,
+    bodegas: Optional[List[str]] = None
+) -> Dict[str, pd.DataFrame]:
+    """
+    Devuelve {'vartips', 'pgc', 'bodegas'} a partir de la salida del reparto.
+
+    `df` va en el orden de consumo dentro de cada VARTIP (como lo deja el
+    reparto): las posiciones de la primera PGC se cuentan en ese orden.
+    `primeras`: columnas {nombre: columna} del resumen por VARTIP tomadas con
+    'first'; `col_num`: columna cuyo valor en la primera PGC se informa
+    (primer_numPesada_pgc); `bodegas`: columnas del resumen por bodega.
+    """
+    primeras = primeras or {}
+    base = df.reset_index(drop=True)
+    pgc = (base['kg_pgc'] > 0).to_numpy()
+    fila = np.arange(len(base), dtype=float)
+
+    tmp = pd.DataFrame({
+        'vartip': base['vartip'],
+        'kg_pgc': base['kg_pgc'],
+        'kg_cava': base['kg_cava'],
+        'kg': base[col_kg],
+        'rendimiento': base['rendimiento'],
+        '_pgc': pgc.astype(np.int64),
+        '_kg_pgc': base['kg_pgc'].where(pgc),
+        '_fila_pgc': np.where(pgc, fila, np.nan),
+    })
+    for nombre, col in primeras.items():
+        tmp[nombre] = base[col]
+    aggs = dict(
+        total_kg_pgc=('kg_pgc', 'sum'),
+        total_kg_cava=('kg_cava', 'sum'),
+        total_kg_general=('kg', 'sum'),
+        rendimiento_maximo=('rendimiento', 'first'),
+        num_pesadas=('kg', 'count'),
+        **{nombre: (nombre, 'first') for nombre in primeras},
+        n_pesadas_pgc=('_pgc', 'sum'),
+        kg_pgc_total=('_kg_pgc', 'sum'),
+        _fila_pgc=('_fila_pgc', 'min'),
+        _n=('kg', 'size'),
+    )
+    if col_num:
+        tmp['_fila_num'] = np.where(pgc & base[col_num].notna().to_numpy(), fila, np.nan)
+        aggs['_fila_num'] = ('_fila_num', 'min')
+
+    grupos = tmp.groupby('vartip', dropna=False, observed=True)
+    agg = grupos.agg(**aggs).reset_index()
+    # Posición (1..n) de cada fila dentro de su VARTIP, con las mismas claves de grupo
+    pos = grupos.cumcount().to_numpy() + 1
+
+    # Resumen_VARTIPs
+    resumen_vartips = agg[['vartip', 'total_kg_pgc', 'total_kg_cava', 'total_kg_general',
+                           'rendimiento_maximo', 'num_pesadas', *primeras]]
+    resumen_vartips['porcentaje_uso_rendimiento'] = np.where(
+        resumen_vartips['rendimiento_maximo'] > 0,
+        (resumen_vartips['total_kg_cava'] / resumen_vartips['rendimiento_maximo'] * 100).round(2),
+        np.nan
+    )
+    resumen_vartips = resumen_vartips.sort_values('total_kg_pgc', ascending=False)
+
+    # PGC_Resumen_VARTIP (solo VARTIPs con alguna pesada PGC)
+    con = agg[agg['n_pesadas_pgc'] > 0].reset_index(drop=True)
+    resumen_pgc = con[['vartip', 'n_pesadas_pgc', 'kg_pgc_total']]
+    resumen_pgc['primer_pgc_pos'] = pos[con['_fila_pgc'].to_numpy(dtype=np.int64)]
+    if col_num:
+        filas = con['_fila_num'].fillna(-1).to_numpy(dtype=np.int64)
+        resumen_pgc['primer_numPesada_pgc'] = base[col_num].array.take(filas, allow_fill=True)
+    resumen_pgc['n_pesadas_desde_primer_pgc'] = con['_n'] - resumen_pgc['primer_pgc_pos'] + 1
+    resumen_pgc = resumen_pgc.sort_values('kg_pgc_total', ascending=False)
+
+    # Resumen por bodega / celler
+    if bodegas:
+        resumen_bodegas = (base.groupby(bodegas, dropna=False, observed=True)
+            .agg(total_kg_pgc=('kg_pgc', 'sum'),
+                 total_kg_cava=('kg_cava', 'sum'),
+                 total_kg_general=(col_kg, 'sum'),
+                 num_pesadas=(col_kg, 'count'))
+            .round(2).reset_index())
+    else:
+        resumen_bodegas = pd.DataFrame()
+
+    return {'vartips': resumen_vartips, 'pgc': resumen_pgc, 'bodegas': resumen_bodegas}
@@ -1,42 +1,48 @@
+from typing import Optional
 import pandas as pd
 import numpy as np
 from .utils import (
     norm_text, norm_variedad, norm_nif, norm_refparcela,
-    find_col, find_col_by_terms, ordenar_num_pesada_key,
-    crear_diccionario_variedades, codigo_variedad_from_name
+    claves_num_pesada, rango_num_pesada, orden_pesadas, normalizar, columna_numerica, a_fechas
+)
+from .esquema import resolver_columnas
+from .variedades import catalogo_variedades
+from .categorias import compactar_claves
+from .indice import IndiceParcelas
+from .resumenes import resumir_reparto
+from .reparto import (
+    repartir_cupo, repartir_cupo_incremental, ruta_estado_reparto,
+    cargar_estado_reparto, cargar_asignacion_reparto, guardar_estado_reparto,
 )
 
 def procesar_rvc(df_rvc: pd.DataFrame) -> pd.DataFrame:
-    # Detectar columnas
-    col_dos    = find_col(df_rvc, ['dos'])
-    col_cgs    = find_col(df_rvc, ['cavaGuardaSuperior', 'cava_guarda_superior'])
-    col_num    = find_col(df_rvc, ['numPesada', 'num_pesada'])
-    col_kg     = find_col(df_rvc, ['kgTotals', 'kg_totals', 'kgTotal', 'kg'])
-    col_celler = find_col(df_rvc, ['nomCeller', 'celler', 'nombreCeller', 'nom_celler'])
-    col_var    = find_col(df_rvc, ['varietatDesc','variedad','varietat','variety'])
-    col_nifll  = find_col(df_rvc, ['nifLliurador','nifLLiurador','nif lliurador','nif_entrega','nifProveedor'])
-    col_nomll  = find_col(df_rvc, ['nomLliurador','nom lliurador','nombreLliurador','proveedor','nombreProveedor'])
-    col_nipd   = find_col(df_rvc, ['nipd','nip','idProveedor'])
-    col_fecha  = find_col(df_rvc, ['dataPesada','fechaPesada','data_pesada','fecha'])
-    col_origen = find_col(df_rvc, ['origenParcella','origenParcela','origen parcela','origen_parcela'])
-    col_tiquet = find_col(df_rvc, ['tiquetBascula','tiquetBascu','tiquet_bascu','ticketBascula','tiquetBascul'])
-    col_motiu  = find_col(df_rvc, ['motiuPesadaIncidental','motivoPesadaIncidental','motiu incidental','motivo incidental'])
-    if col_motiu is None:
-        col_motiu = find_col_by_terms(df_rvc, ['MOTIU','INCID']) or find_col_by_terms(df_rvc, ['MOTIVO','INCID'])
-    if col_motiu is None:
-        col_motiu = find_col_by_terms(df_rvc, ['MOTIU','INCIDENTAL']) or find_col_by_terms(df_rvc, ['MOTIVO','INCIDENTAL'])
+    # Detectar columnas (reglas en core.esquema, resueltas una vez por cabecera)
+    cols = resolver_columnas(df_rvc.columns, 'rvc')
+    col_dos    = cols['dos']
+    col_cgs    = cols['cavaGuardaSuperior']
+    col_num    = cols['numPesada']
+    col_kg     = cols['kgTotals']
+    col_celler = cols['nomCeller']
+    col_var    = cols['varietatDesc']
+    col_nifll  = cols['nifLliurador']
+    col_nomll  = cols['nomLliurador']
+    col_nipd   = cols['nipd']
+    col_fecha  = cols['dataPesada']
+    col_origen = cols['origenParcella']
+    col_tiquet = cols['tiquetBascula']
+    col_motiu  = cols['motiuPesadaIncidental']
 
     if col_kg is None:
         raise ValueError("No se encontró columna de kilos (kgTotals).")
 
-    # Copia de trabajo
-    df = df_rvc.copy()
+    # Copia superficial: con copy-on-write solo se copian las columnas que se reescriben
+    df = df_rvc.copy(deep=False)
 
     # Filtros: dos=CV y cavaGuardaSuperior NO explícito (blancos cuentan)
     if col_dos:
-        df[col_dos] = df[col_dos].astype(str).map(norm_text)
+        df[col_dos] = normalizar(df[col_dos].astype(str), norm_text)
     if col_cgs:
-        cgs = df[col_cgs].astype(str).map(norm_text)
+        cgs = normalizar(df[col_cgs].astype(str), norm_text)
         si_vals = {'SI','SÍ','YES','Y','1','TRUE'}
         mask_no_gs = ~cgs.isin(si_vals) | cgs.isna()
     else:
@@ -49,17 +55,20 @@ def procesar_rvc(df_rvc: pd.DataFrame) -> pd.DataFrame:
 
     # Excluir IN-01
     if col_motiu:
-        mot_norm = df[col_motiu].astype(str).map(norm_text)
+        mot_norm = normalizar(df[col_motiu].astype(str), norm_text)
         excl = mot_norm.str.match(r'^\s*IN[-\s]*0*1\b', na=False)
-        df = df[~excl].copy()
+        df = df[~excl]
 
-    # Ordenar por numPesada si existe
+    # Ordenar por numPesada si existe. El rango se guarda (rango_numPesada) y lo reutilizan
+    # el reparto y las hojas de detalle en lugar de volver a interpretar numPesada
     if col_num:
-        df['_ord'] = df[col_num].apply(ordenar_num_pesada_key)
-        df = df.sort_values('_ord').drop(columns=['_ord']).reset_index(drop=True)
+        rango = rango_num_pesada(df[col_num])
+        orden = np.argsort(rango, kind='stable')
+        df = df.iloc[orden].reset_index(drop=True)
+        df['rango_numPesada'] = rango[orden]
 
     # Kilos a numérico
-    df[col_kg] = pd.to_numeric(df[col_kg], errors='coerce').fillna(0.0)
+    df[col_kg] = columna_numerica(df, col_kg, miles=True).fillna(0.0)
 
     # Renombrar a estándar
     rename_map = {}
@@ -76,221 +85,189 @@ def procesar_rvc(df_rvc: pd.DataFrame) -> pd.DataFrame:
     if col_tiquet: rename_map[col_tiquet] = 'tiquetBascula'
     df = df.rename(columns=rename_map)
 
+    # Fecha de pesada: fechas de Excel, números de serie y textos mezclados a datetime
+    # (mezclados, construir_hojas_salida no podía ordenar por dataPesada)
+    if 'dataPesada' in df.columns:
+        df['dataPesada'] = a_fechas(df['dataPesada'])
+
     # RefParcela_norm
     if 'origenParcella' in df.columns:
-        df['RefParcela_norm'] = df['origenParcella'].map(norm_refparcela)
+        df['RefParcela_norm'] = normalizar(df['origenParcella'], norm_refparcela)
     else:
         df['RefParcela_norm'] = ""
 
-    return df
+    return compactar_claves(df)
 
 
 def crear_vartip_rvc(df_rvc_clean: pd.DataFrame,
                      df_final: pd.DataFrame,
                      df_parcelas_clean: pd.DataFrame,
-                     df_rend_ajustado: pd.DataFrame) -> pd.DataFrame:
-
-    dict_variedades = crear_diccionario_variedades()
+                     df_rend_ajustado: Optional[pd.DataFrame],
+                     indice: Optional[IndiceParcelas] = None) -> pd.DataFrame:
+    # `indice`: el IndiceParcelas de estas Parcelas si ya está construido (sesión).
+    # Sin df_rend_ajustado, 'rendimiento' queda NaN (ver IndiceParcelas.cruzar).
 
     if 'varietatDesc' not in df_rvc_clean.columns or 'nifLliurador' not in df_rvc_clean.columns:
         raise ValueError("Faltan columnas para crear VARTIP (varietatDesc/nifLliurador).")
 
-    socios_nif = set(df_final['nif'].astype(str))
+    indice = indice or IndiceParcelas(df_parcelas_clean)
 
-    var_norm = df_rvc_clean['varietatDesc'].map(norm_variedad)
-    nif_norm = df_rvc_clean['nifLliurador'].map(norm_nif)
+    var_norm = normalizar(df_rvc_clean['varietatDesc'], norm_variedad)
+    nif_norm = normalizar(df_rvc_clean['nifLliurador'], norm_nif)
 
     # Solo viticultores
-    mask_socios = nif_norm.isin(socios_nif)
-    df_filtrado = df_rvc_clean[mask_socios].copy()
+    mask_socios = indice.es_socio(nif_norm)
+    df_filtrado = df_rvc_clean[mask_socios]
     var_norm = var_norm[mask_socios]
     nif_norm = nif_norm[mask_socios]
 
-    # VARTIP
-    cod_var = var_norm.map(lambda s: dict_variedades.get(s, codigo_variedad_from_name(s)))
-    df_filtrado['vartip'] = cod_var.astype(str) + '-' + nif_norm.astype(str)
-
-    # Rendimientos ajustados
-    df_rend = df_rend_ajustado.rename(columns={'rendimiento_ajustado_total':'rendimiento'})[['vartip','rendimiento']]
+    # VARTIP con el diccionario de Parcelas (los que no existen allí quedan NaN y no cruzan)
+    cod_var = catalogo_variedades().resolver(var_norm)
+    df_filtrado['vartip'] = indice.vartip(cod_var, nif_norm)
 
-    # INNER por VARTIP
-    df_merge = df_filtrado.merge(df_rend, on='vartip', how='inner')
+    # VARTIP con rendimiento y (si Parcelas trae parcela) parcela registrada para el VARTIP
+    return indice.cruzar(df_filtrado, df_rend_ajustado, por_parcela=indice.hay_parcelas)
 
-    # INNER por (VARTIP, RefParcela_norm)
-    if 'RefParcela_norm' in df_parcelas_clean.columns and df_parcelas_clean['RefParcela_norm'].notna().any():
-        valid_parcels = (df_parcelas_clean[['vartip','RefParcela_norm']].dropna().drop_duplicates())
-        df_merge = df_merge.merge(valid_parcels, on=['vartip','RefParcela_norm'], how='inner')
 
-    return df_merge
+def _rango_pesada(df: pd.DataFrame) -> np.ndarray:
+    # Rango de numPesada de procesar_rvc (o calculado aquí si df no viene de procesar_rvc)
+    if 'rango_numPesada' in df.columns:
+        return df['rango_numPesada'].to_numpy()
+    return rango_num_pesada(df['numPesada'])
 
 
 def controlar_rendimientos(df_rvc_con_rend: pd.DataFrame) -> pd.DataFrame:
     if 'kgTotals' not in df_rvc_con_rend.columns:
         raise ValueError("Falta 'kgTotals' tras el preprocesado.")
 
-    df = df_rvc_con_rend.copy()
-    df['kg_cava'] = 0.0
-    df['kg_pgc'] = 0.0
-    df['acumulado_antes'] = 0.0
-    df['acumulado_despues'] = 0.0
-    df['estado_vartip'] = 'ACTIVO'
-
     # Orden interno
+    df = df_rvc_con_rend
     if 'numPesada' in df.columns:
-        df['_ord'] = df['numPesada'].apply(ordenar_num_pesada_key)
-        df = df.sort_values(['vartip','_ord']).drop(columns=['_ord']).reset_index(drop=True)
+        df = df.iloc[orden_pesadas(df, _rango_pesada(df))].reset_index(drop=True)
     else:
         df = df.sort_values(['vartip']).reset_index(drop=True)
 
-    for vartip, grp_idx in df.groupby('vartip').groups.items():
-        idxs = list(grp_idx)
-        if not idxs: continue
-        r_vals = df.loc[idxs, 'rendimiento'].dropna()
-        if r_vals.empty: continue
-        r_max = float(r_vals.iloc[0])
-
-        acumulado = 0.0
-        completo = False
-        for i in idxs:
-            kg = float(df.loc[i, 'kgTotals'])
-            df.loc[i, 'acumulado_antes'] = acumulado
-
-            if not completo:
-                if acumulado + kg <= r_max:
-                    df.loc[i, 'kg_cava'] = kg
-                    df.loc[i, 'kg_pgc'] = 0.0
-                    acumulado += kg
-                    if abs(acumulado - r_max) < 1e-9:
-                        completo = True
-                        df.loc[i, 'estado_vartip'] = 'COMPLETADO'
-                else:
-                    kg_cava = max(r_max - acumulado, 0.0)
-                    kg_pgc = kg - kg_cava
-                    df.loc[i, 'kg_cava'] = kg_cava
-                    df.loc[i, 'kg_pgc'] = kg_pgc
-                    acumulado = r_max
-                    completo = True
-                    df.loc[i, 'estado_vartip'] = 'EXCEDIDO'
-            else:
-                df.loc[i, 'kg_cava'] = 0.0
-                df.loc[i, 'kg_pgc'] = kg
-                df.loc[i, 'estado_vartip'] = 'EXCEDIDO'
-
-            df.loc[i, 'acumulado_despues'] = acumulado
+    reparto = repartir_cupo(df['kgTotals'], df['vartip'], df['rendimiento'])
+    df['kg_cava'] = reparto['kg_cava']
+    df['kg_pgc'] = reparto['kg_pgc']
+    df['acumulado_antes'] = reparto['acumulado_antes']
+    df['acumulado_despues'] = reparto['acumulado_despues']
+    df['estado_vartip'] = reparto['estado']
 
     return df
 
 
-def generar_resumenes(df_procesado: pd.DataFrame):
-    # Resumen cellers (nomCeller + nipd)
-    if 'nomCeller' in df_procesado.columns:
-        tmp = df_procesado.copy()
-        if 'nipd' in tmp.columns:
-            tmp['nipd'] = tmp['nipd'].astype(str).replace({'nan':''}).fillna('').str.strip()
-            tmp['nipd'] = np.where(tmp['nipd'] == '', 'SIN_NIPD', tmp['nipd'])
-            group_cols = ['nomCeller','nipd']
-        else:
-            group_cols = ['nomCeller']
-
-        resumen_cellers = (tmp.groupby(group_cols, dropna=False)
-            .agg(total_kg_pgc=('kg_pgc','sum'),
-                 total_kg_cava=('kg_cava','sum'),
-                 total_kg_general=('kgTotals','sum'),
-                 num_pesadas=('kgTotals','count'))
-            .round(2).reset_index())
-        resumen_cellers = resumen_cellers.sort_values(['nomCeller','total_kg_pgc'], ascending=[True, False])
-    else:
-        resumen_cellers = pd.DataFrame()
-
-    # Resumen VARTIP
-    agg_dict = dict(
-        total_kg_pgc=('kg_pgc','sum'),
-        total_kg_cava=('kg_cava','sum'),
-        total_kg_general=('kgTotals','sum'),
-        rendimiento_maximo=('rendimiento','first'),
-        num_pesadas=('kgTotals','count')
-    )
-    resumen_vartips = (df_procesado.groupby(['vartip'], dropna=False)
-                       .agg(**agg_dict).reset_index())
-    resumen_vartips['porcentaje_uso_rendimiento'] = np.where(
-        resumen_vartips['rendimiento_maximo'] > 0,
-        (resumen_vartips['total_kg_cava'] / resumen_vartips['rendimiento_maximo'] * 100).round(2),
-        np.nan
+def controlar_rendimientos_incremental(df_rvc_con_rend: pd.DataFrame, ruta_estado: str = None) -> pd.DataFrame:
+    # Reparto partiendo del estado guardado: devuelve la temporada completa, pero solo reparte
+    # las pesadas nuevas (o las de VARTIPs recalculados); cuántas, en attrs['pesadas_repartidas']
+    if 'kgTotals' not in df_rvc_con_rend.columns:
+        raise ValueError("Falta 'kgTotals' tras el preprocesado.")
+    if 'numPesada' not in df_rvc_con_rend.columns:
+        raise ValueError("El reparto incremental necesita 'numPesada' para ordenar las pesadas.")
+    ruta_estado = ruta_estado or ruta_estado_reparto('rvc')
+
+    # Orden con el rango de numPesada; las marcas del estado, con (número, sufijo), que sí
+    # se comparan entre archivos de días distintos
+    df = df_rvc_con_rend.iloc[orden_pesadas(df_rvc_con_rend, _rango_pesada(df_rvc_con_rend))].reset_index(drop=True)
+    claves = claves_num_pesada(df['numPesada'])
+    df = df.assign(ord_num=claves['ord_num'], ord_suf=claves['ord_suf'])
+
+    reparto, estado, asignacion = repartir_cupo_incremental(
+        df, 'kgTotals', ['ord_num','ord_suf'], cargar_estado_reparto(ruta_estado), cargar_asignacion_reparto(ruta_estado)
     )
-    resumen_vartips = resumen_vartips.sort_values('total_kg_pgc', ascending=False)
+    df = df.drop(columns=['ord_num','ord_suf'])
+    df['kg_cava'] = reparto['kg_cava']
+    df['kg_pgc'] = reparto['kg_pgc']
+    df['acumulado_antes'] = reparto['acumulado_antes']
+    df['acumulado_despues'] = reparto['acumulado_despues']
+    df['estado_vartip'] = reparto['estado']
+    df.attrs['pesadas_repartidas'] = reparto.attrs['repartidas']
+
+    guardar_estado_reparto(estado, ruta_estado, asignacion)
+    return df
+
 
-    return resumen_cellers, resumen_vartips
+def _resumir_rvc(df_procesado: pd.DataFrame):
+    # Cellers (nomCeller + nipd), VARTIPs y PGC por VARTIP en una llamada a resumir_reparto
+    bodegas = None
+    if 'nomCeller' in df_procesado.columns:
+        bodegas = ['nomCeller']
+        if 'nipd' in df_procesado.columns:
+            nipd = df_procesado['nipd'].astype(str).replace({'nan':''}).fillna('').str.strip()
+            df_procesado = df_procesado.assign(nipd=np.where(nipd == '', 'SIN_NIPD', nipd))
+            bodegas.append('nipd')
+
+    r = resumir_reparto(df_procesado, 'kgTotals',
+                        col_num='numPesada' if 'numPesada' in df_procesado.columns else None,
+                        bodegas=bodegas)
+    if bodegas:
+        r['bodegas'] = r['bodegas'].sort_values(['nomCeller','total_kg_pgc'], ascending=[True, False])
+    if 'primer_numPesada_pgc' not in r['pgc'].columns:
+        r['pgc'].insert(4, 'primer_numPesada_pgc', np.nan)
+    return r
 
 
-def construir_hojas_salida(df_procesado: pd.DataFrame, resumen_cellers: pd.DataFrame, resumen_vartips: pd.DataFrame):
+def generar_resumenes(df_procesado: pd.DataFrame):
+    # Resumen_Cellers, Resumen_VARTIPs y PGC_Resumen_VARTIP. df_procesado en el orden
+    # del reparto (VARTIP + numPesada), como lo devuelven controlar_rendimientos*.
+    r = _resumir_rvc(df_procesado)
+    return r['bodegas'], r['vartips'], r['pgc']
+
+
+def construir_hojas_salida(df_procesado: pd.DataFrame, resumen_cellers: pd.DataFrame, resumen_vartips: pd.DataFrame,
+                           pgc_resumen_vartip: pd.DataFrame = None):
+    # pgc_resumen_vartip: el de generar_resumenes; si no se pasa, se calcula aquí
+    # Orden (VARTIP, numPesada) calculado una vez y reutilizado en todas las hojas de detalle
+    if 'numPesada' in df_procesado.columns:
+        orden = orden_pesadas(df_procesado, _rango_pesada(df_procesado))
+    else:
+        orden = None
+    # El rango de numPesada es interno: no va a las hojas
+    df_procesado = df_procesado.drop(columns=['rango_numPesada'], errors='ignore')
+
     # VARTIP_Detalle
-    df_det = df_procesado.copy()
+    df_det = df_procesado
     if 'kgTotals' in df_det.columns:
         df_det = df_det.rename(columns={'kgTotals':'kg', 'estado_vartip':'estado'})
-    if 'numPesada' in df_det.columns:
-        df_det['_ord'] = df_det['numPesada'].apply(ordenar_num_pesada_key)
-        df_det = df_det.sort_values(['vartip','_ord']).drop(columns=['_ord']).reset_index(drop=True)
+    if orden is not None:
+        df_det = df_det.iloc[orden].reset_index(drop=True)
     else:
         df_det = df_det.sort_values(['vartip']).reset_index(drop=True)
-    df_det['acumulado_nif'] = df_det.groupby('vartip')['kg'].cumsum()
+    df_det['acumulado_nif'] = df_det.groupby('vartip', observed=True)['kg'].cumsum()
     cols_vartip_det = [
         'vartip', 'varietatDesc', 'nipd', 'nomLliurador', 'nifLliurador',
         'rendimiento', 'dataPesada', 'numPesada', 'nomCeller', 'origenParcella', 'RefParcela_norm',
         'kg', 'acumulado_nif', 'kg_cava', 'kg_pgc', 'estado', 'motiuPesadaIncidental', 'tiquetBascula'
     ]
     cols_vartip_det = [c for c in cols_vartip_det if c in df_det.columns]
-    df_vartip_detalle = df_det[cols_vartip_det].copy()
+    df_vartip_detalle = df_det[cols_vartip_det]
 
     # Pesadas con PGC
-    df_con_pgc = df_procesado[df_procesado['kg_pgc'] > 0].copy()
+    con_pgc = (df_procesado['kg_pgc'] > 0).to_numpy()
+    df_con_pgc = df_procesado[con_pgc]
     cols_pgc_por_vt = ['vartip','nomCeller','numPesada','kgTotals','kg_cava','kg_pgc','acumulado_antes','acumulado_despues','estado_vartip','origenParcella','RefParcela_norm','motiuPesadaIncidental','tiquetBascula']
     cols_pgc_por_vt = [c for c in cols_pgc_por_vt if c in df_con_pgc.columns]
-    df_pgc_por_vartip = df_con_pgc[cols_pgc_por_vt].copy()
-    if 'numPesada' in df_pgc_por_vartip.columns:
-        df_pgc_por_vartip['_ord'] = df_pgc_por_vartip['numPesada'].apply(ordenar_num_pesada_key)
-        df_pgc_por_vartip = df_pgc_por_vartip.sort_values(['vartip','_ord']).drop(columns=['_ord']).reset_index(drop=True)
+    if orden is not None:
+        df_pgc_por_vartip = df_procesado[cols_pgc_por_vt].iloc[orden[con_pgc[orden]]].reset_index(drop=True)
+    else:
+        df_pgc_por_vartip = df_con_pgc[cols_pgc_por_vt]
 
     # PGC por NIPD (para comunicación con bodegas)
     desired_cols = ['nomCeller','nipd','nifLliurador','varietatDesc','dataPesada','origenParcella','numPesada','tiquetBascula','kg_pgc']
     cols_exist_nipd = [c for c in desired_cols if c in df_con_pgc.columns]
-    df_pgc_por_nipd = df_con_pgc[cols_exist_nipd].copy()
+    df_pgc_por_nipd = df_con_pgc[cols_exist_nipd]
     for c in desired_cols:
         if c not in df_pgc_por_nipd.columns:
             df_pgc_por_nipd[c] = np.nan
     df_pgc_por_nipd = df_pgc_por_nipd[desired_cols].sort_values(['nomCeller','nipd','dataPesada','numPesada']).reset_index(drop=True)
 
-    # Resumen desde primera PGC
-    df_ord = df_procesado.copy()
-    if 'numPesada' in df_ord.columns:
-        df_ord['_ord'] = df_ord['numPesada'].apply(ordenar_num_pesada_key)
-        df_ord = df_ord.sort_values(['vartip','_ord']).reset_index(drop=True)
-    else:
-        df_ord = df_ord.sort_values(['vartip']).reset_index(drop=True)
-    df_ord['pos'] = df_ord.groupby('vartip').cumcount() + 1
-
-    primer_pgc_pos = (df_ord[df_ord['kg_pgc']>0].groupby('vartip', as_index=False)
-                      .agg(primer_pgc_pos=('pos','min')))
-    if 'numPesada' in df_ord.columns:
-        primer_pgc_num = (df_ord[df_ord['kg_pgc']>0].groupby('vartip', as_index=False)
-                          .agg(primer_numPesada_pgc=('numPesada','first')))
-        primer_pgc = primer_pgc_pos.merge(primer_pgc_num, on='vartip', how='left')
-    else:
-        primer_pgc = primer_pgc_pos.copy(); primer_pgc['primer_numPesada_pgc'] = np.nan
-
-    pgc_counts = (df_con_pgc.groupby('vartip', as_index=False)
-                  .agg(n_pesadas_pgc=('kg_pgc','count'),
-                       kg_pgc_total=('kg_pgc','sum')))
-
-    df_join = df_ord.merge(primer_pgc[['vartip','primer_pgc_pos']], on='vartip', how='left')
-    df_join['desde_primer_pgc'] = (df_join['pos'] >= df_join['primer_pgc_pos'])
-    post_counts = (df_join[df_join['desde_primer_pgc']]
-                   .groupby('vartip', as_index=False)
-                   .agg(n_pesadas_desde_primer_pgc=('pos','count')))
-
-    pgc_resumen_vartip = (pgc_counts
-                          .merge(primer_pgc, on='vartip', how='left')
-                          .merge(post_counts, on='vartip', how='left')
-                          .sort_values('kg_pgc_total', ascending=False))
+    # Resumen desde primera PGC (en el orden VARTIP + numPesada)
+    if pgc_resumen_vartip is None:
+        if orden is not None:
+            df_ord = df_procesado.iloc[orden]
+        else:
+            df_ord = df_procesado.sort_values(['vartip'])
+        pgc_resumen_vartip = _resumir_rvc(df_ord)['pgc']
 
     hojas = {
         'VARTIP_Detalle': df_vartip_detalle,
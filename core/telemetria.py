@@ -0,0 +1,201 @@
+# core/telemetria.py
+# ============================================================
+# Telemetría por etapa: tiempo, CPU, memoria y filas
+# - medir(nombre, entrada) mide un bloque dentro de registrar();
+#   fuera de un registro no mide nada.
+# - Pipeline.ejecutar mide cada etapa que ejecuta. Dentro de las
+#   etapas de lectura se separa la lectura del libro (openpyxl /
+#   CSV) de la normalización (procesar_*): "parcelas/lectura",
+#   "parcelas/normalizacion".
+# - Memoria: pico de tracemalloc por encima de lo asignado al
+#   empezar el bloque (objetos de Python y buffers de numpy; los
+#   de Arrow no se trazan). tracemalloc es global al proceso: con
+#   varias sesiones midiendo a la vez, los picos se suman.
+#   Solo con PGC_TELEMETRIA_MEMORIA=1: tracemalloc multiplica por
+#   4-5 el tiempo de lectura con openpyxl (y falsea los tiempos).
+# - informe() / a_json(): lo que se guarda junto al Excel para
+#   comparar campañas (y entorno(), también en benchmarks).
+# ============================================================
+
+from __future__ import annotations
+import contextvars
+import json
+import os
+import platform
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+COLUMNAS = {
+    'etapa': 'Etapa',
+    'segundos': 'Tiempo (s)',
+    'cpu_s': 'CPU (s)',
+    'memoria_pico_mb': 'Pico memoria (MB)',
+    'filas_entrada': 'Filas entrada',
+    'filas_salida': 'Filas salida',
+}
+
+
+@dataclass
+class Medida:
+    etapa: str
+    nivel: int = 0
+    segundos: float = 0.0
+    cpu_s: float = 0.0
+    memoria_pico_mb: Optional[float] = None
+    filas_entrada: Optional[int] = None
+    filas_salida: Optional[int] = None
+
+
+def filas(obj: Any) -> Optional[int]:
+    # Filas de una tabla, o suma de las de una tupla/dict de tablas (resúmenes, hojas); None si no es tabular
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return len(obj)
+    if isinstance(obj, dict):
+        obj = list(obj.values())
+    if isinstance(obj, (list, tuple)):
+        partes = [n for n in (filas(o) for o in obj) if n is not None]
+        return sum(partes) if partes else None
+    return None
+
+
+def memoria_activada() -> bool:
+    # Se lee en cada registro: el proceso por lotes la activa para sus hijos
+    return os.environ.get('PGC_TELEMETRIA_MEMORIA', '0') == '1'
+
+
+class Registro:
+    def __init__(self, memoria: bool = False):
+        self.medidas: List[Medida] = []
+        self.memoria = memoria
+        self._abiertas: List[str] = []
+        self._picos: List[int] = []  # pico absoluto visto en cada bloque abierto
+
+
+_registro: contextvars.ContextVar[Optional[Registro]] = contextvars.ContextVar('pgc_telemetria', default=None)
+# tracemalloc se arranca con el primer registro que mide memoria y se para con el último
+# (si no lo había arrancado otro)
+_trazas = 0
+_arrancada = False
+_trazas_lock = threading.Lock()
+
+
+@contextmanager
+def registrar(memoria: Optional[bool] = None) -> Iterator[Registro]:
+    registro = Registro(memoria_activada() if memoria is None else memoria)
+    global _trazas, _arrancada
+    if registro.memoria:
+        with _trazas_lock:
+            if _trazas == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _arrancada = True
+            _trazas += 1
+    token = _registro.set(registro)
+    try:
+        yield registro
+    finally:
+        _registro.reset(token)
+        if registro.memoria:
+            with _trazas_lock:
+                _trazas -= 1
+                if _trazas == 0 and _arrancada:
+                    tracemalloc.stop()
+                    _arrancada = False
+
+
+@contextmanager
+def medir(nombre: str, entrada: Any = None) -> Iterator[Optional[Medida]]:
+    """
+    Mide el bloque en el registro activo (None fuera de registrar()). Las
+    medidas anidadas se llaman "padre/nombre"; `medida.filas_salida` la pone
+    quien conoce la salida.
+    """
+    registro = _registro.get()
+    if registro is None:
+        yield None
+        return
+    medida = Medida('/'.join(registro._abiertas + [nombre]), nivel=len(registro._abiertas),
+                    filas_entrada=filas(entrada))
+    registro.medidas.append(medida)
+    memoria = registro.memoria and tracemalloc.is_tracing()
+    if memoria:
+        base, pico = tracemalloc.get_traced_memory()
+        if registro._picos:
+            registro._picos[-1] = max(registro._picos[-1], pico)
+        tracemalloc.reset_peak()
+        registro._picos.append(base)
+    registro._abiertas.append(nombre)
+    inicio, inicio_cpu = time.perf_counter(), time.process_time()
+    try:
+        yield medida
+    finally:
+        medida.segundos = round(time.perf_counter() - inicio, 4)
+        medida.cpu_s = round(time.process_time() - inicio_cpu, 4)
+        registro._abiertas.pop()
+        if memoria:
+            pico = max(registro._picos.pop(), tracemalloc.get_traced_memory()[1])
+            if registro._picos:
+                registro._picos[-1] = max(registro._picos[-1], pico)
+            medida.memoria_pico_mb = round((pico - base) / 2 ** 20, 2)
+
+
+def medido(nombre: str, funcion, *args, **kwargs):
+    # funcion(*args, **kwargs) medida, con las filas de su primera entrada tabular y de su salida
+    entrada = next((a for a in args if filas(a) is not None), None)
+    with medir(nombre, entrada) as medida:
+        salida = funcion(*args, **kwargs)
+        if medida is not None:
+            medida.filas_salida = filas(salida)
+    return salida
+
+
+def combinar(anteriores: Iterable[Medida], nuevas: Iterable[Medida]) -> List[Medida]:
+    # Medidas de varias ejecuciones del mismo grafo: cada etapa (con sus sub-medidas) queda con la última
+    nuevas = list(nuevas)
+    etapas = {m.etapa.split('/')[0] for m in nuevas}
+    return [m for m in anteriores if m.etapa.split('/')[0] not in etapas] + nuevas
+
+
+def tabla(medidas: Iterable[Medida]) -> pd.DataFrame:
+    # Vista para la página: sub-medidas sangradas bajo su etapa; sin memoria si no se trazó
+    df = pd.DataFrame([asdict(m) for m in medidas], columns=['nivel', *COLUMNAS])
+    df['etapa'] = ['· ' * n + e.split('/')[-1] for n, e in zip(df['nivel'], df['etapa'])]
+    df['memoria_pico_mb'] = df['memoria_pico_mb'].astype('float64')
+    for col in ('filas_entrada', 'filas_salida'):
+        df[col] = df[col].astype('Int64')
+    if df['memoria_pico_mb'].isna().all():
+        df = df.drop(columns='memoria_pico_mb')
+    return df.drop(columns='nivel').rename(columns=COLUMNAS)
+
+
+def entorno() -> Dict[str, Any]:
+    # Versiones y máquina: dos informes solo son comparables con el mismo entorno
+    return {
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'nucleos': os.cpu_count(),
+    }
+
+
+def informe(medidas: Iterable[Medida], **contexto) -> Dict[str, Any]:
+    # contexto: flujo, parámetros... (lo que haga falta para comparar ejecuciones)
+    medidas = list(medidas)
+    return {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        **contexto,
+        'entorno': {**entorno(), 'memoria_trazada': any(m.memoria_pico_mb is not None for m in medidas)},
+        'total_s': round(sum(m.segundos for m in medidas if m.nivel == 0), 4),
+        'etapas': [asdict(m) for m in medidas],
+    }
+
+
+def a_json(medidas: Iterable[Medida], **contexto) -> bytes:
+    return json.dumps(informe(medidas, **contexto), ensure_ascii=False, indent=2, default=str).encode('utf-8')
@@ -0,0 +1,182 @@
+# core/trabajos.py
+# ============================================================
+# Cola local de trabajos en segundo plano (solo biblioteca estándar)
+# - Un pool de procesos acotado por proceso del servidor,
+#   compartido por todas las sesiones de Streamlit: dos análisis
+#   grandes a la vez no bloquean el hilo del script.
+# - Un trabajo = copia del grafo de etapas (core.pipeline) con lo
+#   que necesita; en el proceso hijo se ejecutan las etapas
+#   pendientes y se devuelven sus salidas y medidas (telemetría)
+#   para incorporar().
+# - Progreso real: etapas hechas / etapas pendientes, enviado por
+#   el hijo en una multiprocessing.Queue y leído en un hilo.
+# - Los trabajos viven en el módulo, no en la ejecución del
+#   script: un rerun de la página los vuelve a encontrar por id.
+#
+# PGC_TRABAJOS: procesos en paralelo (por defecto, 2).
+# PGC_TRABAJOS_COLA: trabajos admitidos a la vez (por defecto, 8).
+# ============================================================
+
+from __future__ import annotations
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .pipeline import Pipeline
+from .telemetria import Medida
+
+MAX_PROCESOS = int(os.environ.get('PGC_TRABAJOS', '2'))
+MAX_EN_COLA = int(os.environ.get('PGC_TRABAJOS_COLA', '8'))
+# Los terminados que nadie recoge (pestaña cerrada) se descartan pasado este tiempo
+CADUCIDAD_S = 3600
+
+ESTADOS = ('en_cola', 'ejecutando', 'terminado', 'error')
+
+# Cola de progreso en los procesos hijo (la pone _iniciar_hijo)
+_progreso_hijo = None
+
+
+@dataclass
+class Trabajo:
+    id: str
+    descripcion: str
+    estado: str = 'en_cola'
+    hechas: int = 0
+    total: int = 0
+    etapa: str = ''
+    error: str = ''
+    creado: float = field(default_factory=time.time)
+    fin: Optional[float] = None
+    futuro: Optional[Future] = field(default=None, repr=False)
+
+    @property
+    def progreso(self) -> float:
+        # 0..1; 1 al terminar (también si no había etapas pendientes)
+        if self.estado in ('terminado', 'error'):
+            return 1.0
+        return self.hechas / self.total if self.total else 0.0
+
+    @property
+    def activo(self) -> bool:
+        return self.estado in ('en_cola', 'ejecutando')
+
+
+def _iniciar_hijo(cola) -> None:
+    global _progreso_hijo
+    _progreso_hijo = cola
+
+
+def _ejecutar_en_hijo(id_trabajo: str, flujo: Pipeline, objetivos: Tuple[str, ...],
+                      forzar: Tuple[str, ...]) -> Tuple[List[Tuple[str, str, Any]], List[Medida]]:
+    pendientes = flujo.pendientes(objetivos, forzar)
+    hechas = [0]
+
+    def avisar(etapa: str) -> None:
+        _progreso_hijo.put((id_trabajo, hechas[0], len(pendientes), etapa))
+        hechas[0] += 1
+
+    _progreso_hijo.put((id_trabajo, 0, len(pendientes), ''))
+    flujo.ejecutar(objetivos, forzar, al_ejecutar=avisar)
+    return flujo.exportar(flujo.ejecutadas), flujo.medidas
+
+
+class ColaTrabajos:
+    def __init__(self, max_procesos: int = MAX_PROCESOS, max_en_cola: int = MAX_EN_COLA):
+        # 'spawn': no se duplica el servidor (hilos de Streamlit) en cada hijo
+        contexto = multiprocessing.get_context('spawn')
+        self.max_en_cola = max_en_cola
+        self._progreso = contexto.Queue()
+        self._pool = ProcessPoolExecutor(max_workers=max(1, max_procesos), mp_context=contexto,
+                                         initializer=_iniciar_hijo, initargs=(self._progreso,))
+        self._trabajos: Dict[str, Trabajo] = {}
+        self._lock = threading.Lock()
+        self._hilo = threading.Thread(target=self._escuchar, name='pgc-trabajos', daemon=True)
+        self._hilo.start()
+
+    def _escuchar(self) -> None:
+        while True:
+            mensaje = self._progreso.get()
+            if mensaje is None:
+                return
+            id_trabajo, hechas, total, etapa = mensaje
+            with self._lock:
+                trabajo = self._trabajos.get(id_trabajo)
+                if trabajo is not None and trabajo.activo:
+                    trabajo.estado, trabajo.hechas, trabajo.total, trabajo.etapa = 'ejecutando', hechas, total, etapa
+
+    def _terminado(self, id_trabajo: str, futuro: Future) -> None:
+        with self._lock:
+            trabajo = self._trabajos.get(id_trabajo)
+            if trabajo is None:
+                return
+            trabajo.fin = time.time()
+            if futuro.cancelled():
+                trabajo.estado, trabajo.error = 'error', 'Cancelado'
+            elif futuro.exception() is not None:
+                e = futuro.exception()
+                trabajo.estado, trabajo.error = 'error', f"{type(e).__name__}: {e}"
+            else:
+                trabajo.estado, trabajo.hechas = 'terminado', trabajo.total
+
+    def enviar(self, flujo: Pipeline, objetivos: Iterable[str], forzar: Iterable[str] = (),
+               descripcion: str = '') -> str:
+        """
+        Ejecuta `objetivos` de una copia de `flujo` en el pool y devuelve el id del
+        trabajo. Lo que devuelve recoger() se pasa a flujo.incorporar(*...).
+        """
+        objetivos, forzar = tuple(objetivos), tuple(forzar)
+        with self._lock:
+            ahora = time.time()
+            for t in [t for t in self._trabajos.values() if not t.activo and ahora - (t.fin or ahora) > CADUCIDAD_S]:
+                del self._trabajos[t.id]
+            if sum(t.activo for t in self._trabajos.values()) >= self.max_en_cola:
+                raise RuntimeError("Hay demasiados análisis en cola; inténtalo en unos minutos.")
+            trabajo = Trabajo(id=uuid.uuid4().hex, descripcion=descripcion)
+            self._trabajos[trabajo.id] = trabajo
+        trabajo.futuro = self._pool.submit(_ejecutar_en_hijo, trabajo.id, flujo.copia_para(objetivos),
+                                           objetivos, forzar)
+        trabajo.futuro.add_done_callback(lambda f, i=trabajo.id: self._terminado(i, f))
+        return trabajo.id
+
+    def estado(self, id_trabajo: Optional[str]) -> Optional[Trabajo]:
+        with self._lock:
+            return self._trabajos.get(id_trabajo) if id_trabajo else None
+
+    def recoger(self, id_trabajo: str) -> Tuple[List[Tuple[str, str, Any]], List[Medida]]:
+        # (salidas, medidas) de un trabajo terminado (relanza su error); el trabajo deja de estar en la cola
+        with self._lock:
+            trabajo = self._trabajos.pop(id_trabajo)
+        return trabajo.futuro.result()
+
+    def cancelar(self, id_trabajo: str) -> bool:
+        # Solo los que aún no han empezado
+        trabajo = self.estado(id_trabajo)
+        return trabajo is not None and trabajo.futuro.cancel()
+
+    def trabajos(self) -> List[Trabajo]:
+        with self._lock:
+            return list(self._trabajos.values())
+
+    def cerrar(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self._progreso.put(None)
+
+
+_cola: Optional[ColaTrabajos] = None
+_cola_lock = threading.Lock()
+
+
+def cola_trabajos() -> ColaTrabajos:
+    # Una cola por proceso del servidor, creada al primer uso
+    global _cola
+    with _cola_lock:
+        if _cola is None:
+            _cola = ColaTrabajos()
+            atexit.register(_cola.cerrar)
+        return _cola
@@ -2,9 +2,21 @@ import pandas as pd
 import numpy as np
 import re
 import unicodedata
-from typing import List, Optional, Tuple, Dict
+import warnings
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple, Dict
+from pandas.tseries.api import guess_datetime_format
 
 RENDIMIENTO_POR_HECTAREA_DEFAULT = 10500
+# Valores distintos recordados por cada función de normalización (entre ejecuciones)
+MEMO_NORMALIZACION = 200_000
+
+# Tipos en los que factorizar no junta valores que normalizan distinto (1, 1.0 y True sí se juntarían)
+_INFERIDOS_HOMOGENEOS = {'string', 'empty', 'integer', 'floating', 'boolean'}
+
+# Fechas: origen de los números de serie de Excel y textos distintos usados para detectar el formato
+ORIGEN_SERIAL_EXCEL = '1899-12-30'
+MUESTRA_FORMATO_FECHA = 50
 
 def strip_accents(s: str) -> str:
     if pd.isna(s):
@@ -40,6 +52,176 @@ def norm_refparcela(x) -> str:
     s = str(x).strip().upper().replace(" ", "")
     return s
 
+@lru_cache(maxsize=None)
+def _memo(funcion: Callable) -> Callable:
+    return lru_cache(maxsize=MEMO_NORMALIZACION, typed=True)(funcion)
+
+def normalizar(serie: pd.Series, funcion: Callable) -> pd.Series:
+    """
+    Igual que `serie.map(funcion)`, pero llamando a `funcion` una vez por valor
+    distinto (factorize + take) y recordando los resultados de llamadas anteriores.
+    """
+    memo = _memo(funcion)
+    if pd.api.types.infer_dtype(serie, skipna=True) not in _INFERIDOS_HOMOGENEOS:
+        return serie.map(memo)
+    codigos, distintos = pd.factorize(serie, use_na_sentinel=False)
+    normalizados = pd.Series(np.asarray(distintos, dtype=object)).map(memo)
+    return pd.Series(normalizados.array.take(codigos), index=serie.index, name=serie.name)
+
+def _anio_dia_mes(formato: str) -> bool:
+    # Con dayfirst, '2024-09-10' se deduce como %Y-%d-%m: ese orden no se usa, es ISO
+    y, d, m = (formato.find(c) for c in ('%Y', '%d', '%m'))
+    return 0 <= y < d < m
+
+def _formato_fecha(textos: pd.Series) -> Optional[str]:
+    # De los formatos que se deducen de la muestra (día primero), el que más textos interpreta
+    muestra = textos.head(MUESTRA_FORMATO_FECHA)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', UserWarning)  # ISO con dayfirst=True: se acepta igual
+        formatos = list(dict.fromkeys(f for f in (guess_datetime_format(t, dayfirst=True) for t in muestra)
+                                      if f and not _anio_dia_mes(f)))
+    if not formatos:
+        return None
+    return max(formatos, key=lambda f: pd.to_datetime(muestra, format=f, errors='coerce').notna().sum())
+
+def _fechas_sueltas(textos: pd.Series) -> pd.Series:
+    # ISO ('2024-09-16') como tal; el resto, formato por valor con día primero ('16-9-2024')
+    textos = textos.str.strip()
+    iso = textos.str.match(r'\d{4}-\d{1,2}-\d{1,2}').astype(bool)
+    fechas = pd.Series(pd.NaT, index=textos.index, dtype='datetime64[us]')
+    if iso.any():
+        fechas[iso] = pd.to_datetime(textos[iso], format='ISO8601', errors='coerce')
+    if (~iso).any():
+        fechas[~iso] = pd.to_datetime(textos[~iso], format='mixed', dayfirst=True, errors='coerce')
+    return fechas
+
+def a_fechas(serie: pd.Series) -> pd.Series:
+    """
+    Columna de fechas a datetime64 (día primero; lo no interpretable, NaT).
+
+    Fechas nativas de Excel pasan tal cual, los números se leen como número de
+    serie de Excel y los textos con el formato detectado en una muestra; los que
+    no encajan en ese formato se interpretan uno a uno. Cada valor distinto se
+    convierte una sola vez.
+    """
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        return pd.to_datetime(serie, unit='D', origin=ORIGEN_SERIAL_EXCEL, errors='coerce')
+
+    codigos, distintos = pd.factorize(serie)
+    distintos = pd.Series(np.asarray(distintos, dtype=object))
+    fechas = pd.Series(pd.NaT, index=distintos.index, dtype='datetime64[us]')
+    es_texto = distintos.map(lambda v: isinstance(v, str)).astype(bool)
+    es_num = distintos.map(lambda v: isinstance(v, (int, float, np.number)) and not isinstance(v, (bool, np.bool_))).astype(bool)
+    otros = ~(es_texto | es_num)
+    if es_texto.any():
+        textos = distintos[es_texto]
+        formato = _formato_fecha(textos)
+        if formato:
+            fechas[es_texto] = pd.to_datetime(textos, format=formato, errors='coerce')
+        # Textos en otro formato que el detectado (o sin formato detectable): uno a uno
+        resto = textos[fechas[es_texto].isna()]
+        if len(resto):
+            fechas[resto.index] = _fechas_sueltas(resto)
+    if es_num.any():
+        fechas[es_num] = pd.to_datetime(distintos[es_num].astype(float), unit='D', origin=ORIGEN_SERIAL_EXCEL, errors='coerce')
+    if otros.any():
+        fechas[otros] = pd.to_datetime(distintos[otros], errors='coerce')
+    return pd.Series(fechas.array.take(codigos, allow_fill=True), index=serie.index, name=serie.name)
+
+def _texto_a_numero(textos: pd.Series, miles: bool = False) -> pd.Series:
+    # '1.234,56', '1,234.56', '12,5', '1.234.567', '50 %' -> float. Los textos son los distintos de
+    # una columna: el separador decimal se decide por columna. Con un solo separador seguido de
+    # 3 cifras ('2.500', '9,000') manda el resto de la columna; si no dice nada, `miles` (por
+    # defecto decimal, como '12,5'). Con un 0 delante ('0,350') siempre es decimal.
+    t = textos.str.replace("[\\s\u00a0'%]", '', regex=True)
+    coma, punto = t.str.rfind(','), t.str.rfind('.')
+    ambos = (coma >= 0) & (punto >= 0)
+    solo_coma = (coma >= 0) & (punto < 0)
+    solo_punto = (punto >= 0) & (coma < 0)
+    miles_coma = solo_coma & t.str.fullmatch(r'[+-]?\d{1,3}(,\d{3}){2,}')
+    miles_punto = solo_punto & t.str.fullmatch(r'[+-]?\d{1,3}(\.\d{3}){2,}')
+    dudoso_coma = solo_coma & t.str.fullmatch(r'[+-]?[1-9]\d{0,2},\d{3}')
+    dudoso_punto = solo_punto & t.str.fullmatch(r'[+-]?[1-9]\d{0,2}\.\d{3}')
+    decimal_coma = int(((ambos & (coma > punto)) | miles_punto | (solo_coma & ~miles_coma & ~dudoso_coma)).sum())
+    decimal_punto = int(((ambos & (punto > coma)) | miles_coma | (solo_punto & ~miles_punto & ~dudoso_punto)).sum())
+    if decimal_coma == decimal_punto:
+        miles_coma = miles_coma | (dudoso_coma & miles)
+        miles_punto = miles_punto | (dudoso_punto & miles)
+    else:
+        miles_coma = miles_coma | (dudoso_coma & (decimal_coma < decimal_punto))
+        miles_punto = miles_punto | (dudoso_punto & (decimal_punto < decimal_coma))
+    t = t.mask(ambos & (coma > punto), t.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    t = t.mask(ambos & (punto > coma), t.str.replace(',', '', regex=False))
+    t = t.mask(miles_coma, t.str.replace(',', '', regex=False))
+    t = t.mask(solo_coma & ~miles_coma, t.str.replace(',', '.', regex=False))
+    t = t.mask(miles_punto, t.str.replace('.', '', regex=False))
+    return pd.to_numeric(t.where(t != ''), errors='coerce')
+
+def a_numero(serie: pd.Series, miles: bool = False) -> pd.Series:
+    """
+    Columna numérica aceptando números de Excel y textos con separadores de miles y
+    decimales en español/catalán o inglés y signo '%'. Cada texto distinto se
+    interpreta una vez. Lo no interpretable queda NaN y se cuenta en
+    `attrs['no_numericos']` (los vacíos no cuentan).
+
+    Un solo separador seguido de 3 cifras se decide con el resto de la columna; si
+    no hay pistas, es de miles con `miles=True` (kg) y decimal si no (superficies):
+
+    >>> a_numero(pd.Series(['0,350', '1,250', '2,125'])).tolist()
+    [0.35, 1.25, 2.125]
+    >>> a_numero(pd.Series(['0.875', '1.250'])).tolist()
+    [0.875, 1.25]
+    >>> a_numero(pd.Series(['9,000', '12.500']), miles=True).tolist()
+    [9000.0, 12500.0]
+    >>> a_numero(pd.Series(['0,350']), miles=True).tolist()
+    [0.35]
+    >>> a_numero(pd.Series(['2.500', '1.234,5'])).tolist()
+    [2500.0, 1234.5]
+    """
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        # Ya numérica: se deja como está (entera sigue entera, como pd.to_numeric)
+        out = serie.copy(deep=False)
+        out.attrs['no_numericos'] = 0
+        return out
+    codigos, distintos = pd.factorize(serie)
+    if not len(distintos):
+        out = pd.Series(np.nan, index=serie.index, name=serie.name)
+        out.attrs['no_numericos'] = 0
+        return out
+    distintos = pd.Series(np.asarray(distintos, dtype=object))
+    es_texto = distintos.map(lambda v: isinstance(v, str)).astype(bool)
+    valores = pd.Series(np.nan, index=distintos.index)
+    vacio = pd.Series(False, index=distintos.index)
+    if (~es_texto).any():
+        # Números, fechas...: lo que no sea número queda NaN (to_numeric por valor no falla con tipos mezclados)
+        otros = distintos[~es_texto]
+        valores[~es_texto] = [v if isinstance(v, (int, float, np.number)) and not isinstance(v, (bool, np.bool_))
+                              else np.nan for v in otros]
+    if es_texto.any():
+        textos = distintos[es_texto].astype(str)
+        valores[es_texto] = _texto_a_numero(textos, miles).astype(float)
+        vacio[es_texto] = (textos.str.strip() == '').to_numpy()
+    fallo = (valores.isna() & ~vacio).to_numpy()
+    valores = valores.to_numpy()
+    out = pd.Series(np.where(codigos >= 0, valores[codigos], np.nan), index=serie.index, name=serie.name)
+    out.attrs['no_numericos'] = int(np.count_nonzero((codigos >= 0) & fallo[codigos]))
+    return out
+
+def columna_numerica(df: pd.DataFrame, col: str, miles: bool = False) -> pd.Series:
+    # a_numero(df[col], miles) anotando en df.attrs['no_numericos'][col] los valores no interpretados
+    serie = a_numero(df[col], miles)
+    df.attrs.setdefault('no_numericos', {})[col] = serie.attrs.pop('no_numericos')
+    return serie
+
+def aviso_no_numericos(df: pd.DataFrame) -> str:
+    # Texto para la interfaz con las columnas que tenían valores no numéricos ('' si ninguna)
+    fallos = {c: n for c, n in df.attrs.get('no_numericos', {}).items() if n}
+    if not fallos:
+        return ''
+    return "Valores no numéricos tratados como vacíos: " + ", ".join(f"{c} ({n:,})" for c, n in fallos.items())
+
 def to_numeric_safe(x):
     if isinstance(x, str):
         x = x.replace(",", ".")
@@ -81,16 +263,45 @@ def ordenar_num_pesada_key(pesada_str):
     except:
         return (0, str(pesada_str))
 
+# Número de pesada: dígitos iniciales + letras de sufijo ('1234', '1234B')
+PATRON_NUM_PESADA = r'^(\d+)([A-Za-z]*)'
+
+def _claves_distintas(serie: pd.Series, patron: str):
+    # Códigos por fila + (número, sufijo) de cada texto distinto, con str.extract
+    codigos, textos = pd.factorize(normalizar(serie, str), use_na_sentinel=False)
+    textos = pd.Series(np.asarray(textos, dtype=object))
+    partes = textos.str.extract(patron)
+    num = pd.to_numeric(partes[0], errors='coerce').fillna(0).astype('int64').to_numpy()
+    suf = partes[1].fillna('').where(partes[0].notna(), textos).to_numpy(dtype=object)
+    return codigos, num, suf
+
+def claves_num_pesada(serie: pd.Series, patron: str = PATRON_NUM_PESADA) -> pd.DataFrame:
+    """
+    ordenar_num_pesada_key de toda la columna: 'ord_num' (número, 0 si no empieza
+    por dígitos) y 'ord_suf' (sufijo, o el texto entero si no hay número).
+    """
+    codigos, num, suf = _claves_distintas(serie, patron)
+    return pd.DataFrame({'ord_num': num[codigos], 'ord_suf': suf[codigos]}, index=serie.index)
+
+def rango_num_pesada(serie: pd.Series, patron: str = PATRON_NUM_PESADA) -> np.ndarray:
+    # Posición de cada fila en el orden de ordenar_num_pesada_key (iguales = mismo rango)
+    codigos, num, suf = _claves_distintas(serie, patron)
+    if not len(num):
+        return np.zeros(len(serie), dtype=np.int64)
+    cod_suf = pd.factorize(suf, sort=True)[0]
+    orden = np.lexsort((cod_suf, num))
+    cambia = np.r_[True, (np.diff(num[orden]) != 0) | (np.diff(cod_suf[orden]) != 0)]
+    rango = np.empty(len(num), dtype=np.int64)
+    rango[orden] = np.cumsum(cambia) - 1
+    return rango[codigos]
+
+def orden_pesadas(df: pd.DataFrame, rango: np.ndarray, grupo: str = 'vartip') -> np.ndarray:
+    # Permutación estable por (grupo, rango): como sort_values([grupo, clave]), nulos al final
+    codigos, distintos = pd.factorize(df[grupo], sort=True)
+    codigos[codigos < 0] = len(distintos)
+    return np.lexsort((rango, codigos))
+
 def crear_diccionario_variedades() -> Dict[str, str]:
-    base = {
-        'CHARDONNAY': 'CHB',
-        'GARNATXA NEGRA': 'GAN',
-        'MACABEU': 'MAB',
-        'MONASTRELL': 'MTN',
-        'PARELLADA': 'PAB',
-        'PINOT NOIR': 'PTN',
-        'SUBIRAT PARENT': 'SPB',
-        'TREPAT': 'TRN',
-        'XARELLO': 'XAB',
-    }
-    return { norm_variedad(k): v for k, v in base.items() }
+    # Nombre normalizado -> código, desde el catálogo compartido (core.variedades)
+    from .variedades import catalogo_variedades
+    return catalogo_variedades().diccionario()
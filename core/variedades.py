@@ -0,0 +1,117 @@
+# core/variedades.py
+# ============================================================
+# Catálogo de variedades (código VARTIP)
+# - Un único catálogo por proceso, compartido por Parcelas, RVC
+#   y Cavanet: mismo código para el mismo nombre en los dos flujos.
+# - Índice alias -> código precalculado (nombres normalizados y
+#   sin signos), en lugar de rehacer el diccionario por fila.
+# - Variedades y alias nuevos desde un JSON (PGC_VARIEDADES):
+#   {"XAB": ["XARELLO", "XAREL·LO", "PANSA BLANCA"], ...}
+#   Se relee cuando cambia el archivo (fecha o tamaño); su huella
+#   entra en la clave de la caché de entradas (core.cache).
+# - Nombres fuera del catálogo: tres primeras letras ('UNK' si vacío).
+# ============================================================
+
+from __future__ import annotations
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+import pandas as pd
+
+from .utils import norm_variedad, codigo_variedad_from_name, normalizar
+
+
+RUTA_VARIEDADES = os.environ.get('PGC_VARIEDADES', 'variedades.json')
+
+VARIEDADES_BASE: Dict[str, list] = {
+    'CHB': ['CHARDONNAY'],
+    'GAN': ['GARNATXA NEGRA', 'GARNACHA NEGRA', 'GARNACHA TINTA'],
+    'MAB': ['MACABEU', 'MACABEO', 'VIURA'],
+    'MTN': ['MONASTRELL', 'MATARO'],
+    'PAB': ['PARELLADA'],
+    'PTN': ['PINOT NOIR', 'PINOT-NOIR'],
+    'SPB': ['SUBIRAT PARENT', 'MALVASIA DE SITGES'],
+    'TRN': ['TREPAT'],
+    'XAB': ['XARELLO', 'XAREL·LO', 'XAREL.LO', 'XAREL-LO', 'PANSA BLANCA'],
+}
+
+
+def _sin_signos(nombre: str) -> str:
+    # 'XAREL LO', 'PINOT  NOIR.' -> solo letras y un espacio entre palabras
+    return re.sub(r"\s+", " ", re.sub(r"[^A-Z ]", " ", nombre)).strip()
+
+
+class CatalogoVariedades:
+    def __init__(self, variedades: Dict[str, Iterable[str]]):
+        self.variedades: Dict[str, list] = {}
+        self.indice: Dict[str, str] = {}
+        for cod, nombres in variedades.items():
+            self.agregar(cod, nombres)
+
+    def agregar(self, codigo: str, nombres: Iterable[str]) -> None:
+        # Un alias ya indexado pasa al último código que lo declara
+        codigo = str(codigo).strip().upper()
+        if isinstance(nombres, str):
+            nombres = [nombres]
+        for nombre in nombres:
+            base = norm_variedad(nombre)
+            self.variedades.setdefault(codigo, []).append(nombre)
+            self.indice[base] = codigo
+            self.indice[_sin_signos(base)] = codigo
+
+    @classmethod
+    def desde_archivo(cls, ruta: Optional[str] = None) -> 'CatalogoVariedades':
+        # Catálogo base ampliado con el JSON, si existe
+        catalogo = cls(VARIEDADES_BASE)
+        ruta = ruta or RUTA_VARIEDADES
+        if ruta and os.path.exists(ruta):
+            with open(ruta, 'r', encoding='utf-8') as f:
+                for cod, nombres in json.load(f).items():
+                    catalogo.agregar(cod, nombres)
+        return catalogo
+
+    def codigo(self, nombre) -> str:
+        base = norm_variedad(nombre)
+        cod = self.indice.get(base)
+        if cod is None:
+            base = _sin_signos(base)
+            cod = self.indice.get(base) or codigo_variedad_from_name(base)
+        return cod
+
+    def resolver(self, serie: pd.Series) -> pd.Series:
+        # Código de toda la columna: una búsqueda por nombre distinto
+        return normalizar(serie, self.codigo)
+
+    def diccionario(self) -> Dict[str, str]:
+        # nombre normalizado -> código (forma de crear_diccionario_variedades)
+        return dict(self.indice)
+
+    def huella(self) -> str:
+        return hashlib.sha1(json.dumps(self.variedades, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+# Ruta -> (fecha y tamaño del archivo al leerlo, catálogo)
+_catalogos: Dict[str, Tuple[Optional[Tuple[int, int]], CatalogoVariedades]] = {}
+_catalogos_lock = threading.Lock()
+
+
+def _firma_archivo(ruta: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(ruta)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def catalogo_variedades(ruta: Optional[str] = None) -> CatalogoVariedades:
+    ruta = ruta or RUTA_VARIEDADES
+    firma = _firma_archivo(ruta) if ruta else None
+    with _catalogos_lock:
+        guardado = _catalogos.get(ruta)
+        if guardado is None or guardado[0] != firma:
+            guardado = _catalogos[ruta] = (firma, CatalogoVariedades.desde_archivo(ruta))
+    return guardado[1]
@@ -0,0 +1,398 @@
+# core/xlsx.py
+# ============================================================
+# Escritura de libros xlsx en streaming (solo escritura)
+# - Mismas celdas que DataFrame.to_excel(engine='openpyxl',
+#   index=False): cabecera (con el estilo de la versión de pandas),
+#   NaN vacías, inf como texto, fechas con formato y '%.16g'.
+# - Cada hoja se vuelca a su XML por bloques de filas y se
+#   comprime por partes, sin árbol de celdas en memoria.
+# - Textos en una tabla de cadenas compartidas (sharedStrings),
+#   resuelta antes de serializar: las hojas son independientes y
+#   en libros grandes se serializan en paralelo (pool acotado).
+# - El zip se monta al final con las partes ya comprimidas.
+# ============================================================
+
+from __future__ import annotations
+import datetime as dt
+import multiprocessing as mp
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from xml.sax.saxutils import escape, quoteattr
+
+import numpy as np
+import pandas as pd
+from openpyxl.utils import get_column_letter
+
+FILAS_POR_BLOQUE = 10_000
+
+# Procesos para serializar hojas: un pool por servidor, compartido entre sesiones
+PROCESOS_EXPORTACION = int(os.environ.get('PGC_EXPORT_PROCESOS', max(1, min(4, (os.cpu_count() or 2) // 2))))
+# Por debajo de este nº de celdas no compensa arrancar/usar el pool
+CELDAS_MIN_PARALELO = 200_000
+
+FORMATO_FECHA_HORA = 'YYYY-MM-DD HH:MM:SS'
+FORMATO_FECHA = 'YYYY-MM-DD'
+
+# pandas < 3 escribe la cabecera en negrita, con bordes y centrada; pandas 3 sin formato
+CABECERA_CON_ESTILO = int(pd.__version__.split('.')[0]) < 3
+
+# Índices de cellXfs en styles.xml
+_XF_CABECERA, _XF_FECHA_HORA, _XF_FECHA, _XF_DURACION = 1, 2, 3, 4
+
+_CODIGOS_ERROR = ('#NULL!', '#DIV/0!', '#VALUE!', '#REF!', '#NAME?', '#NUM!', '#N/A')
+_CARACTERES_ILEGALES = re.compile(r'[\000-\010]|[\013-\014]|[\016-\037]')
+_ERROR_ZONA_HORARIA = (
+    "Excel does not support datetimes with timezones. "
+    "Please ensure that datetimes are timezone unaware before writing to Excel."
+)
+_EPOCH = dt.datetime(1899, 12, 30)
+_US_DIA = 86_400_000_000
+_DIAS_EPOCH_1970 = 25569
+
+_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+_NS_R = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_NS_PKG = 'http://schemas.openxmlformats.org/package/2006/relationships'
+_CT = 'application/vnd.openxmlformats-officedocument.spreadsheetml'
+
+
+class CadenasCompartidas:
+    """Tabla de textos del libro: cada texto distinto se guarda una vez."""
+
+    def __init__(self):
+        self.indices: Dict[str, int] = {}
+        self.total = 0
+
+    def indice(self, texto: str, veces: int = 1) -> int:
+        self.total += veces
+        i = self.indices.get(texto)
+        if i is None:
+            i = self.indices[texto] = len(self.indices)
+        return i
+
+    def xml(self) -> bytes:
+        partes = [f'<sst xmlns="{_NS}" count="{self.total}" uniqueCount="{len(self.indices)}">']
+        for texto in self.indices:
+            espacio = ' xml:space="preserve"' if texto != texto.strip() else ''
+            partes.append(f'<si><t{espacio}>{escape(texto)}</t></si>')
+        partes.append('</sst>')
+        return ''.join(partes).encode('utf-8')
+
+
+# ============================================================
+# Conversión de valores (mismas reglas que pandas + openpyxl)
+# ============================================================
+def _serial_excel(v) -> float:
+    if getattr(v, 'tzinfo', None) is not None:
+        raise ValueError(_ERROR_ZONA_HORARIA)
+    if not isinstance(v, dt.datetime):
+        v = dt.datetime.combine(v, dt.time())
+    dias = (v - _EPOCH).days
+    if 0 < dias <= 60:
+        dias -= 1
+    return dias + (v.hour * 3600 + v.minute * 60 + v.second + v.microsecond / 10**6) / 86400
+
+
+def _celda_texto(ref: str, texto: str, sst: CadenasCompartidas, estilo: str = '', veces: int = 1) -> str:
+    texto = _CARACTERES_ILEGALES.sub('', texto[:32767])
+    if len(texto) > 1 and texto.startswith('='):
+        return f'<c r="{ref}"{estilo}><f>{escape(texto[1:])}</f><v></v></c>'
+    if texto in _CODIGOS_ERROR:
+        return f'<c r="{ref}"{estilo} t="e"><v>{texto}</v></c>'
+    return f'<c r="{ref}"{estilo} t="s"><v>{sst.indice(texto, veces)}</v></c>'
+
+
+def _celda_objeto(ref: str, v, sst: CadenasCompartidas, estilo: str = '', veces: int = 1) -> str:
+    if v is None or (pd.api.types.is_scalar(v) and pd.isna(v)):
+        return ''
+    if isinstance(v, (bool, np.bool_)):
+        return f'<c r="{ref}"{estilo} t="b"><v>{int(v)}</v></c>'
+    if isinstance(v, (int, np.integer, Decimal)):
+        return f'<c r="{ref}"{estilo} t="n"><v>{"%.16g" % v}</v></c>'
+    if isinstance(v, (float, np.floating)):
+        if np.isinf(v):
+            return _celda_texto(ref, 'inf' if v > 0 else '-inf', sst, estilo, veces)
+        return f'<c r="{ref}"{estilo} t="n"><v>{"%.16g" % v}</v></c>'
+    if isinstance(v, dt.datetime):
+        return f'<c r="{ref}" s="{_XF_FECHA_HORA}" t="n"><v>{"%.16g" % _serial_excel(v)}</v></c>'
+    if isinstance(v, dt.date):
+        return f'<c r="{ref}" s="{_XF_FECHA}" t="n"><v>{"%.16g" % _serial_excel(v)}</v></c>'
+    if isinstance(v, dt.timedelta):
+        return f'<c r="{ref}" s="{_XF_DURACION}" t="n"><v>{"%.16g" % (v.total_seconds() / 86400)}</v></c>'
+    return _celda_texto(ref, str(v), sst, estilo, veces)
+
+
+# Tipos inferidos cuyos valores distintos se pueden factorizar sin mezclar celdas
+# (en 'mixed-integer' True y 1 caerían en el mismo código)
+_INFERIDOS_FACTORIZABLES = {
+    'string', 'empty', 'integer', 'floating', 'mixed-integer-float', 'decimal', 'boolean',
+    'datetime', 'datetime64', 'date', 'timedelta', 'timedelta64',
+}
+
+
+def _resto(celda: str) -> str:
+    # '<c r="" ...' -> '" ...' (la celda sin la referencia; '' si está vacía)
+    return celda[6:] if celda else ''
+
+
+def _plan_columna(serie: pd.Series, sst: CadenasCompartidas) -> tuple:
+    # Deja la columna lista para serializarla en otro proceso: arrays numéricos o, para
+    # texto/objetos, códigos + XML de cada valor distinto (índices de sst ya resueltos)
+    tipo = serie.dtype
+    if isinstance(tipo, np.dtype) and tipo.kind in 'iu':
+        return ('i', serie.to_numpy())
+    if isinstance(tipo, np.dtype) and tipo.kind == 'f':
+        v = serie.to_numpy()
+        pos, neg = int(np.isposinf(v).sum()), int(np.isneginf(v).sum())
+        return ('f', v,
+                _resto(_celda_texto('', 'inf', sst, veces=pos)) if pos else '',
+                _resto(_celda_texto('', '-inf', sst, veces=neg)) if neg else '')
+    if isinstance(tipo, np.dtype) and tipo.kind == 'b':
+        return ('b', serie.to_numpy())
+    if isinstance(tipo, np.dtype) and tipo.kind == 'M':
+        us = serie.to_numpy(dtype='datetime64[us]').astype('int64')
+        dias = us // _US_DIA + _DIAS_EPOCH_1970
+        resto = us % _US_DIA
+        dias = np.where((dias > 0) & (dias <= 60), dias - 1, dias)
+        serial = dias + ((resto // 10**6) + (resto % 10**6) / 10**6) / 86400
+        return ('M', serial, serie.isna().to_numpy())
+
+    if (isinstance(tipo, pd.CategoricalDtype)
+            and pd.api.types.infer_dtype(tipo.categories, skipna=True) in _INFERIDOS_FACTORIZABLES):
+        # Claves en category: se factorizan los códigos, sin volver a recorrer el texto
+        codigos, distintos = pd.factorize(serie)
+        distintos = np.asarray(distintos, dtype=object)
+        veces = np.bincount(codigos[codigos >= 0], minlength=len(distintos))
+    else:
+        valores = serie.to_numpy(dtype=object)
+        if pd.api.types.infer_dtype(valores, skipna=True) in _INFERIDOS_FACTORIZABLES:
+            codigos, distintos = pd.factorize(valores)
+            veces = np.bincount(codigos[codigos >= 0], minlength=len(distintos))
+        else:
+            codigos, distintos, veces = np.arange(len(valores)), valores, np.ones(len(valores), dtype=int)
+    restos = [_resto(_celda_objeto('', v, sst, veces=int(k))) for v, k in zip(distintos, veces)]
+    restos.append('')  # código -1 (NaN/None) -> celda vacía
+    return ('o', codigos, restos)
+
+
+def _celdas_plan(plan: tuple, refs: List[str], a: int, b: int) -> List[str]:
+    # XML de las celdas [a, b) de una columna ('' si la celda queda vacía)
+    clase = plan[0]
+    if clase == 'i':
+        return [f'<c r="{r}" t="n"><v>{"%.16g" % v}</v></c>' for r, v in zip(refs, plan[1][a:b].tolist())]
+    if clase == 'f':
+        _, v, inf, menos_inf = plan
+        return [
+            (f'<c r="{r}" t="n"><v>{"%.16g" % x}</v></c>' if x - x == 0
+             else '' if x != x else '<c r="' + r + (inf if x > 0 else menos_inf))
+            for r, x in zip(refs, v[a:b].tolist())
+        ]
+    if clase == 'b':
+        return [f'<c r="{r}" t="b"><v>{int(x)}</v></c>' for r, x in zip(refs, plan[1][a:b].tolist())]
+    if clase == 'M':
+        _, serial, nulo = plan
+        return [
+            '' if n else f'<c r="{r}" s="{_XF_FECHA_HORA}" t="n"><v>{"%.16g" % x}</v></c>'
+            for r, x, n in zip(refs, serial[a:b].tolist(), nulo[a:b].tolist())
+        ]
+    _, codigos, restos = plan
+    celdas = [restos[c] for c in codigos[a:b].tolist()]
+    return [('<c r="' + r + x) if x else '' for r, x in zip(refs, celdas)]
+
+
+# ============================================================
+# Hojas y libro
+# ============================================================
+def _tarea_hoja(df: pd.DataFrame, sst: CadenasCompartidas) -> tuple:
+    letras = [get_column_letter(j + 1) for j in range(df.shape[1])]
+    estilo = f' s="{_XF_CABECERA}"' if CABECERA_CON_ESTILO else ''
+    cabecera = ''.join(
+        _celda_objeto(f'{l}1', c, sst, estilo) or f'<c r="{l}1"{estilo}/>'
+        for l, c in zip(letras, df.columns)
+    )
+    planes = [_plan_columna(df.iloc[:, j], sst) for j in range(df.shape[1])]
+    return cabecera, letras, len(df), planes
+
+
+def _xml_hoja(cabecera: str, letras: List[str], n: int, planes: List[tuple],
+              filas_por_bloque: int = FILAS_POR_BLOQUE):
+    # Genera el XML de la hoja por trozos: cabecera y luego bloques de filas
+    ultima = f'{letras[-1]}{n + 1}' if letras else 'A1'
+    yield (f'<?xml version="1.0" encoding="UTF-8"?>\n<worksheet xmlns="{_NS}" xmlns:r="{_NS_R}">'
+           f'<dimension ref="A1:{ultima}"/><sheetData>')
+    if letras:
+        yield f'<row r="1">{cabecera}</row>'
+    for a in range(0, n, filas_por_bloque):
+        b = min(a + filas_por_bloque, n)
+        filas = [str(i + 2) for i in range(a, b)]
+        columnas = [_celdas_plan(plan, [l + f for f in filas], a, b) for l, plan in zip(letras, planes)]
+        if columnas:
+            yield ''.join(f'<row r="{f}">{"".join(c)}</row>' for f, c in zip(filas, zip(*columnas)))
+        else:
+            yield ''.join(f'<row r="{f}"/>' for f in filas)
+    yield '</sheetData></worksheet>'
+
+
+def _comprimir(trozos: Iterable) -> Tuple[bytes, int, int]:
+    # Deflate crudo (como ZIP_DEFLATED) + CRC32 y tamaño sin comprimir
+    z = zlib.compressobj(6, zlib.DEFLATED, -15)
+    partes, crc, tam = [], 0, 0
+    for t in trozos:
+        b = t.encode('utf-8') if isinstance(t, str) else t
+        crc = zlib.crc32(b, crc)
+        tam += len(b)
+        partes.append(z.compress(b))
+    partes.append(z.flush())
+    return b''.join(partes), crc, tam
+
+
+def _render_hoja(tarea: tuple) -> Tuple[bytes, int, int]:
+    return _comprimir(_xml_hoja(*tarea))
+
+
+def _xml_estilos() -> bytes:
+    return (
+        f'<?xml version="1.0" encoding="UTF-8"?>\n<styleSheet xmlns="{_NS}">'
+        f'<numFmts count="2"><numFmt numFmtId="164" formatCode="{FORMATO_FECHA_HORA}"/>'
+        f'<numFmt numFmtId="165" formatCode="{FORMATO_FECHA}"/></numFmts>'
+        '<fonts count="2"><font><sz val="11"/><name val="Calibri"/><family val="2"/></font>'
+        '<font><b val="1"/><sz val="11"/><name val="Calibri"/><family val="2"/></font></fonts>'
+        '<fills count="2"><fill><patternFill/></fill><fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="2"><border><left/><right/><top/><bottom/><diagonal/></border>'
+        '<border><left style="thin"/><right style="thin"/><top style="thin"/><bottom style="thin"/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="5"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="0" fontId="1" fillId="0" borderId="1" xfId="0" applyFont="1" applyBorder="1" applyAlignment="1">'
+        '<alignment horizontal="center" vertical="top"/></xf>'
+        '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+        '<xf numFmtId="1" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    ).encode('utf-8')
+
+
+def _xml_paquete(nombres: Sequence[str]) -> Dict[str, bytes]:
+    hojas = ''.join(f'<sheet name={quoteattr(n)} sheetId="{i}" r:id="rId{i}"/>' for i, n in enumerate(nombres, 1))
+    rels = ''.join(
+        f'<Relationship Id="rId{i}" Type="{_NS_R}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+        for i in range(1, len(nombres) + 1)
+    )
+    k = len(nombres)
+    rels += (f'<Relationship Id="rId{k + 1}" Type="{_NS_R}/styles" Target="styles.xml"/>'
+             f'<Relationship Id="rId{k + 2}" Type="{_NS_R}/sharedStrings" Target="sharedStrings.xml"/>')
+    tipos = ''.join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" ContentType="{_CT}.worksheet+xml"/>'
+        for i in range(1, k + 1)
+    )
+    cab = '<?xml version="1.0" encoding="UTF-8"?>\n'
+    return {
+        '[Content_Types].xml': (
+            f'{cab}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            f'<Override PartName="/xl/workbook.xml" ContentType="{_CT}.sheet.main+xml"/>'
+            f'<Override PartName="/xl/styles.xml" ContentType="{_CT}.styles+xml"/>'
+            f'<Override PartName="/xl/sharedStrings.xml" ContentType="{_CT}.sharedStrings+xml"/>'
+            f'{tipos}</Types>'
+        ).encode('utf-8'),
+        '_rels/.rels': (
+            f'{cab}<Relationships xmlns="{_NS_PKG}">'
+            f'<Relationship Id="rId1" Type="{_NS_R}/officeDocument" Target="xl/workbook.xml"/></Relationships>'
+        ).encode('utf-8'),
+        'xl/workbook.xml': (
+            f'{cab}<workbook xmlns="{_NS}" xmlns:r="{_NS_R}"><sheets>{hojas}</sheets></workbook>'
+        ).encode('utf-8'),
+        'xl/_rels/workbook.xml.rels': f'{cab}<Relationships xmlns="{_NS_PKG}">{rels}</Relationships>'.encode('utf-8'),
+        'xl/styles.xml': _xml_estilos(),
+    }
+
+
+def _zip(partes: List[Tuple[str, bytes, int, int]]) -> bytes:
+    # Contenedor zip con partes ya comprimidas (deflate): cabeceras locales, directorio central y fin
+    t = time.localtime()
+    hora = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    fecha = ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    salida, central, offset = [], [], 0
+    for nombre, datos, crc, tam in partes:
+        n = nombre.encode('utf-8')
+        if max(len(datos), tam, offset) >= 0xFFFFFFFF:
+            raise ValueError(f"La parte {nombre} supera el tamaño máximo de un xlsx sin ZIP64.")
+        local = struct.pack('<IHHHHHIIIHH', 0x04034B50, 20, 0, 8, hora, fecha, crc, len(datos), tam, len(n), 0) + n
+        central.append(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014B50, 20, 20, 0, 8, hora, fecha,
+                                   crc, len(datos), tam, len(n), 0, 0, 0, 0, 0, offset) + n)
+        salida += [local, datos]
+        offset += len(local) + len(datos)
+    directorio = b''.join(central)
+    fin = struct.pack('<IHHHHIIH', 0x06054B50, 0, 0, len(partes), len(partes), len(directorio), offset, 0)
+    return b''.join(salida) + directorio + fin
+
+
+# ============================================================
+# Pool de procesos (uno por servidor, acotado)
+# ============================================================
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _pool_exportacion() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # 'spawn': el servidor Streamlit tiene hilos y fork no es seguro
+            _pool = ProcessPoolExecutor(max_workers=PROCESOS_EXPORTACION, mp_context=mp.get_context('spawn'))
+        return _pool
+
+
+def _descartar_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _render_en_pool(tareas: List[tuple]) -> List[Tuple[bytes, int, int]]:
+    # Las hojas grandes primero para repartir mejor la carga
+    pool = _pool_exportacion()
+    orden = sorted(range(len(tareas)), key=lambda i: -tareas[i][2] * max(len(tareas[i][1]), 1))
+    futuros = {i: pool.submit(_render_hoja, tareas[i]) for i in orden}
+    return [futuros[i].result() for i in range(len(tareas))]
+
+
+def escribir_libro(hojas: List[Tuple[str, pd.DataFrame]], paralelo: Optional[bool] = None) -> bytes:
+    """
+    Escribe las hojas (nombre, DataFrame) en un xlsx y devuelve los bytes.
+
+    Equivale a un pd.ExcelWriter(engine='openpyxl') con to_excel(index=False)
+    por hoja. Con `paralelo=None` las hojas se serializan en el pool de procesos
+    solo si el libro es grande (CELDAS_MIN_PARALELO) y hay más de una hoja.
+    """
+    sst = CadenasCompartidas()
+    tareas = [_tarea_hoja(df, sst) for _, df in hojas]
+    if paralelo is None:
+        paralelo = (PROCESOS_EXPORTACION > 1 and len(hojas) > 1
+                    and sum(df.size for _, df in hojas) >= CELDAS_MIN_PARALELO)
+
+    partes = None
+    if paralelo:
+        try:
+            partes = _render_en_pool(tareas)
+        except (BrokenProcessPool, OSError):
+            # Pool caído (proceso muerto, sin recursos...): se rehace en la próxima y esta vez en serie
+            _descartar_pool()
+    if partes is None:
+        partes = [_render_hoja(t) for t in tareas]
+
+    contenido = [(f'xl/worksheets/sheet{i}.xml', *p) for i, p in enumerate(partes, 1)]
+    contenido.append(('xl/sharedStrings.xml', *_comprimir([sst.xml()])))
+    for nombre, datos in _xml_paquete([n for n, _ in hojas]).items():
+        contenido.append((nombre, *_comprimir([datos])))
+    return _zip(contenido)
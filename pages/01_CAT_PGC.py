@@ -1,5 +1,4 @@
 import streamlit as st
-import pandas as pd
 from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode
 
 # Constante con fallback limpio (10500 si no se pudiera importar)
@@ -8,13 +7,13 @@ try:
 except Exception:
     RENDIMIENTO_POR_HECTAREA_DEFAULT = 10500
 
-from core.parcelas import procesar_parcelas, crear_dataframe_final
-from core.it04 import cargar_it04, construir_rendimiento_ajustado
-from core.rvc import (
-    procesar_rvc, crear_vartip_rvc, controlar_rendimientos,
-    generar_resumenes, construir_hojas_salida
-)
-from core.export import exportar_excel_parcelas, exportar_excel_rvc
+from core.lectura import columnas_extra
+from core.escenarios import escenarios_desde_texto, cupos_por_escenario, barrido_rendimiento_ha
+from core.flujos import flujo_rvc
+from core.trabajos import cola_trabajos
+from core import telemetria
+from core.categorias import a_texto
+from core.utils import aviso_no_numericos
 
 
 st.title("CAT PGC")
@@ -31,6 +30,43 @@ with st.sidebar:
         value=float(RENDIMIENTO_POR_HECTAREA_DEFAULT)
     )
     agrupar_ejercicio = st.checkbox("Agrupar Parcelas por ejercicio", value=True)
+    reparto_incremental = st.checkbox(
+        "Reparto incremental (entregas diarias)",
+        value=False,
+        help="Continúa el reparto guardado de la última ejecución con estas Parcelas y solo reparte las pesadas nuevas; el informe sigue siendo de toda la temporada."
+    )
+    extra = columnas_extra(st.text_input(
+        "Columnas adicionales a conservar",
+        value="",
+        help="Separadas por comas. Por defecto solo se leen las columnas que usa el proceso."
+    ))
+
+# Grafo de etapas de la sesión: cada etapa se repite solo si cambian sus entradas
+# (archivos, kg/ha, agrupación...); el resto se reutiliza de la ejecución anterior.
+flujo = st.session_state.setdefault("flujo_rvc", flujo_rvc())
+
+
+def _avisos():
+    # Valores no numéricos de las entradas leídas en esta ejecución
+    for etapa, nombre in (("parcelas", "Parcelas"), ("pesadas", "RVC")):
+        if etapa in flujo.ejecutadas and aviso_no_numericos(flujo.resultado(etapa)):
+            st.warning(f"{nombre}: {aviso_no_numericos(flujo.resultado(etapa))}")
+
+
+def _medidas():
+    # Telemetría de la sesión: cada etapa con su última ejecución (Parcelas, IT04 y RVC van por separado)
+    if flujo.medidas:
+        st.session_state["rvc_medidas"] = telemetria.combinar(st.session_state.get("rvc_medidas", []), flujo.medidas)
+
+
+def _seguir_etapas(barra, objetivos, textos):
+    # Progreso real de una ejecución en la página: etapas hechas / etapas pendientes
+    pendientes = flujo.pendientes(objetivos)
+    return lambda etapa: barra.progress(pendientes.index(etapa) / len(pendientes),
+                                        text=textos.get(etapa, "Procesando…"))
+
+
+flujo.actualizar(rendimiento_ha=float(rendimiento_ha), agrupar_por_ejercicio=bool(agrupar_ejercicio))
 
 # -----------------------------
 # 1) Parcelas
@@ -45,7 +81,7 @@ with col1:
         key="parcelas_upl"
     )
 with col2:
-    if "df_parcelas_clean" in st.session_state:
+    if flujo.tiene("parcelas"):
         st.success("Parcelas ya cargado desde sesión.")
     else:
         st.info("No hay Parcelas en sesión.")
@@ -56,54 +92,27 @@ if process_parcelas:
     if f_parcelas is None:
         st.error("Debe subir el archivo de Parcelas.")
     else:
-        progress_parc = st.progress(5, text="Iniciando procesamiento de Parcelas…")
-        # Igual que en Colab: detección de cabecera desplazada
-        xls = pd.ExcelFile(f_parcelas)
-        sheet_name = "Parcelas" if "Parcelas" in xls.sheet_names else xls.sheet_names[0]
-        progress_parc.progress(20, text="Leyendo hoja de Parcelas…")
-
-        # Primer intento: encabezados en la primera fila
-        dfp_try = xls.parse(sheet_name=sheet_name, nrows=10)
-        columnas_esperadas = [
-            'Ejercicio','RefParcela','NRegistro','NIF','Apellidos','Nombre',
-            'Variedad','Superficie','PorcentajeTitularidad','Estado','Segmento'
-        ]
-        # Normalizamos para comparar
-        from core.utils import norm_text
-        cols_norm = [norm_text(c) for c in dfp_try.columns]
-        esper_norm = [norm_text(c) for c in columnas_esperadas]
-        coincidencias = sum(1 for col in esper_norm if col in cols_norm)
-
-        progress_parc.progress(35, text="Analizando cabeceras…")
-        if coincidencias < 4:
-            # Cabecera en fila 7 (saltando metadata), igual que en Colab
-            dfp = xls.parse(sheet_name=sheet_name, skiprows=6)
-        else:
-            dfp = xls.parse(sheet_name=sheet_name)
-
-        progress_parc.progress(55, text="Procesando Parcelas…")
-        # Procesado y dataframe final
-        from core.parcelas import procesar_parcelas, crear_dataframe_final  # aseguramos la versión nueva
-        df_parcelas_clean = procesar_parcelas(dfp)
-
-        progress_parc.progress(75, text="Construyendo dataframe final…")
-        df_final = crear_dataframe_final(
-            df_parcelas_clean,
-            rendimiento_ha,
-            agrupar_por_ejercicio=agrupar_ejercicio
+        progress_parc = st.progress(0.0, text="Iniciando procesamiento de Parcelas…")
+        pasos = {
+            "parcelas": "Leyendo y procesando Parcelas…",
+            "hect": "Construyendo dataframe final…",
+            "excel_parcelas": "Generando Excel de Parcelas…",
+        }
+        # Igual que en Colab: cabecera en la fila 1 o desplazada a la fila 7 (metadata),
+        # detectada en la misma lectura del libro. Si el archivo ya se procesó, se lee de la caché.
+        flujo.actualizar(archivo_parcelas=f_parcelas.getvalue(), extra=extra)
+        salidas = flujo.ejecutar(
+            ["final", "excel_parcelas"],
+            al_ejecutar=_seguir_etapas(progress_parc, ["final", "excel_parcelas"], pasos)
         )
-
-        # Guardar en sesión
-        st.session_state["df_parcelas_clean"] = df_parcelas_clean
-        st.session_state["df_final"] = df_final
+        _avisos()
+        _medidas()
+        df_final = salidas["final"]
 
         # Export Parcels
-        from core.export import exportar_excel_parcelas
-        progress_parc.progress(90, text="Generando Excel de Parcelas…")
-        bin_parcelas = exportar_excel_parcelas(df_final, df_parcelas_clean)
         st.download_button(
             "Descargar dataframe_final.xlsx",
-            data=bin_parcelas,
+            data=salidas["excel_parcelas"],
             file_name="dataframe_final.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
         )
@@ -112,9 +121,10 @@ if process_parcelas:
         # Preview
         from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode
         st.markdown("**Vista rápida de `dataframe_final`**")
-        gob = GridOptionsBuilder.from_dataframe(df_final)
+        vista = a_texto(df_final)
+        gob = GridOptionsBuilder.from_dataframe(vista)
         gob.configure_default_column(resizable=True, filter=True, sortable=True)
-        AgGrid(df_final, gridOptions=gob.build(),
+        AgGrid(vista, gridOptions=gob.build(),
                update_mode=GridUpdateMode.NO_UPDATE, height=300)
 
 
@@ -133,38 +143,32 @@ with col3:
         key="it04_upl"
     )
 with col4:
-    if "df_rend_ajustado" in st.session_state:
+    if flujo.tiene("rend_ajustado"):
         st.success("Ajustes IT04 ya calculados.")
 
 apply_it04 = st.button("Aplicar ajustes IT04")
 
 if apply_it04:
-    if "df_final" not in st.session_state:
+    if not flujo.tiene("parcelas"):
         st.error("Debe procesar Parcelas antes de aplicar IT04.")
     else:
-        progress_it04 = st.progress(5, text="Preparando ajustes IT04…")
-        if f_it04 is None:
-            # Sin archivo it04: ajustes nulos
-            df_it04_aggr = pd.DataFrame(columns=["vartip", "kg_a_restar_total"])
-        else:
-            progress_it04.progress(25, text="Leyendo archivo IT04…")
-            if f_it04.name.lower().endswith(".csv"):
-                df_i = pd.read_csv(f_it04)
-            else:
-                df_i = pd.read_excel(f_it04)
-            df_it04_aggr = cargar_it04(df_i)
-        progress_it04.progress(65, text="Construyendo rendimiento ajustado…")
-        df_rend_ajustado = construir_rendimiento_ajustado(
-            st.session_state["df_final"],
-            df_it04_aggr
+        progress_it04 = st.progress(0.0, text="Preparando ajustes IT04…")
+        pasos = {"it04": "Leyendo archivo IT04…", "rend_ajustado": "Construyendo rendimiento ajustado…"}
+        # Sin archivo it04: ajustes nulos
+        flujo.actualizar(
+            archivo_it04=f_it04.getvalue() if f_it04 is not None else None,
+            it04_csv=f_it04 is not None and f_it04.name.lower().endswith(".csv")
         )
-        st.session_state["df_it04_aggr"] = df_it04_aggr
-        st.session_state["df_rend_ajustado"] = df_rend_ajustado
+        df_rend_ajustado = flujo.ejecutar(
+            ["rend_ajustado"], al_ejecutar=_seguir_etapas(progress_it04, ["rend_ajustado"], pasos)
+        )["rend_ajustado"]
+        _medidas()
 
         st.markdown("**Vista rápida de ajustes (IT04_Ajustes)**")
-        gob = GridOptionsBuilder.from_dataframe(df_rend_ajustado)
+        vista = a_texto(df_rend_ajustado)
+        gob = GridOptionsBuilder.from_dataframe(vista)
         gob.configure_default_column(resizable=True, filter=True, sortable=True)
-        AgGrid(df_rend_ajustado, gridOptions=gob.build(),
+        AgGrid(vista, gridOptions=gob.build(),
                update_mode=GridUpdateMode.NO_UPDATE, height=280)
         progress_it04.progress(100, text="Ajustes IT04 aplicados.")
 
@@ -182,89 +186,190 @@ f_rvc = st.file_uploader(
 )
 run_rvc = st.button("Ejecutar análisis RVC", type="primary")
 
+cola = cola_trabajos()
+_PASOS_RVC = {
+    "parcelas": "Leyendo y procesando Parcelas…",
+    "it04": "Leyendo archivo IT04…",
+    "pesadas": "Leyendo y limpiando RVC…",
+    "cruce": "Cruzando con Parcelas e IT04…",
+    "procesado": "Controlando rendimientos…",
+    "resumenes": "Generando resúmenes y hojas…",
+    "hojas": "Generando resúmenes y hojas…",
+    "excel": "Generando Excel de resultados…",
+}
+
+
+@st.fragment(run_every=1.0)
+def _seguir_trabajo():
+    # Progreso real del análisis en segundo plano; al terminar se recarga la página para recogerlo
+    trabajo = cola.estado(st.session_state.get("rvc_trabajo"))
+    if trabajo is None or not trabajo.activo:
+        st.rerun()
+    if trabajo.estado == "en_cola":
+        st.progress(0.0, text="En cola: esperando a que termine otro análisis…")
+    else:
+        texto = _PASOS_RVC.get(trabajo.etapa, "Analizando RVC…")
+        st.progress(trabajo.progreso, text=f"{texto} ({trabajo.hechas}/{trabajo.total} etapas)")
+
+
+trabajo = cola.estado(st.session_state.get("rvc_trabajo"))
 if run_rvc:
     # Precondiciones
-    if "df_parcelas_clean" not in st.session_state or "df_final" not in st.session_state:
+    if not flujo.tiene("parcelas"):
         st.error("Debe procesar Parcelas primero.")
+    elif f_rvc is None:
+        st.error("Debe subir un archivo RVC.")
+    elif trabajo is not None and trabajo.activo:
+        st.warning("Ya hay un análisis RVC en marcha en esta sesión.")
     else:
-        progress_rvc = st.progress(5, text="Iniciando análisis RVC…")
-        # IT04 opcional: si no hay, construimos sin ajuste
-        if "df_rend_ajustado" not in st.session_state:
-            df_rend_ajustado = construir_rendimiento_ajustado(
-                st.session_state["df_final"],
-                pd.DataFrame(columns=["vartip", "kg_a_restar_total"])
-            )
-            st.session_state["df_rend_ajustado"] = df_rend_ajustado
-
-        if f_rvc is None:
-            st.error("Debe subir un archivo RVC.")
-        else:
-            progress_rvc.progress(20, text="Leyendo archivo RVC…")
-            if f_rvc.name.lower().endswith(".csv"):
-                df_r = pd.read_csv(f_rvc)
-            else:
-                df_r = pd.read_excel(f_rvc)
-
-            progress_rvc.progress(40, text="Limpiando RVC…")
-            # Procesado RVC y cruce con Parcelas + IT04
-            df_rvc_clean = procesar_rvc(df_r)
-
-            progress_rvc.progress(60, text="Cruzando con Parcelas e IT04…")
-            df_rvc_con_rend = crear_vartip_rvc(
-                df_rvc_clean,
-                st.session_state["df_final"],
-                st.session_state["df_parcelas_clean"],
-                st.session_state["df_rend_ajustado"]
-            )
-            progress_rvc.progress(75, text="Controlando rendimientos…")
-            df_procesado = controlar_rendimientos(df_rvc_con_rend)
-
-            progress_rvc.progress(85, text="Generando resúmenes y hojas…")
-            resumen_cellers, resumen_vartips = generar_resumenes(df_procesado)
-            hojas = construir_hojas_salida(df_procesado, resumen_cellers, resumen_vartips)
-
-            # Guardar en sesión
-            st.session_state["df_rvc_clean"] = df_rvc_clean
-            st.session_state["df_procesado"] = df_procesado
-            st.session_state["resumen_cellers"] = resumen_cellers
-            st.session_state["resumen_vartips"] = resumen_vartips
-            st.session_state["hojas_rvc"] = hojas
-
-            progress_rvc.progress(92, text="Generando Excel de resultados…")
-            # Descarga Excel RVC
-            with st.spinner("Generando Excel de resultados…"):
-                bin_rvc = exportar_excel_rvc(
-                    hojas,
-                    df_rend_ajustado=st.session_state["df_rend_ajustado"],
-                    df_it04_aggr=st.session_state.get("df_it04_aggr")
-                )
-            st.download_button(
-                "Descargar analisis_pesadas_rvc_resultados.xlsx",
-                data=bin_rvc,
-                file_name="analisis_pesadas_rvc_resultados.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        # IT04 opcional: si no se aplicó, se construye sin ajuste
+        if "archivo_it04" not in flujo.valores:
+            flujo.actualizar(archivo_it04=None, it04_csv=False)
+        flujo.actualizar(
+            archivo_pesadas=f_rvc.getvalue(),
+            pesadas_csv=f_rvc.name.lower().endswith(".csv"),
+            extra=extra, incremental=bool(reparto_incremental)
+        )
+        # Procesado RVC (o el ya guardado en caché para este archivo), cruce, reparto y Excel
+        # en un proceso aparte (core.trabajos)
+        try:
+            st.session_state["rvc_trabajo"] = cola.enviar(
+                flujo, ["excel"], forzar=("procesado",) if reparto_incremental else (),
+                descripcion="RVC"
             )
+        except RuntimeError as e:
+            st.warning(str(e))
+        trabajo = cola.estado(st.session_state.get("rvc_trabajo"))
+
+if trabajo is not None and trabajo.activo:
+    _seguir_trabajo()
+
+elif trabajo is not None:
+    # Terminado (también si la página se recargó mientras tanto): se incorporan sus etapas
+    del st.session_state["rvc_trabajo"]
+    try:
+        flujo.incorporar(*cola.recoger(trabajo.id))
+    except Exception as e:
+        st.exception(e)
+    else:
+        _avisos()
+        _medidas()
+        if flujo.valores.get("incremental") and "procesado" in flujo.ejecutadas:
+            procesado = flujo.resultado("procesado")
+            repartidas = procesado.attrs.get("pesadas_repartidas", len(procesado))
+            st.info(f"Reparto incremental: {repartidas:,} de {len(procesado):,} pesadas repartidas en esta ejecución.")
+        resumen_cellers, resumen_vartips, _ = flujo.resultado("resumenes")
+        hojas = flujo.resultado("hojas")
+        bin_rvc = flujo.resultado("excel")
+        st.session_state["rvc_recalculado"] = False
+
+        # Descarga Excel RVC
+        st.download_button(
+            "Descargar analisis_pesadas_rvc_resultados.xlsx",
+            data=bin_rvc,
+            file_name="analisis_pesadas_rvc_resultados.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
 
-            # Vistas rápidas
-            st.markdown("**Resumen_Cellers**")
-            gob = GridOptionsBuilder.from_dataframe(resumen_cellers)
-            gob.configure_default_column(resizable=True, filter=True, sortable=True)
-            AgGrid(resumen_cellers, gridOptions=gob.build(),
-                   update_mode=GridUpdateMode.NO_UPDATE, height=260)
+        # Vistas rápidas
+        st.markdown("**Resumen_Cellers**")
+        vista = a_texto(resumen_cellers)
+        gob = GridOptionsBuilder.from_dataframe(vista)
+        gob.configure_default_column(resizable=True, filter=True, sortable=True)
+        AgGrid(vista, gridOptions=gob.build(),
+               update_mode=GridUpdateMode.NO_UPDATE, height=260)
+
+        st.markdown("**Resumen_VARTIPs**")
+        vista = a_texto(resumen_vartips)
+        gob = GridOptionsBuilder.from_dataframe(vista)
+        gob.configure_default_column(resizable=True, filter=True, sortable=True)
+        AgGrid(vista, gridOptions=gob.build(),
+               update_mode=GridUpdateMode.NO_UPDATE, height=260)
 
-            st.markdown("**Resumen_VARTIPs**")
-            gob = GridOptionsBuilder.from_dataframe(resumen_vartips)
-            gob.configure_default_column(resizable=True, filter=True, sortable=True)
-            AgGrid(resumen_vartips, gridOptions=gob.build(),
-                   update_mode=GridUpdateMode.NO_UPDATE, height=260)
+        st.markdown("**VARTIP_Detalle**")
+        df_vt = hojas["VARTIP_Detalle"]
+        vista = a_texto(df_vt)
+        gob = GridOptionsBuilder.from_dataframe(vista)
+        gob.configure_default_column(resizable=True, filter=True, sortable=True)
+        AgGrid(vista, gridOptions=gob.build(),
+               update_mode=GridUpdateMode.NO_UPDATE, height=420)
+
+        st.success(f"Análisis RVC completado en {trabajo.fin - trabajo.creado:,.1f} s.")
+
+elif flujo.tiene("procesado"):
+    # Si solo cambió kg/ha o agrupación se repiten hectáreas/reparto/hojas, sin releer Parcelas ni repetir cruces
+    if not reparto_incremental:
+        flujo.ejecutar(["hojas"], incremental=False)
+        _medidas()
+        if "procesado" in flujo.ejecutadas:
+            st.session_state["rvc_recalculado"] = True
+    if st.session_state.get("rvc_recalculado"):
+        st.info(f"Resultados RVC recalculados con {rendimiento_ha:,.0f} kg/ha (sin releer archivos).")
+        resumen_cellers, resumen_vartips, _ = flujo.resultado("resumenes")
+        st.markdown("**Resumen_Cellers**")
+        st.dataframe(a_texto(resumen_cellers), use_container_width=True, height=260)
+        st.markdown("**Resumen_VARTIPs**")
+        st.dataframe(a_texto(resumen_vartips), use_container_width=True, height=260)
+        if st.button("Generar Excel RVC"):
+            # También en segundo plano: al terminar se muestra con la descarga
+            try:
+                st.session_state["rvc_trabajo"] = cola.enviar(flujo, ["excel"], descripcion="Excel RVC")
+            except RuntimeError as e:
+                st.warning(str(e))
+            else:
+                st.rerun()
 
-            st.markdown("**VARTIP_Detalle**")
-            df_vt = hojas["VARTIP_Detalle"]
-            gob = GridOptionsBuilder.from_dataframe(df_vt)
-            gob.configure_default_column(resizable=True, filter=True, sortable=True)
-            AgGrid(df_vt, gridOptions=gob.build(),
-                   update_mode=GridUpdateMode.NO_UPDATE, height=420)
+if st.session_state.get("rvc_medidas"):
+    medidas = st.session_state["rvc_medidas"]
+    with st.expander("Telemetría por etapa (última ejecución de cada una)", expanded=False):
+        st.dataframe(telemetria.tabla(medidas), use_container_width=True, hide_index=True)
+        st.download_button(
+            "Descargar telemetria_rvc.json",
+            data=telemetria.a_json(medidas, flujo="rvc", **{k: flujo.valores.get(k) for k in (
+                "rendimiento_ha", "agrupar_por_ejercicio", "incremental")}),
+            file_name="telemetria_rvc.json",
+            mime="application/json"
+        )
 
-            progress_rvc.progress(100, text="Análisis RVC completado.")
 
+st.divider()
 
+# -----------------------------
+# 4) Escenarios kg/ha
+# -----------------------------
+st.subheader("4) Escenarios de rendimiento (kg/ha)")
+
+col5, col6 = st.columns([1, 1])
+with col5:
+    txt_escenarios = st.text_input("Valores kg/ha a comparar", value="9000, 10000, 10500, 11000, 12000")
+with col6:
+    txt_por_variedad = st.text_input("Escenario por variedad (opc.)", value="", placeholder="XAB=11000; MAB=9500")
+run_escenarios = st.button("Calcular escenarios")
+
+if run_escenarios:
+    try:
+        escenarios = escenarios_desde_texto(txt_escenarios, txt_por_variedad)
+    except ValueError as e:
+        escenarios = None
+        st.error(str(e))
+    if not flujo.tiene("procesado"):
+        st.error("Debe ejecutar el análisis RVC primero.")
+    elif escenarios:
+        cupos = cupos_por_escenario(
+            flujo.resultado("parcelas"),
+            escenarios,
+            flujo.resultado("it04"),
+            agrupar_por_ejercicio=agrupar_ejercicio,
+            rendimiento_ha_base=rendimiento_ha
+        )
+        tabla = barrido_rendimiento_ha(flujo.resultado("procesado"), cupos, 'kgTotals', ['nomCeller'])
+        st.markdown("**total_kg_pgc por escenario**")
+        st.dataframe(tabla.pivot_table(index='escenario', values='total_kg_pgc', aggfunc='sum', sort=False),
+                     use_container_width=True)
+        st.dataframe(a_texto(tabla), use_container_width=True, height=320)
+        st.download_button(
+            "Descargar escenarios_rvc.csv",
+            data=tabla.to_csv(index=False).encode("utf-8"),
+            file_name="escenarios_rvc.csv",
+            mime="text/csv"
+        )
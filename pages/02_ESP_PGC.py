@@ -4,17 +4,15 @@
 # ============================================================
 
 import streamlit as st
-import pandas as pd
-
-from core.cavanet import (
-    RENDIMIENTO_POR_HECTAREA_DEFAULT,
-    AGRUPAR_POR_EJERCICIO_DEFAULT,
-    cargar_parcelas_desde_excel, procesar_parcelas, crear_dataframe_final_parcelas,
-    cargar_it04_df, construir_rendimiento_ajustado,
-    cargar_cavanet_desde_excel, procesar_cavanet,
-    crear_vartip_cavanet, controlar_rendimientos_por_fecha,
-    generar_resumenes_cavanet, build_excel_bytes_cavanet,
-)
+
+from core.cavanet import RENDIMIENTO_POR_HECTAREA_DEFAULT, AGRUPAR_POR_EJERCICIO_DEFAULT
+from core.escenarios import escenarios_desde_texto, cupos_por_escenario, barrido_rendimiento_ha
+from core.flujos import flujo_cavanet
+from core.trabajos import cola_trabajos
+from core import telemetria
+from core.lectura import columnas_extra
+from core.categorias import a_texto
+from core.utils import aviso_no_numericos
 
 st.set_page_config(page_title="ESP PGC", layout="wide")
 st.title("ESP PGC")
@@ -34,6 +32,16 @@ with st.sidebar:
         "Agrupar por Ejercicio",
         value=AGRUPAR_POR_EJERCICIO_DEFAULT
     )
+    reparto_incremental = st.checkbox(
+        "Reparto incremental (entregas diarias)",
+        value=False,
+        help="Continúa el reparto guardado de la última ejecución con estas Parcelas y solo reparte las pesadas nuevas; el informe sigue siendo de toda la temporada."
+    )
+    extra = columnas_extra(st.text_input(
+        "Columnas adicionales a conservar",
+        value="",
+        help="Separadas por comas. Por defecto solo se leen las columnas que usa el proceso."
+    ))
 
 st.markdown("### 1) Subir archivos")
 col1, col2, col3 = st.columns(3)
@@ -46,79 +54,182 @@ with col3:
 
 procesar = st.button("Procesar CAVANET", type="primary")
 
+# Grafo de etapas de la sesión: cada etapa se repite solo si cambian sus entradas
+# (archivos, kg/ha, agrupación...); el resto se reutiliza de la ejecución anterior.
+flujo = st.session_state.setdefault("cav_flujo", flujo_cavanet())
+_PASOS = {
+    "parcelas": "Leyendo y procesando Parcelas…",
+    "hect": "Construyendo dataframe final de Parcelas…",
+    "it04": "Aplicando ajustes IT04 (si hay)…",
+    "pesadas": "Leyendo y limpiando Cavanet…",
+    "cruce": "Cruzando con Parcelas y reparto por VARTIP…",
+    "procesado": "Controlando rendimientos por fecha…",
+    "resumenes": "Generando resúmenes…",
+    "excel": "Generando Excel de resultados…",
+}
+
+
+def _avisos():
+    # Valores no numéricos de las entradas leídas en esta ejecución
+    for etapa, nombre in (("parcelas", "Parcelas"), ("pesadas", "Cavanet")):
+        if etapa in flujo.ejecutadas and aviso_no_numericos(flujo.resultado(etapa)):
+            st.warning(f"{nombre}: {aviso_no_numericos(flujo.resultado(etapa))}")
+
+
+def _medidas():
+    # Telemetría de la sesión: cada etapa con su última ejecución
+    if flujo.medidas:
+        st.session_state["cav_medidas"] = telemetria.combinar(st.session_state.get("cav_medidas", []), flujo.medidas)
+
+
+cola = cola_trabajos()
+
+
+@st.fragment(run_every=1.0)
+def _seguir_trabajo():
+    # Progreso real del análisis en segundo plano; al terminar se recarga la página para recogerlo
+    trabajo = cola.estado(st.session_state.get("cav_trabajo"))
+    if trabajo is None or not trabajo.activo:
+        st.rerun()
+    if trabajo.estado == "en_cola":
+        st.progress(0.0, text="En cola: esperando a que termine otro análisis…")
+    else:
+        texto = _PASOS.get(trabajo.etapa, "Procesando CAVANET…")
+        st.progress(trabajo.progreso, text=f"{texto} ({trabajo.hechas}/{trabajo.total} etapas)")
+
+
+trabajo = cola.estado(st.session_state.get("cav_trabajo"))
 if procesar:
     if not f_parcelas or not f_cavanet:
         st.error("Debes subir Parcelas y Cavanet.")
         st.stop()
-
-    try:
-        progress_cav = st.progress(5, text="Iniciando procesamiento CAVANET…")
-        # --- Parcelas ---
-        progress_cav.progress(20, text="Leyendo Parcelas…")
-        df_parcelas = cargar_parcelas_desde_excel(f_parcelas.read())
-        progress_cav.progress(35, text="Procesando Parcelas…")
-        df_parcelas_clean = procesar_parcelas(df_parcelas)
-        progress_cav.progress(50, text="Construyendo dataframe final de Parcelas…")
-        df_final = crear_dataframe_final_parcelas(
-            df_parcelas_clean,
-            rendimiento_por_ha=rendimiento_ha,
-            agrupar_por_ejercicio=agrupar_por_ejercicio
+    if trabajo is not None and trabajo.activo:
+        st.warning("Ya hay un análisis CAVANET en marcha en esta sesión.")
+    else:
+        # Lectura, cruces, reparto, resúmenes y Excel en un proceso aparte (core.trabajos)
+        flujo.actualizar(
+            archivo_parcelas=f_parcelas.getvalue(),
+            archivo_it04=f_it04.getvalue() if f_it04 else None,
+            archivo_pesadas=f_cavanet.getvalue(),
+            extra=extra, rendimiento_ha=float(rendimiento_ha),
+            agrupar_por_ejercicio=bool(agrupar_por_ejercicio), incremental=bool(reparto_incremental)
         )
-
+        try:
+            st.session_state["cav_trabajo"] = cola.enviar(
+                flujo, ["excel"], forzar=("procesado",) if reparto_incremental else (),
+                descripcion="CAVANET"
+            )
+        except RuntimeError as e:
+            st.warning(str(e))
+        trabajo = cola.estado(st.session_state.get("cav_trabajo"))
+
+if trabajo is not None and trabajo.activo:
+    _seguir_trabajo()
+
+elif trabajo is not None:
+    # Terminado (también si la página se recargó mientras tanto): se incorporan sus etapas
+    del st.session_state["cav_trabajo"]
+    try:
+        flujo.incorporar(*cola.recoger(trabajo.id))
+        _avisos()
+        _medidas()
+        df_final = flujo.resultado("final")
         st.success(f"Parcelas OK — VARTIPs: {df_final['vartip'].nunique():,}")
         with st.expander("Parcelas (resumen)", expanded=False):
-            st.dataframe(df_final.head(50), use_container_width=True)
-
-        # --- IT04 ---
-        progress_cav.progress(60, text="Aplicando ajustes IT04 (si hay)…")
-        df_it04_aggr = cargar_it04_df(f_it04.read()) if f_it04 else None
-        df_rend_ajustado, _ = construir_rendimiento_ajustado(df_final, df_it04_aggr)
-
-        # --- Cavanet ---
-        progress_cav.progress(70, text="Leyendo archivo Cavanet…")
-        df_cav = cargar_cavanet_desde_excel(f_cavanet.read())
-        progress_cav.progress(78, text="Limpiando Cavanet…")
-        df_cav_clean = procesar_cavanet(df_cav)
-
-        # Cruce y reparto
-        progress_cav.progress(86, text="Cruzando con Parcelas y reparto por VARTIP…")
-        df_cav_con_rend = crear_vartip_cavanet(df_cav_clean, df_final, df_parcelas_clean, df_rend_ajustado)
-        if df_cav_con_rend.empty:
+            st.dataframe(a_texto(df_final.head(50)), use_container_width=True)
+        if flujo.resultado("cruce").empty:
             st.warning("Tras los cruces (NIF + parcela + VARTIP) no quedan pesadas. Revisa normalizaciones y columnas.")
-            st.stop()
-
-        progress_cav.progress(90, text="Controlando rendimientos por fecha…")
-        df_procesado = controlar_rendimientos_por_fecha(df_cav_con_rend)
-        resumen_bodegas, resumen_vartips = generar_resumenes_cavanet(df_procesado)
-
-        st.markdown("### 2) Resultados")
-        tabs = st.tabs(["Pesadas procesadas", "Resumen bodegas", "Resumen VARTIPs"])
-        with tabs[0]:
-            st.dataframe(df_procesado.head(1000), use_container_width=True)
-        with tabs[1]:
-            st.dataframe(resumen_bodegas, use_container_width=True)
-        with tabs[2]:
-            st.dataframe(resumen_vartips, use_container_width=True)
-
-        # --- Excel de salida (incluye VARTIP_Detalle y VARTIP_Detalle_ticket) ---
-        progress_cav.progress(96, text="Generando Excel de resultados…")
-        xls_bytes = build_excel_bytes_cavanet(
-            df_procesado=df_procesado,
-            resumen_bodegas=resumen_bodegas,
-            resumen_vartips=resumen_vartips,
-            df_rend_ajustado=df_rend_ajustado,
-            df_it04_aggr=df_it04_aggr
-        )
+        if flujo.valores.get("incremental") and "procesado" in flujo.ejecutadas:
+            procesado = flujo.resultado("procesado")
+            repartidas = procesado.attrs.get("pesadas_repartidas", len(procesado))
+            st.info(f"Reparto incremental: {repartidas:,} de {len(procesado):,} pesadas repartidas en esta ejecución.")
+        st.session_state["cav_xls"] = flujo.resultado("excel")
+        st.success(f"Proceso completado en {trabajo.fin - trabajo.creado:,.1f} s.")
+    except Exception as e:
+        st.exception(e)
+
+elif flujo.tiene("procesado") and not reparto_incremental:
+    # Si solo cambió kg/ha o agrupación se repiten hectáreas/reparto/resúmenes, sin releer archivos ni repetir cruces
+    flujo.ejecutar(["resumenes"], rendimiento_ha=float(rendimiento_ha),
+                   agrupar_por_ejercicio=bool(agrupar_por_ejercicio), incremental=False)
+    _medidas()
+    if "procesado" in flujo.ejecutadas:
+        st.session_state["cav_xls"] = None
+        st.info(f"Resultados recalculados con {rendimiento_ha:,.0f} kg/ha (sin releer archivos).")
+
+if flujo.tiene("procesado"):
+    resumen_bodegas, resumen_vartips, _ = flujo.resultado("resumenes")
+    st.markdown("### 2) Resultados")
+    tabs = st.tabs(["Pesadas procesadas", "Resumen bodegas", "Resumen VARTIPs"])
+    with tabs[0]:
+        st.dataframe(a_texto(flujo.resultado("procesado").head(1000)), use_container_width=True)
+    with tabs[1]:
+        st.dataframe(a_texto(resumen_bodegas), use_container_width=True)
+    with tabs[2]:
+        st.dataframe(a_texto(resumen_vartips), use_container_width=True)
+
+    if st.session_state.get("cav_xls") is None and st.button("Generar Excel resultados",
+                                                            disabled=trabajo is not None and trabajo.activo):
+        # También en segundo plano: al terminar se muestra con la descarga
+        try:
+            st.session_state["cav_trabajo"] = cola.enviar(flujo, ["excel"], descripcion="Excel CAVANET")
+        except RuntimeError as e:
+            st.warning(str(e))
+        else:
+            st.rerun()
+    if st.session_state.get("cav_xls") is not None:
         st.download_button(
             "Descargar Excel resultados (CAVANET)",
-            data=xls_bytes,
+            data=st.session_state["cav_xls"],
             file_name="analisis_pesadas_cavanet_resultados.xlsx",
             mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
             use_container_width=True
         )
 
-        progress_cav.progress(100, text="Proceso completado.")
-        st.success("Proceso completado.")
-
-    except Exception as e:
-        st.exception(e)
+    if st.session_state.get("cav_medidas"):
+        medidas = st.session_state["cav_medidas"]
+        with st.expander("Telemetría por etapa (última ejecución de cada una)", expanded=False):
+            st.dataframe(telemetria.tabla(medidas), use_container_width=True, hide_index=True)
+            st.download_button(
+                "Descargar telemetria_cavanet.json",
+                data=telemetria.a_json(medidas, flujo="cavanet", **{k: flujo.valores.get(k) for k in (
+                    "rendimiento_ha", "agrupar_por_ejercicio", "incremental")}),
+                file_name="telemetria_cavanet.json",
+                mime="application/json",
+                use_container_width=True
+            )
+
+st.markdown("### 3) Escenarios de rendimiento (kg/ha)")
+col4, col5 = st.columns(2)
+with col4:
+    txt_escenarios = st.text_input("Valores kg/ha a comparar", value="9000, 10000, 10500, 11000, 12000")
+with col5:
+    txt_por_variedad = st.text_input("Escenario por variedad (opc.)", value="", placeholder="XAB=11000; MAB=9500")
+
+if st.button("Calcular escenarios"):
+    if not flujo.tiene("procesado"):
+        st.error("Procesa CAVANET primero.")
+        st.stop()
+    try:
+        escenarios = escenarios_desde_texto(txt_escenarios, txt_por_variedad)
+    except ValueError as e:
+        st.error(str(e))
+        st.stop()
+    cupos = cupos_por_escenario(
+        flujo.resultado("parcelas"),
+        escenarios,
+        flujo.resultado("it04"),
+        agrupar_por_ejercicio=agrupar_por_ejercicio,
+        rendimiento_ha_base=rendimiento_ha
+    )
+    tabla = barrido_rendimiento_ha(flujo.resultado("procesado"), cupos, 'kg', ['Bodega'])
+    st.dataframe(tabla.pivot_table(index='escenario', values='total_kg_pgc', aggfunc='sum', sort=False),
+                 use_container_width=True)
+    st.dataframe(a_texto(tabla), use_container_width=True, height=320)
+    st.download_button(
+        "Descargar escenarios_cavanet.csv",
+        data=tabla.to_csv(index=False).encode("utf-8"),
+        file_name="escenarios_cavanet.csv",
+        mime="text/csv",
+        use_container_width=True
+    )